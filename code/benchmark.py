@@ -0,0 +1,336 @@
+"""
+Benchmark suite - times the SDFs, the ray marching, the normals and whole renders on fixed stress scenes
+and reports the results as JSON, so the speed of two versions of the code can be compared.
+
+The scenes are generated from a seed (see STRESS_SCENES), so every run measures the same geometry.
+Every benchmark is repeated and the best time is reported, together with the rays per second and/or the
+SDF evaluations per second (one evaluation = the scene SDF of one point, see count_sdf_evaluations).
+
+usage (from the code directory):
+    python -m benchmark --out results.json
+    python -m benchmark --scenes single_primitive sphere_union --sizes 160x120 --workers 1 2 --backends process thread
+"""
+import csg
+import rotation
+import rendering
+import ray_marching
+import scene
+from render import parse_size
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+
+
+SDF_POINTS = 100000
+"""number of random points the SDF benchmarks evaluate in one batch"""
+
+CAST_RAY_PIXELS = (16,12)
+"""resolution of the grid of rays cast one by one in the cast_ray benchmark"""
+
+RENDER_SIZES = ((160,120),(320,240),(640,480))
+"""default resolutions of the render benchmark"""
+
+RENDER_WORKERS = (1,2,4)
+"""default worker counts of the render benchmark"""
+
+RENDER_BACKENDS = ("process",)
+"""default execution backends of the render benchmark (see rendering.BACKENDS)"""
+
+
+def random_rotation(rng):
+    """
+    Returns a random rotation as (rotation matrix, inverse rotation matrix) - see CSG_object_node.rotate
+    """
+    matrix,inverse = np.eye(3),np.eye(3)
+    for axis in "xyz":
+        angle = rng.uniform(0,2 * np.pi)
+        matrix = rotation.rotation_matrix(angle,axis) @ matrix
+        inverse = inverse @ rotation.rotation_matrix(angle,axis,inverse=True)
+    return matrix,inverse
+
+
+def single_primitive_scene(rng):
+    """one sphere in front of the camera"""
+    return {"sphere0": csg.CSG_object_node(csg.Sphere(1.5))}
+
+
+def difference_chain_scene(rng,length=32):
+    """
+    one box with length small spheres cut out of it one after another - a left-deep tree of difference nodes
+    (((box - sphere) - sphere) - ...) whose depth is length
+    """
+    node = csg.CSG_object_node(csg.Box(3,3,3))
+    for _ in range(length):
+        hole = csg.CSG_object_node(csg.Sphere(rng.uniform(0.2,0.5)))
+        hole.translate(rng.uniform(-1.5,1.5,3))
+        node = csg.CSG_difference(node,hole)
+    return {"combined-difference0": node}
+
+
+def sphere_union_scene(rng,count=256):
+    """
+    one object made of count spheres combined by union - the spheres are combined pairwise, so the tree is balanced
+    """
+    nodes = []
+    for _ in range(count):
+        sphere = csg.CSG_object_node(csg.Sphere(rng.uniform(0.1,0.3)))
+        sphere.translate(rng.uniform(-2,2,3))
+        nodes.append(sphere)
+    while len(nodes) > 1:
+        nodes = [csg.CSG_union(nodes[i],nodes[i + 1]) if i + 1 < len(nodes) else nodes[i] for i in range(0,len(nodes),2)]
+    return {"combined-union0": nodes[0]}
+
+
+def rotated_primitives_scene(rng,count=48):
+    """
+    count separate boxes and cylinders with random sizes, positions and rotations
+    """
+    objects = dict()
+    for i in range(count):
+        if i % 2 == 0:
+            node = csg.CSG_object_node(csg.Box(*rng.uniform(0.2,0.8,3)))
+            name = f"box{i}"
+        else:
+            node = csg.CSG_object_node(csg.Cylinder(rng.uniform(0.1,0.3),rng.uniform(0.4,1.2)))
+            name = f"cylinder{i}"
+        node.rotate(*random_rotation(rng))
+        node.translate(rng.uniform(-2.5,2.5,3))
+        objects[name] = node
+    return objects
+
+
+STRESS_SCENES = {
+    "single_primitive": single_primitive_scene,
+    "difference_chain": difference_chain_scene,
+    "sphere_union": sphere_union_scene,
+    "rotated_primitives": rotated_primitives_scene,
+}
+"""name -> function that builds the objects of the scene from a numpy random generator"""
+
+
+def stress_scene(name,seed=0):
+    """
+    Builds one of the STRESS_SCENES - the same seed always gives the same scene.
+
+    returns: (objects, camera, light_sources) - the same form as scene.load_scene
+    """
+    objects = STRESS_SCENES[name](np.random.default_rng(seed))
+    camera = scene.camera(np.array([0.0,0.0,-7.0]))
+    light_sources = {"white0": scene.Light_source(np.array([10.0,10.0,-10.0]),"white")}
+    return objects,camera,light_sources
+
+
+@contextlib.contextmanager
+def count_sdf_evaluations():
+    """
+    Counts the points evaluated by ray_marching.scene_sdf and ray_marching.scene_sdf_gradient inside of the with block
+    (the marching, the normals and the object ids all go through them). Works only in the current process.
+
+    yields: dictionary whose key "evaluations" holds the count
+    """
+    counter = {"evaluations": 0}
+    original_sdf = ray_marching.scene_sdf
+    original_gradient = ray_marching.scene_sdf_gradient
+
+    def counted_sdf(objects,p,with_ids=False,rays=None):
+        counter["evaluations"] += len(p) if np.ndim(p) > 1 else 1
+        return original_sdf(objects,p,with_ids,rays)
+
+    def counted_gradient(objects,p):
+        counter["evaluations"] += len(p)
+        return original_gradient(objects,p)
+
+    ray_marching.scene_sdf = counted_sdf
+    ray_marching.scene_sdf_gradient = counted_gradient
+    try:
+        yield counter
+    finally:
+        ray_marching.scene_sdf = original_sdf
+        ray_marching.scene_sdf_gradient = original_gradient
+
+
+def best_time(function,repeat):
+    """
+    Calls function repeat times and returns the shortest time of one call in seconds
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        best = min(best,time.perf_counter() - start_time)
+    return best
+
+
+def result(benchmark,scene_name,seconds,rays=None,evaluations=None,**details):
+    """
+    One entry of the report - the rates are calculated from the counts and the time
+    """
+    entry = {"benchmark": benchmark,"scene": scene_name,**details,"seconds": seconds}
+    if rays is not None:
+        entry["rays"] = int(rays)
+        entry["rays_per_s"] = rays / seconds
+    if evaluations is not None:
+        entry["sdf_evaluations"] = int(evaluations)
+        entry["sdf_evaluations_per_s"] = evaluations / seconds
+    return entry
+
+
+def random_points(rng,count=SDF_POINTS):
+    """random points in the cube [-3,3]^3 around the objects of the stress scenes"""
+    return rng.uniform(-3,3,(count,3))
+
+
+def pixel_grid(width,height):
+    """the (x,y) positions of all the pixels of the screen in row major order - numpy array of shape (width*height,2)"""
+    ys,xs = np.mgrid[0:height,0:width]
+    return np.stack([xs.ravel(),ys.ravel()],axis=-1)
+
+
+def benchmark_primitive_sdf(scene_name,objects,rng,repeat):
+    """Primitive.sdf of every primitive of the scene (at most 8 of them) on SDF_POINTS points"""
+    primitives = []
+    stack = list(objects.values())
+    while stack and len(primitives) < 8:
+        node = stack.pop()
+        if node.is_leaf():
+            primitives.append(node.primitive)
+        else:
+            stack += [node.left,node.right]
+    points = random_points(rng)
+
+    def run():
+        for primitive in primitives:
+            primitive.sdf(points)
+    seconds = best_time(run,repeat)
+    return [result("primitive_sdf",scene_name,seconds,evaluations=len(points) * len(primitives),primitives=len(primitives))]
+
+
+def benchmark_node_sdf(scene_name,objects,rng,repeat):
+    """CSG_object_node.sdf of the whole scene and the same SDF through the compiled tapes the renderer uses"""
+    points = random_points(rng)
+    nodes = list(objects.values())
+    tapes = rendering.prepare_objects(objects)
+    results = []
+    for benchmark,scene_objects in (("node_sdf",nodes),("tape_sdf",tapes)):
+        seconds = best_time(lambda: ray_marching.scene_sdf(scene_objects,points),repeat)
+        results.append(result(benchmark,scene_name,seconds,evaluations=len(points),objects=len(nodes)))
+    return results
+
+
+def benchmark_cast_ray(scene_name,objects,camera,repeat):
+    """cast_ray of every ray of a CAST_RAY_PIXELS grid one by one, and the same rays marched together by march_rays"""
+    width,height = CAST_RAY_PIXELS
+    prepared = rendering.prepare_objects(objects)
+    directions = rendering.camera_ray_directions(pixel_grid(width,height),width,height,camera)
+    origin = np.asarray(camera.position,dtype=float)
+
+    def cast_all():
+        for direction in directions:
+            ray_marching.cast_ray(prepared,origin,direction)
+
+    results = []
+    for benchmark,run in (("cast_ray",cast_all),("march_rays",lambda: ray_marching.march_rays(prepared,origin,directions))):
+        with count_sdf_evaluations() as counter:
+            run()
+        seconds = best_time(run,repeat)
+        results.append(result(benchmark,scene_name,seconds,rays=len(directions),evaluations=counter["evaluations"]))
+    return results
+
+
+def benchmark_get_normal(scene_name,objects,camera,repeat):
+    """get_normal of the hit points of a 320x240 frame with every method of NORMAL_METHODS"""
+    width,height = 320,240
+    prepared = rendering.prepare_objects(objects)
+    directions = rendering.camera_ray_directions(pixel_grid(width,height),width,height,camera)
+    marched = ray_marching.march_rays(prepared,camera.position,directions)
+    points = marched["point"][marched["hit"]]
+    if len(points) == 0:
+        return []
+
+    results = []
+    for method in rendering.NORMAL_METHODS:
+        run = lambda: rendering.get_normal(prepared,points,method=method)
+        with count_sdf_evaluations() as counter:
+            run()
+        seconds = best_time(run,repeat)
+        results.append(result("get_normal",scene_name,seconds,evaluations=counter["evaluations"],method=method,points=len(points)))
+    return results
+
+
+def benchmark_render(scene_name,objects,camera,light_sources,sizes,workers,backends,repeat):
+    """
+    render_frame of the whole scene at every resolution with every backend and every number of workers (the serial backend only once).
+    The SDF evaluations of a frame are counted once per resolution by rendering it in this process (see count_sdf_evaluations).
+    """
+    results = []
+    prepared = rendering.prepare_objects(objects)
+    for width,height in sizes:
+        with count_sdf_evaluations() as counter:
+            rendering.render_pixels(pixel_grid(width,height),width,height,prepared,camera,light_sources)
+        for backend in backends:
+            for processes in (workers if backend != "serial" else (1,)):
+                seconds = best_time(lambda: rendering.render_frame(width,height,prepared,camera,light_sources,rendering.Render_settings(processes=processes,backend=backend)),repeat)
+                results.append(result("render_frame",scene_name,seconds,rays=width * height,evaluations=counter["evaluations"],
+                                      size=f"{width}x{height}",workers=processes,backend=backend))
+    return results
+
+
+def run_benchmarks(scene_names,seed=0,sizes=RENDER_SIZES,workers=RENDER_WORKERS,backends=RENDER_BACKENDS,repeat=3,progress=None):
+    """
+    Runs all the benchmarks on the stress scenes.
+
+    scene_names: names of the STRESS_SCENES to use
+    seed: seed of the stress scenes and of the random points
+    sizes, workers, backends: resolutions, worker counts and execution backends of the render benchmark
+    repeat: number of repetitions of every benchmark - the best time is reported
+    progress: optional function called with a message before every scene
+
+    returns: the report - dictionary with the keys "environment", "parameters" and "results" (list of the entries, see result)
+    """
+    results = []
+    for scene_name in scene_names:
+        if progress is not None:
+            progress(f"benchmarking {scene_name}...")
+        objects,camera,light_sources = stress_scene(scene_name,seed)
+        rng = np.random.default_rng(seed)
+        results += benchmark_primitive_sdf(scene_name,objects,rng,repeat)
+        results += benchmark_node_sdf(scene_name,objects,rng,repeat)
+        results += benchmark_cast_ray(scene_name,objects,camera,repeat)
+        results += benchmark_get_normal(scene_name,objects,camera,repeat)
+        results += benchmark_render(scene_name,objects,camera,light_sources,sizes,workers,backends,repeat)
+
+    environment = {"python": platform.python_version(),"numpy": np.__version__,"platform": platform.platform(),"cpu_count": os.cpu_count(),"available_cores": rendering.available_cores()}
+    parameters = {"scenes": list(scene_names),"seed": seed,"sizes": [f"{width}x{height}" for width,height in sizes],
+                  "workers": list(workers),"backends": list(backends),"repeat": repeat}
+    return {"environment": environment,"parameters": parameters,"results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SDFs, the ray marching and the renderer on seeded stress scenes")
+    parser.add_argument("--out",help="path of the JSON report (default: print it)")
+    parser.add_argument("--scenes",nargs="+",choices=list(STRESS_SCENES),default=list(STRESS_SCENES),help="stress scenes to benchmark (default: all)")
+    parser.add_argument("--seed",type=int,default=0,help="seed of the stress scenes (default: 0)")
+    parser.add_argument("--sizes",nargs="+",type=parse_size,default=list(RENDER_SIZES),help="resolutions of the render benchmark (default: 160x120 320x240 640x480)")
+    parser.add_argument("--workers",nargs="+",type=int,default=list(RENDER_WORKERS),help="worker counts of the render benchmark (default: 1 2 4)")
+    parser.add_argument("--backends",nargs="+",choices=rendering.BACKENDS,default=list(RENDER_BACKENDS),help="execution backends of the render benchmark (default: process)")
+    parser.add_argument("--repeat",type=int,default=3,help="repetitions of every benchmark, the best time is reported (default: 3)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.scenes,args.seed,args.sizes,args.workers,args.backends,args.repeat,progress=lambda message: print(message,file=sys.stderr))
+    text = json.dumps(report,indent=2)
+    if args.out is None:
+        print(text)
+    else:
+        with open(args.out,"w") as file:
+            file.write(text)
+        print(f"Wrote {len(report['results'])} results -> {args.out}",file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
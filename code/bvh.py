@@ -0,0 +1,262 @@
+import csg
+
+import numpy as np
+
+LEAF_SIZE = 4
+"""maximum number of objects in a leaf of the BVH"""
+
+
+class BVH:
+    """
+    Bounding volume hierarchy over the objects of the scene - a binary tree of bounding spheres with at most LEAF_SIZE objects in every leaf.
+
+    The BVH has the same sdf method as the objects, so it can be used in place of the list of objects (ray_marching.scene_sdf([bvh],p)).
+    The SDF query descends only into the nodes whose bounding sphere is closer than the best distance found so far,
+    so for scenes with many separate objects only a few objects are evaluated for every point.
+
+    The nodes are stored in arrays, a parent always comes before its children.
+    """
+
+    items: list
+    """the objects in the leaves - anything with the methods sdf and bounding_sphere (CSG_object_node, CSG_tape)"""
+
+    centers: np.array
+    """np.array of shape (m,3) with the centers of the bounding spheres of the nodes"""
+
+    radii: np.array
+    """np.array of shape (m,) with the radii of the bounding spheres of the nodes"""
+
+    children: np.array
+    """np.array of shape (m,2) with the indices of the left and right child (-1 for leaves)"""
+
+    leaf_items: list
+    """list of m lists with the indices of the items in the leaves (empty for internal nodes)"""
+
+    item_spheres: list
+    """bounding spheres (center, radius) of the items"""
+
+    def __init__(self,items):
+        self.items = list(items)
+        self.build()
+
+    def build(self):
+        """
+        Builds the tree from scratch - used when objects are added or removed.
+        The objects are split recursively in half by the median of their centers along the axis with the largest spread.
+        """
+        spheres = [item.bounding_sphere() for item in self.items]
+        item_centers = np.array([center for center,_ in spheres],dtype=float).reshape(-1,3)
+
+        children,leaf_items = [],[]
+        if len(self.items) > 0:
+            # iterative construction - (node index, indices of the items in the node)
+            children.append([-1,-1])
+            leaf_items.append([])
+            stack = [(0,np.arange(len(self.items)))]
+            while stack:
+                node,indices = stack.pop()
+                if len(indices) <= LEAF_SIZE:
+                    leaf_items[node] = indices.tolist()
+                    continue
+
+                axis = np.argmax(np.ptp(item_centers[indices],axis=0))
+                indices = indices[np.argsort(item_centers[indices,axis],kind="stable")]
+                half = len(indices) // 2
+
+                for side,part in enumerate((indices[:half],indices[half:])):
+                    children.append([-1,-1])
+                    leaf_items.append([])
+                    children[node][side] = len(children) - 1
+                    stack.append((len(children) - 1,part))
+
+        self.children = np.array(children,dtype=np.int32).reshape(-1,2)
+        self.leaf_items = leaf_items
+        self.centers = np.zeros((len(children),3))
+        self.radii = np.zeros(len(children))
+        self.refit(spheres)
+
+    def refit(self,spheres=None):
+        """
+        Recomputes the bounding spheres of all the nodes without changing the structure of the tree
+        - used when objects are translated or rotated.
+
+        spheres: bounding spheres of the items, computed from the items if not given
+        """
+        if spheres is None:
+            spheres = [item.bounding_sphere() for item in self.items]
+        self.item_spheres = spheres
+
+        # children come after their parents so going backwards computes the children first
+        for node in range(len(self.radii) - 1,-1,-1):
+            if self.leaf_items[node]:
+                center,radius = spheres[self.leaf_items[node][0]]
+                for item in self.leaf_items[node][1:]:
+                    center,radius = csg.enclosing_sphere((center,radius),spheres[item])
+            else:
+                left,right = self.children[node]
+                center,radius = csg.enclosing_sphere((self.centers[left],self.radii[left]),(self.centers[right],self.radii[right]))
+            self.centers[node] = center
+            self.radii[node] = radius
+
+    def map_items(self,function):
+        """
+        Returns a BVH with the same tree whose items are function(item) - e.g. the compiled tapes of the CSG objects.
+        The new items must have the same bounding spheres as the old ones.
+        """
+        mapped = BVH.__new__(BVH)
+        mapped.items = [function(item) for item in self.items]
+        mapped.children = self.children
+        mapped.leaf_items = self.leaf_items
+        mapped.centers = self.centers.copy()
+        mapped.radii = self.radii.copy()
+        mapped.item_spheres = self.item_spheres
+        return mapped
+
+    def traverse(self,p:np.array,best:np.array,visit_leaf):
+        """
+        Visits the leaves of the BVH whose bounding sphere is closer to the points than the best distance found so far -
+        the traversal shared by sdf, sdf_ids and sdf_gradient.
+
+        p: a batch of points of shape (N,3)
+        best: array of shape (N,) with the best distances - lowered by visit_leaf
+        visit_leaf: function called with (leaf node, indices of the points that need it, the points) - it evaluates the items of the leaf
+                    and stores the distances that are smaller than best[indices] in best
+        """
+        if len(self.items) == 0:
+            return
+        # (node, indices of the points that still need the node)
+        stack = [(0,np.arange(len(p)))]
+        while stack:
+            node,indices = stack.pop()
+            points = p[indices]
+            #the distance to the bounding sphere is a lower bound of the distance to anything inside of it
+            offset = points - self.centers[node]
+            keep = np.sqrt(np.einsum("ij,ij->i",offset,offset)) - self.radii[node] < best[indices]
+            if not keep.all():
+                indices = indices[keep]
+                points = points[keep]
+            if len(indices) == 0:
+                continue
+
+            if self.leaf_items[node]:
+                visit_leaf(node,indices,points)
+            else:
+                left,right = self.children[node]
+                # the child nearer to the first point is visited first so that the farther one is more likely to be skipped
+                if np.sum((self.centers[left] - points[0]) ** 2) < np.sum((self.centers[right] - points[0]) ** 2):
+                    left,right = right,left
+                stack.append((left,indices))
+                stack.append((right,indices))
+
+    def sdf(self,p:np.array):
+        """
+        calculates the signed distance from point p to the nearest object in the BVH - same as ray_marching.scene_sdf over the items
+        for the points near the objects, far from the objects the result can be a smaller (but still safe) lower bound.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+        """
+        if np.ndim(p) == 1:
+            return self.sdf(p[None])[0]
+        if len(self.items) == 0:
+            return np.full(len(p),1000.0)
+
+        best = np.full(len(p),np.inf)
+
+        def visit_leaf(node,indices,points):
+            distances = best[indices]
+            for item in self.leaf_items[node]:
+                distances = np.minimum(distances,self.items[item].sdf(points))
+            best[indices] = distances
+
+        self.traverse(p,best,visit_leaf)
+        return best
+
+    def sdf_ids(self,p:np.array):
+        """
+        calculates the signed distance from point p to the nearest object in the BVH together with the object and the primitive that produced it
+        - same traversal as sdf, see ray_marching.scene_sdf with with_ids=True
+        p: a batch of points of shape (N,3)
+
+        returns: (distances, object ids (the object_id of the items), leaf ids (see CSG_tape.sdf_leaf)) - arrays of shape (N,)
+        """
+        best = np.full(len(p),np.inf if len(self.items) > 0 else 1000.0)
+        object_ids = np.full(len(p),-1)
+        leaf_ids = np.full(len(p),-1)
+
+        def visit_leaf(node,indices,points):
+            for item in self.leaf_items[node]:
+                distance,leaf = self.items[item].sdf_leaf(points)
+                closer = distance < best[indices]
+                best[indices[closer]] = distance[closer]
+                object_ids[indices[closer]] = getattr(self.items[item],"object_id",-1)
+                leaf_ids[indices[closer]] = leaf[closer]
+
+        self.traverse(p,best,visit_leaf)
+        return best,object_ids,leaf_ids
+
+    def sdf_gradient(self,p:np.array):
+        """
+        calculates the signed distance from point p to the nearest object in the BVH and its gradient - same traversal as sdf,
+        the gradient is the one of the nearest item (see CSG_object_node.sdf_gradient)
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+
+        returns: (distance, gradient)
+        """
+        if np.ndim(p) == 1:
+            distance,gradient = self.sdf_gradient(p[None])
+            return distance[0],gradient[0]
+        if len(self.items) == 0:
+            return np.full(len(p),1000.0),np.zeros((len(p),3))
+
+        best = np.full(len(p),np.inf)
+        best_gradient = np.zeros((len(p),3))
+
+        def visit_leaf(node,indices,points):
+            for item in self.leaf_items[node]:
+                distance,gradient = self.items[item].sdf_gradient(points)
+                closer = distance < best[indices]
+                best[indices[closer]] = distance[closer]
+                best_gradient[indices[closer]] = gradient[closer]
+
+        self.traverse(p,best,visit_leaf)
+        return best,best_gradient
+
+    def intersected_items(self,ray_origin,ray_direction,margin=0,with_rays=False):
+        """
+        Returns the list of items whose bounding sphere (enlarged by margin) is intersected by at least one of the rays.
+        Each node is tested only with the rays that intersect its parent.
+
+        ray_origin: starting point of the rays - shape (3,)
+        ray_direction: normalized direction vectors of the rays - shape (N,3)
+        with_rays: return (item, indices of the rays that intersect its bounding sphere) instead of the items
+        """
+        items = []
+        if len(self.items) == 0:
+            return items
+
+        stack = [(0,np.arange(len(ray_direction)))]
+        while stack:
+            node,rays = stack.pop()
+            rays = rays[csg.ray_sphere_intersection(self.centers[node],self.radii[node] + margin,ray_origin,ray_direction[rays])]
+            if len(rays) == 0:
+                continue
+            if self.leaf_items[node]:
+                for item in self.leaf_items[node]:
+                    center,radius = self.item_spheres[item]
+                    intersected = csg.ray_sphere_intersection(center,radius + margin,ray_origin,ray_direction[rays])
+                    if intersected.any():
+                        items.append((self.items[item],rays[intersected]) if with_rays else self.items[item])
+            else:
+                stack.append((self.children[node][0],rays))
+                stack.append((self.children[node][1],rays))
+        return items
+
+    def bounding_sphere(self):
+        """Returns the bounding sphere (center, radius) of all the objects"""
+        if len(self.items) == 0:
+            return np.zeros(3),0.0
+        return self.centers[0],self.radii[0]
+
+    def bounding_sphere_intersection(self,ray_origin,ray_direction,margin=0):
+        """Same as CSG_object_node.bounding_sphere_intersection for the bounding sphere of all the objects"""
+        center,radius = self.bounding_sphere()
+        return csg.ray_sphere_intersection(center,radius + margin,ray_origin,ray_direction)
@@ -25,8 +25,12 @@ class Primitive:
         self.bounding_sphere_radius = 0 # this will be set in the child classes
     
     def reverse_transform(self,p:np.array):
-        """Applies the inverse transformation to point p to bring it back to the object's local coordinate system"""
+        """
+        Applies the inverse transformation to point p to bring it back to the object's local coordinate system.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3).
+        """
         # this method applies the inverse transformation to a given p
+        # the points are stored as rows so the same two lines work for a single point and for a batch
         p = p - self.translation
         p = p @ self.rotation
         return p
@@ -34,6 +38,44 @@ class Primitive:
     def sdf(self,p:np.array):
         """
         Calculates the signed distance from point p to the surface of the primitive.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3) - the result is a float or an array of shape (N,).
+        """
+        return self.local_sdf(self.reverse_transform(p),self.parameters())
+
+    def sdf_gradient(self,p:np.array):
+        """
+        Calculates the signed distance and its gradient (the normalized normal of the surface) at point p.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+
+        returns: (distance, gradient) - a float and an array of shape (3,) or arrays of shape (N,) and (N,3) for a batch of points
+        """
+        local = self.reverse_transform(p)
+        parameters = self.parameters()
+        # the point is transformed by p @ rotation so the gradient is transformed back by the transposed matrix
+        return self.local_sdf(local,parameters),self.local_gradient(local,parameters) @ self.rotation.T
+
+    def parameters(self) -> np.array:
+        """
+        Returns the shape parameters of the primitive as a numpy array of shape (3,) - the format expected by local_sdf.
+        This method should be implemented in each subclass.
+        """
+        pass
+
+    @staticmethod
+    def local_sdf(p:np.array,parameters:np.array):
+        """
+        Calculates the signed distance from point p given in the object's local coordinate system (see reverse_transform)
+        to the surface of a primitive with the given shape parameters (see parameters).
+        It does not use the instance so compiled CSG trees (csg_tape.py) can evaluate primitives from parameter arrays.
+        This method should be implemented in each subclass.
+        """
+        pass
+
+    @staticmethod
+    def local_gradient(p:np.array,parameters:np.array):
+        """
+        Calculates the gradient of local_sdf at point p given in the object's local coordinate system - a unit vector
+        (or an array of shape (N,3) of unit vectors for a batch of points).
         This method should be implemented in each subclass.
         """
         pass
@@ -54,14 +96,29 @@ class Box(Primitive):
 
         self.bounding_sphere_radius = np.linalg.norm(self.side_lengths) / 2
 
-    def sdf(self,p:np.array):
+    def parameters(self):
+        """[length, width, height]"""
+        return self.side_lengths
 
-        p = self.reverse_transform(p)
+    @staticmethod
+    def local_sdf(p:np.array,parameters:np.array):
         #since the box has axial symmetry we can consider the p where all coordinates are positive
         p = np.abs(p)
-        q = p - (self.side_lengths / 2)
-        distance = np.linalg.norm(np.maximum(q,0)) + min(0,max(q[0],q[1],q[2]))
+        q = p - (parameters / 2)
+        # the last axis holds the coordinates so this works for both a single point and a batch of points
+        distance = np.linalg.norm(np.maximum(q,0),axis=-1) + np.minimum(np.max(q,axis=-1),0)
         return distance
+
+    @staticmethod
+    def local_gradient(p:np.array,parameters:np.array):
+        signs = np.where(p < 0,-1.0,1.0)
+        q = np.abs(p) - (parameters / 2)
+        #outside - the direction from the nearest point of the box, inside - the normal of the nearest face
+        outside = np.maximum(q,0)
+        length = np.linalg.norm(outside,axis=-1,keepdims=True)
+        face = np.eye(3)[np.argmax(q,axis=-1)]
+        gradient = np.where(length > 0,outside / np.where(length > 0,length,1),face)
+        return gradient * signs
         
 
 class Sphere(Primitive):
@@ -78,11 +135,20 @@ class Sphere(Primitive):
 
         self.bounding_sphere_radius = radius
     
-    def sdf(self,p:np.array):
-        p = self.reverse_transform(p)
-        distance = np.linalg.norm(p) - self.r
+    def parameters(self):
+        """[radius, 0, 0]"""
+        return np.array([self.r,0,0])
+
+    @staticmethod
+    def local_sdf(p:np.array,parameters:np.array):
+        distance = np.linalg.norm(p,axis=-1) - parameters[0]
         return distance
 
+    @staticmethod
+    def local_gradient(p:np.array,parameters:np.array):
+        length = np.linalg.norm(p,axis=-1,keepdims=True)
+        return p / np.where(length > 0,length,1)
+
 
 
 class Cylinder(Primitive):
@@ -105,14 +171,34 @@ class Cylinder(Primitive):
         self.bounding_sphere_radius = np.linalg.norm(np.array([radius,height/2]))
 
     
-    def sdf(self,p:np.array):
-        p = self.reverse_transform(p)
+    def parameters(self):
+        """[radius, height, 0]"""
+        return np.array([self.r,self.h,0])
+
+    @staticmethod
+    def local_sdf(p:np.array,parameters:np.array):
         p = np.abs(p)
 
-        d = np.array([np.linalg.norm(p[:2]) - self.r, p[2] - self.h / 2])
-        distance = np.minimum(np.maximum(d[0], d[1]), 0) + np.linalg.norm(np.maximum(d, 0))
+        # d[...,0] - distance from the side, d[...,1] - distance from the top/bottom face
+        d = np.stack([np.linalg.norm(p[...,:2],axis=-1) - parameters[0], p[...,2] - parameters[1] / 2],axis=-1)
+        distance = np.minimum(np.maximum(d[...,0], d[...,1]), 0) + np.linalg.norm(np.maximum(d, 0),axis=-1)
         return distance
 
+    @staticmethod
+    def local_gradient(p:np.array,parameters:np.array):
+        radial_length = np.linalg.norm(p[...,:2],axis=-1)
+        d = np.stack([radial_length - parameters[0], np.abs(p[...,2]) - parameters[1] / 2],axis=-1)
+
+        # the gradient in the (distance from the axis, |z|) plane - same cases as for the box
+        outside = np.maximum(d,0)
+        length = np.linalg.norm(outside,axis=-1,keepdims=True)
+        side = (d[...,0] >= d[...,1])[...,None]
+        gradient_2d = np.where(length > 0,outside / np.where(length > 0,length,1),np.concatenate([side,~side],axis=-1))
+
+        radial = p[...,:2] / np.where(radial_length > 0,radial_length,1)[...,None]
+        axial = np.where(p[...,2] < 0,-1.0,1.0)
+        return np.concatenate([radial * gradient_2d[...,:1],(axial * gradient_2d[...,1])[...,None]],axis=-1)
+
 
 class CSG_object_node:
     """
@@ -139,12 +225,24 @@ class CSG_object_node:
     """
 
 
+    cache: dict
+    """derived data of the node computed by other modules (e.g. the baked distance grid in distance_grid.py)
+    - cleared whenever the node is translated or rotated or becomes a child of a new node
+    """
+
     def __init__(self,primitive=None,operator=None,left=None,right = None):
 
         self.primitive = primitive 
         self.operator = operator
         self.left = left
         self.right = right
+        self.cache = dict()
+
+        #the children are now part of a new object - the data cached for them is not needed anymore
+        if left is not None:
+            left.cache.clear()
+        if right is not None:
+            right.cache.clear()
 
         if primitive != None:
             self.center = np.array([0.0,0.0,0.0])
@@ -162,36 +260,51 @@ class CSG_object_node:
         #this funtion determines whether the node is a leaf becuase only the lease
         return self.primitive is not None
     
-    def bounding_sphere_intersection(self,ray_origin,ray_direction)-> bool:
+    def bounding_sphere(self):
         """
-        calcualtes whether a ray and bounding sphere intersect.
-        ray_origin a point on the ray
-        ray_direction: normalized direction vector of the ray
+        Calculates the bounding sphere of the CSG object represented by the tree rooted at this node.
+        - leaf: the bounding sphere of the primitive (the primitive is centered at its translation)
+        - union: the smallest sphere enclosing the bounding spheres of both children
+        - intersection: the smaller of the two children's bounding spheres (the intersection lies inside both)
+        - difference: the bounding sphere of the left child (the difference lies inside the left object)
 
-        returns: True if the ray intersects the bounding sphere, False otherwise
+        returns: (center, radius) - center is a np.array of shape (3,)
         """
-        
         if self.is_leaf():
-            ray_origin -= self.primitive.translation()
-            distance_from_center = np.sqrt(np.dot(ray_origin,ray_origin)-np.dot(ray_origin,ray_direction)**2)
+            return self.primitive.translation.astype(float),float(self.primitive.bounding_sphere_radius)
 
-            if distance_from_center < self.primitive.bounding_sphere_radius:
-                return True
-            else:
-                return False
-        
+        left = self.left.bounding_sphere()
+        if self.operator == "difference":
+            return left
+
+        right = self.right.bounding_sphere()
+        if self.operator == "intersection":
+            return left if left[1] <= right[1] else right
+        elif self.operator == "union":
+            return enclosing_sphere(left,right)
         else:
-            l = self.left.bounding_sphere_intersection(ray_origin,ray_direction)
-            # if l is true then it returns true if not it returns
-            return l or self.right.bounding_sphere_intersection(ray_origin,ray_direction)
+            raise ValueError("Unknown operator")
+
+    def bounding_sphere_intersection(self,ray_origin,ray_direction,margin=0)-> bool:
+        """
+        calculates whether rays and the bounding sphere of this node intersect - see ray_sphere_intersection.
+        ray_origin: starting point of the rays
+        ray_direction: normalized direction vector of the ray - shape (3,) or a batch of directions (N,3)
+        margin: the bounding sphere is enlarged by margin
+
+        returns: True if the ray intersects the bounding sphere, False otherwise (a boolean array for a batch of directions)
+        """
+        center,radius = self.bounding_sphere()
+        return ray_sphere_intersection(center,radius + margin,ray_origin,ray_direction)
 
     
    
     def sdf(self,p:np.array) -> np.float32:
         """
         calculates the signed distance from point p to the surface of the CSG object represented by the tree rooted at this node.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
 
-        returns: signed distance as a float
+        returns: signed distance as a float or an array of shape (N,) for a batch of points
         """
 
         if self.is_leaf():
@@ -202,15 +315,64 @@ class CSG_object_node:
             if self.operator == 'union': 
                 # this operation is not perfect while it determines the exterior distance correctly the interior distance is not always correct
                 # for now we will use it as is
-                return min(left_dist, right_dist) 
+                return np.minimum(left_dist, right_dist) 
             elif self.operator == 'intersection':
-                return max(left_dist, right_dist)
+                return np.maximum(left_dist, right_dist)
             elif self.operator == 'difference':
-                return max(left_dist, -right_dist)
+                return np.maximum(left_dist, -right_dist)
             else:
                 raise ValueError("Unknown operator")
             
 
+    def sdf_gradient(self,p:np.array):
+        """
+        calculates the signed distance and its gradient at point p - see Primitive.sdf_gradient.
+        The operations pass through the gradient of the child whose distance they return (the negated gradient of the right child
+        of a difference when the point is inside of it).
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+
+        returns: (distance, gradient)
+        """
+        if self.is_leaf():
+            return self.primitive.sdf_gradient(p)
+
+        left_dist,left_gradient = self.left.sdf_gradient(p)
+        right_dist,right_gradient = self.right.sdf_gradient(p)
+        return combine_gradients(self.operator,left_dist,left_gradient,right_dist,right_gradient)
+
+    def sdf_leaf(self,p:np.array,first_leaf=0):
+        """
+        calculates the signed distance at point p and the primitive (leaf of the tree) that produced it.
+        The leaves are numbered from left to right starting at first_leaf - the same numbering as the primitives of the compiled tape (csg_tape.py).
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+
+        returns: (distance, index of the leaf)
+        """
+        if self.is_leaf():
+            distance = self.primitive.sdf(p)
+            return distance,np.full(np.shape(distance),first_leaf)
+
+        left_dist,left_leaf = self.left.sdf_leaf(p,first_leaf)
+        right_dist,right_leaf = self.right.sdf_leaf(p,first_leaf + self.left.leaf_count())
+        if self.operator == "difference":
+            right_dist = -right_dist
+        elif self.operator != "union" and self.operator != "intersection":
+            raise ValueError("Unknown operator")
+        right_wins = right_dist < left_dist if self.operator == "union" else right_dist > left_dist
+        return np.where(right_wins,right_dist,left_dist),np.where(right_wins,right_leaf,left_leaf)
+
+    def leaf_count(self) -> int:
+        """Returns the number of primitives in the tree rooted at this node"""
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.is_leaf():
+                count += 1
+            else:
+                stack += [node.left,node.right]
+        return count
+
     def translate(self,v:np.array ):
         """
         Translates the CSG object and all its children by vector v.
@@ -221,6 +383,7 @@ class CSG_object_node:
             self.left.translate(v)
             self.right.translate(v)
         self.center += v
+        self.cache.clear()
 
     def rotate(self,rot_matrix,inverse_rot_matrix):
         """
@@ -243,6 +406,60 @@ class CSG_object_node:
             self.right.rotate(rot_matrix,inverse_rot_matrix)
             self.right.translate(center_diff)
             self.right.translate(-center_diff@rot_matrix)
+        self.cache.clear()
+
+
+def enclosing_sphere(sphere1,sphere2):
+    """
+    Returns the smallest sphere (center, radius) enclosing the two given spheres (center, radius)
+    """
+    (center1,radius1),(center2,radius2) = sphere1,sphere2
+    distance = np.linalg.norm(center2 - center1)
+
+    #one of the spheres is inside of the other
+    if distance + radius2 <= radius1:
+        return sphere1
+    if distance + radius1 <= radius2:
+        return sphere2
+
+    radius = (distance + radius1 + radius2) / 2
+    center = center1 + (center2 - center1) / distance * (radius - radius1)
+    return center,radius
+
+def combine_gradients(operator,left_dist,left_gradient,right_dist,right_gradient):
+    """
+    Combines the distances and gradients of the two children of an operation node - the result is the distance of the operation
+    and the gradient of the child that produced it
+
+    returns: (distance, gradient)
+    """
+    if operator == "difference":
+        right_dist,right_gradient = -right_dist,-right_gradient
+    elif operator != "union" and operator != "intersection":
+        raise ValueError("Unknown operator")
+
+    right_wins = right_dist < left_dist if operator == "union" else right_dist > left_dist
+    return np.where(right_wins,right_dist,left_dist),np.where(np.asarray(right_wins)[...,None],right_gradient,left_gradient)
+
+
+def ray_sphere_intersection(center,radius,ray_origin,ray_direction):
+    """
+    calculates whether rays starting at ray_origin intersect the sphere - only the part of the ray in front of the origin counts.
+    center, radius: the sphere
+    ray_origin: starting point of the rays - shape (3,)
+    ray_direction: normalized direction vector of the ray - shape (3,) or a batch of directions (N,3)
+
+    returns: True if the ray intersects the sphere, False otherwise (a boolean array for a batch of directions)
+    """
+    to_center = center - ray_origin
+    distance_squared = np.dot(to_center,to_center)
+    #the origin is inside of the sphere - every ray intersects it
+    if distance_squared <= radius ** 2:
+        return np.ones(np.shape(ray_direction)[:-1],dtype=bool) if np.ndim(ray_direction) > 1 else True
+
+    #distance along the ray to the point closest to the center - the sphere is behind the origin if it is negative
+    along = ray_direction @ to_center
+    return (along >= 0) & (distance_squared - along ** 2 <= radius ** 2)
 
 
 # We define funtions whose input is are two CSG nodes and output is a new CSG node with the appropriate operator
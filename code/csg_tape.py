@@ -0,0 +1,320 @@
+import csg
+
+import numpy as np
+
+# Instructions of the tape
+# the first three push the distance to a primitive onto the stack, the next three pop two distances and push the combined one
+# BOUND starts the code of a subtree (an operation node) - see CSG_tape.sdf
+PUSH_BOX = 0
+PUSH_SPHERE = 1
+PUSH_CYLINDER = 2
+UNION = 3
+INTERSECTION = 4
+DIFFERENCE = 5
+BOUND = 6
+
+BOUND_MARGIN = 0.1
+"""points farther than BOUND_MARGIN from the bounding sphere of a subtree get the distance to the bounding sphere instead of the exact SDF of the subtree"""
+
+PRIMITIVE_INSTRUCTIONS = {csg.Box: PUSH_BOX, csg.Sphere: PUSH_SPHERE, csg.Cylinder: PUSH_CYLINDER}
+OPERATOR_INSTRUCTIONS = {"union": UNION, "intersection": INTERSECTION, "difference": DIFFERENCE}
+
+# local SDFs of the primitives indexed by the PUSH instructions
+PRIMITIVE_SDFS = [csg.Box.local_sdf, csg.Sphere.local_sdf, csg.Cylinder.local_sdf]
+
+# gradients of the local SDFs of the primitives indexed by the PUSH instructions
+PRIMITIVE_GRADIENTS = [csg.Box.local_gradient, csg.Sphere.local_gradient, csg.Cylinder.local_gradient]
+
+
+class CSG_tape:
+    """
+    A CSG tree compiled into a flat postfix program (tape) - see compile_tree.
+
+    The tape is evaluated by a small interpreter with a stack of distance arrays: the PUSH instructions
+    evaluate a primitive for the whole batch of points, the operations combine the two distances on top of the stack.
+    There is no recursion, no string comparison and no attribute lookup of the CSG nodes while evaluating,
+    and the tape consists only of numpy arrays, so it is cheap to send to worker processes.
+
+    The code of every operation node is preceded by a BOUND instruction with the bounding sphere of the node (see CSG_object_node.bounding_sphere)
+    and the position of the first instruction after the code of the node. Points far from the bounding sphere skip the whole subtree.
+    """
+
+    instructions: np.array
+    """np.array of shape (n,) with the instructions in postfix order"""
+
+    operands: np.array
+    """np.array of shape (n,) with the index of the primitive for the PUSH instructions, the index of the bounding sphere for BOUND instructions (-1 for operations)"""
+
+    targets: np.array
+    """np.array of shape (n,) with the position of the instruction after the subtree for BOUND instructions (-1 for the other instructions)"""
+
+    translations: np.array
+    """np.array of shape (p,3) with the translations of the primitives"""
+
+    rotations: np.array
+    """np.array of shape (p,3,3) with the inverse rotation matrices of the primitives"""
+
+    parameters: np.array
+    """np.array of shape (p,3) with the shape parameters of the primitives (see Primitive.parameters)"""
+
+    bound_centers: np.array
+    """np.array of shape (b,3) with the centers of the bounding spheres of the operation nodes"""
+
+    bound_radii: np.array
+    """np.array of shape (b,) with the radii of the bounding spheres of the operation nodes"""
+
+    center: np.array
+    """np.array of shape (3,) - center of the bounding sphere of the whole object"""
+
+    radius: float
+    """radius of the bounding sphere of the whole object"""
+
+    object_id: int
+    """index of the object in the scene (set by rendering.prepare_objects) - reported by ray_marching.scene_sdf with with_ids=True, -1 if not set"""
+
+    def __init__(self,instructions,operands,targets,translations,rotations,parameters,bound_centers,bound_radii,center,radius):
+        self.instructions = np.asarray(instructions,dtype=np.int8)
+        self.operands = np.asarray(operands,dtype=np.int32)
+        self.targets = np.asarray(targets,dtype=np.int32)
+        self.translations = np.asarray(translations,dtype=float).reshape(-1,3)
+        self.rotations = np.asarray(rotations,dtype=float).reshape(-1,3,3)
+        self.parameters = np.asarray(parameters,dtype=float).reshape(-1,3)
+        self.bound_centers = np.asarray(bound_centers,dtype=float).reshape(-1,3)
+        self.bound_radii = np.asarray(bound_radii,dtype=float)
+        self.center = np.asarray(center,dtype=float)
+        self.radius = float(radius)
+        self.object_id = -1
+        self._build_program()
+
+    def _build_program(self):
+        # the interpreter loops over a python list of tuples - much faster than indexing the numpy arrays in the loop
+        self.program = []
+        #the operand of every instruction - for the PUSH instructions the index of the primitive (the leaf reported by sdf_leaf)
+        self.leaves = self.operands.tolist()
+        for instruction,i,target in zip(self.instructions.tolist(),self.operands.tolist(),self.targets.tolist()):
+            if instruction == BOUND:
+                self.program.append((instruction,self.bound_centers[i],self.bound_radii[i],target))
+            elif i >= 0:
+                self.program.append((instruction,self.translations[i],self.rotations[i],self.parameters[i]))
+            else:
+                self.program.append((instruction,None,None,None))
+
+    def __getstate__(self):
+        # only the arrays are pickled, the program is rebuilt after unpickling
+        state = self.__dict__.copy()
+        del state["program"]
+        del state["leaves"]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._build_program()
+
+    def __copy__(self):
+        # a shallow copy shares the arrays and the program too (see rendering.prepare_objects) - copy.copy would rebuild the program in __setstate__
+        copied = object.__new__(type(self))
+        copied.__dict__.update(self.__dict__)
+        return copied
+
+    def sdf(self,p:np.array):
+        """
+        calculates the signed distance from point p to the surface of the compiled CSG object.
+        Same result as CSG_object_node.sdf for the points near the object, points farther than BOUND_MARGIN from the bounding sphere
+        of a subtree get the distance to that bounding sphere instead (a lower bound of the distance, so it is still safe for ray marching).
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+
+        returns: signed distance as a float or an array of shape (N,) for a batch of points
+        """
+        if np.ndim(p) == 1:
+            return self.sdf(p[None])[0]
+        return self._run(0,len(self.program),p)
+
+    def _run(self,start,end,p):
+        """
+        Runs the instructions start <= i < end (the code of one subtree) on the points p and returns the distances
+        """
+        program = self.program
+        stack = []
+        i = start
+        while i < end:
+            instruction,a,b,c = program[i]
+            i += 1
+            if instruction == BOUND:
+                center,radius,target = a,b,c
+                bound_distance = np.linalg.norm(p - center,axis=-1) - radius
+                near = bound_distance <= BOUND_MARGIN
+                if near.all():
+                    #every point needs the exact distance - continue with the code of the subtree
+                    continue
+                #the distance to the bounding sphere is a lower bound of the distance to the subtree - it is used for the far points
+                #and only the near points are evaluated exactly
+                if near.any():
+                    bound_distance[near] = self._run(i,target,p[near])
+                stack.append(bound_distance)
+                i = target
+            elif instruction == UNION:
+                right = stack.pop()
+                stack[-1] = np.minimum(stack[-1],right)
+            elif instruction == INTERSECTION:
+                right = stack.pop()
+                stack[-1] = np.maximum(stack[-1],right)
+            elif instruction == DIFFERENCE:
+                right = stack.pop()
+                stack[-1] = np.maximum(stack[-1],-right)
+            else:
+                # same as Primitive.reverse_transform
+                translation,rotation,parameters = a,b,c
+                stack.append(PRIMITIVE_SDFS[instruction]((p - translation) @ rotation,parameters))
+        return stack[0]
+
+    def sdf_gradient(self,p:np.array):
+        """
+        calculates the signed distance and its gradient at point p - see CSG_object_node.sdf_gradient.
+        The far points that get the distance to a bounding sphere get the gradient of the distance to the sphere.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+
+        returns: (distance, gradient)
+        """
+        if np.ndim(p) == 1:
+            distance,gradient = self.sdf_gradient(p[None])
+            return distance[0],gradient[0]
+        distance,_,gradient = self._run_tracked(0,len(self.program),p,True)
+        return distance,gradient
+
+    def sdf_leaf(self,p:np.array):
+        """
+        calculates the signed distance at point p and the primitive (leaf of the CSG tree) that produced it - see CSG_object_node.sdf_leaf.
+        The far points that get the distance to a bounding sphere get the leaf -1.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+
+        returns: (distance, index of the primitive in the tape)
+        """
+        if np.ndim(p) == 1:
+            distance,leaf = self.sdf_leaf(p[None])
+            return distance[0],leaf[0]
+        distance,leaf,_ = self._run_tracked(0,len(self.program),p,False)
+        return distance,leaf
+
+    def _run_tracked(self,start,end,p,with_gradient):
+        """
+        Same as _run, but the stack also holds the index of the primitive that produced every distance (and its gradient if with_gradient is True)
+        - returns the distances, the primitives and the gradients (None if with_gradient is False) of the subtree
+        """
+        program = self.program
+        stack = []
+        i = start
+        while i < end:
+            instruction,a,b,c = program[i]
+            i += 1
+            if instruction == BOUND:
+                center,radius,target = a,b,c
+                offset = p - center
+                length = np.linalg.norm(offset,axis=-1)
+                bound_distance = length - radius
+                near = bound_distance <= BOUND_MARGIN
+                if near.all():
+                    continue
+                bound_leaf = np.full(len(p),-1)
+                bound_gradient = offset / np.where(length > 0,length,1)[:,None] if with_gradient else None
+                if near.any():
+                    distance,leaf,gradient = self._run_tracked(i,target,p[near],with_gradient)
+                    bound_distance[near] = distance
+                    bound_leaf[near] = leaf
+                    if with_gradient:
+                        bound_gradient[near] = gradient
+                stack.append((bound_distance,bound_leaf,bound_gradient))
+                i = target
+            elif instruction == UNION or instruction == INTERSECTION or instruction == DIFFERENCE:
+                right_distance,right_leaf,right_gradient = stack.pop()
+                left_distance,left_leaf,left_gradient = stack[-1]
+                if instruction == DIFFERENCE:
+                    right_distance = -right_distance
+                    right_gradient = None if right_gradient is None else -right_gradient
+                right_wins = right_distance < left_distance if instruction == UNION else right_distance > left_distance
+                stack[-1] = (np.where(right_wins,right_distance,left_distance),np.where(right_wins,right_leaf,left_leaf),
+                             np.where(right_wins[:,None],right_gradient,left_gradient) if with_gradient else None)
+            else:
+                translation,rotation,parameters = a,b,c
+                local = (p - translation) @ rotation
+                gradient = PRIMITIVE_GRADIENTS[instruction](local,parameters) @ rotation.T if with_gradient else None
+                stack.append((PRIMITIVE_SDFS[instruction](local,parameters),np.full(len(p),self.leaves[i - 1]),gradient))
+        return stack[0]
+
+    def bounding_sphere(self):
+        """Returns the bounding sphere (center, radius) of the whole object - see CSG_object_node.bounding_sphere"""
+        return self.center,self.radius
+
+    def bounding_sphere_intersection(self,ray_origin,ray_direction,margin=0):
+        """Same as CSG_object_node.bounding_sphere_intersection"""
+        return csg.ray_sphere_intersection(self.center,self.radius + margin,ray_origin,ray_direction)
+
+
+def compile_tree(node:csg.CSG_object_node) -> CSG_tape:
+    """
+    Compiles the CSG tree rooted at node into a CSG_tape.
+    The tree is traversed in postorder (left child, right child, node) which gives the postfix order of the instructions,
+    the BOUND instruction of an operation node is added before the code of its children.
+    """
+    instructions,operands,targets = [],[],[]
+    translations,rotations,parameters = [],[],[]
+    bound_centers,bound_radii = [],[]
+    #bounding spheres of the visited nodes - computed bottom up so every node is visited only once
+    spheres = []
+
+    # iterative traversal - deep trees (long difference chains) would hit the recursion limit
+    stack = [(node,False,-1)]
+    while stack:
+        current,children_done,bound_position = stack.pop()
+        if current.is_leaf():
+            primitive = current.primitive
+            instructions.append(PRIMITIVE_INSTRUCTIONS[type(primitive)])
+            operands.append(len(parameters))
+            targets.append(-1)
+            translations.append(primitive.translation)
+            rotations.append(primitive.rotation)
+            parameters.append(primitive.parameters())
+            spheres.append((primitive.translation.astype(float),float(primitive.bounding_sphere_radius)))
+        elif not children_done:
+            #placeholder of the BOUND instruction - filled in when the code of the subtree is finished
+            instructions.append(BOUND)
+            operands.append(len(bound_radii))
+            targets.append(-1)
+            bound_centers.append(None)
+            bound_radii.append(None)
+
+            stack.append((current,True,len(instructions) - 1))
+            stack.append((current.right,False,-1))
+            stack.append((current.left,False,-1))
+        else:
+            instructions.append(OPERATOR_INSTRUCTIONS[current.operator])
+            operands.append(-1)
+            targets.append(-1)
+
+            #same rules as CSG_object_node.bounding_sphere
+            right = spheres.pop()
+            left = spheres.pop()
+            if current.operator == "union":
+                sphere = csg.enclosing_sphere(left,right)
+            elif current.operator == "intersection":
+                sphere = left if left[1] <= right[1] else right
+            else:
+                sphere = left
+            spheres.append(sphere)
+
+            targets[bound_position] = len(instructions)
+            bound_centers[operands[bound_position]],bound_radii[operands[bound_position]] = sphere
+
+    center,radius = spheres.pop()
+    return CSG_tape(instructions,operands,targets,translations,rotations,parameters,bound_centers,bound_radii,center,radius)
+
+
+def cached_tape(node:csg.CSG_object_node) -> CSG_tape:
+    """
+    Returns the compiled tape of the CSG object - it is compiled only once and stored in node.cache,
+    which is cleared automatically when the object is translated, rotated or combined with another object.
+    """
+    tape = node.cache.get("tape")
+    if tape is None:
+        tape = compile_tree(node)
+        node.cache["tape"] = tape
+    return tape
@@ -0,0 +1,139 @@
+import csg
+import csg_tape
+
+import numpy as np
+
+GRID_RESOLUTION = 32
+"""default number of samples of the grid along each axis"""
+
+EXACT_BAND = 0.1
+"""points whose lower bound from the grid is below EXACT_BAND * cell size are evaluated exactly"""
+
+# offsets of the eight samples of a grid cell
+CELL_CORNERS = [(x,y,z) for x in (0,1) for y in (0,1) for z in (0,1)]
+
+
+class Distance_grid:
+    """
+    The SDF of one object baked into a regular 3D grid of samples over the cube around its bounding sphere.
+
+    Because an SDF changes by at most the distance moved, every sample of the cell around a point minus the distance
+    to the sample is a lower bound of the true distance at the point - the largest of these eight bounds is used.
+    Far from the surface that bound is used (large, cheap and still safe steps when ray marching),
+    only the points near the surface are evaluated exactly with the compiled tape of the object.
+    Outside of the grid the distance to the bounding sphere is used.
+
+    Has the same sdf and bounding sphere methods as the objects, so it can be used in their place when rendering.
+    """
+
+    tape: csg_tape.CSG_tape
+    """compiled tape of the object - used for the exact distance near the surface"""
+
+    corner: np.array
+    """np.array of shape (3,) - the corner of the grid with the smallest coordinates"""
+
+    cell_size: float
+    """distance between two neighbouring samples"""
+
+    values: np.array
+    """np.array of shape (n,n,n) with the distances at the samples - values[i,j,k] is the distance at corner + cell_size * [i,j,k]"""
+
+    object_id: int
+    """index of the object in the scene (set by rendering.prepare_objects) - see CSG_tape.object_id"""
+
+    def __init__(self,tape:csg_tape.CSG_tape,resolution=GRID_RESOLUTION):
+        self.tape = tape
+        self.object_id = -1
+        center,radius = tape.bounding_sphere()
+
+        # the grid is slightly larger than the bounding sphere so that the points near the sphere are inside of it
+        half_size = radius + csg_tape.BOUND_MARGIN
+        self.corner = center - half_size
+        self.cell_size = 2 * half_size / (resolution - 1)
+
+        axis = np.arange(resolution) * self.cell_size
+        samples = np.stack(np.meshgrid(axis,axis,axis,indexing="ij"),axis=-1).reshape(-1,3) + self.corner
+        self.values = tape.sdf(samples).reshape(resolution,resolution,resolution).astype(np.float32)
+
+    def lower_bound(self,p:np.array):
+        """
+        Lower bound of the distance at the points p of shape (N,3) from the eight samples of the grid cell around each point
+        - the points must be inside of the grid
+        """
+        resolution = self.values.shape[0]
+        position = (p - self.corner) / self.cell_size
+        index = np.clip(np.floor(position).astype(int),0,resolution - 2)
+        t = position - index
+        i,j,k = index[:,0],index[:,1],index[:,2]
+
+        bound = np.full(len(p),-np.inf)
+        for corner in CELL_CORNERS:
+            offset = t - corner
+            sample = self.values[i + corner[0],j + corner[1],k + corner[2]]
+            bound = np.maximum(bound,sample - self.cell_size * np.sqrt(np.einsum("ij,ij->i",offset,offset)))
+        return bound
+
+    def sdf(self,p:np.array):
+        """
+        calculates a lower bound of the signed distance from point p to the surface of the object - exact near the surface.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+        """
+        return self.sdf_leaf(p,False)
+
+    def sdf_leaf(self,p:np.array,with_leaf=True):
+        """
+        calculates the same distance as sdf and the primitive that produced it (see CSG_tape.sdf_leaf) - -1 for the points whose distance comes from the grid.
+        p can be a single point of shape (3,) or a batch of points of shape (N,3)
+
+        returns: (distance, index of the primitive in the tape) - only the distance if with_leaf is False
+        """
+        if np.ndim(p) == 1:
+            result = self.sdf_leaf(p[None],with_leaf)
+            return (result[0][0],result[1][0]) if with_leaf else result[0]
+
+        center,radius = self.tape.bounding_sphere()
+        distance = np.linalg.norm(p - center,axis=-1) - radius
+
+        resolution = self.values.shape[0]
+        inside = np.all((p >= self.corner) & (p <= self.corner + self.cell_size * (resolution - 1)),axis=-1)
+        leaf = np.full(len(p),-1)
+        if inside.any():
+            bound = np.maximum(distance[inside],self.lower_bound(p[inside]))
+            # near the surface (or inside of the object) the bound would make the steps too small - the exact distance is used there
+            near = bound <= EXACT_BAND * self.cell_size
+            if near.any():
+                if with_leaf:
+                    inside_leaf = leaf[inside]
+                    bound[near],inside_leaf[near] = self.tape.sdf_leaf(p[inside][near])
+                    leaf[inside] = inside_leaf
+                else:
+                    bound[near] = self.tape.sdf(p[inside][near])
+            distance[inside] = bound
+        return (distance,leaf) if with_leaf else distance
+
+    def sdf_gradient(self,p:np.array):
+        """
+        calculates the exact signed distance and its gradient at point p with the compiled tape - used for the normals at the hit points,
+        which are near the surface where the grid is not used anyway
+        """
+        return self.tape.sdf_gradient(p)
+
+    def bounding_sphere(self):
+        """Returns the bounding sphere (center, radius) of the object"""
+        return self.tape.bounding_sphere()
+
+    def bounding_sphere_intersection(self,ray_origin,ray_direction,margin=0):
+        """Same as CSG_object_node.bounding_sphere_intersection"""
+        return self.tape.bounding_sphere_intersection(ray_origin,ray_direction,margin)
+
+
+def cached_distance_grid(node:csg.CSG_object_node,resolution=GRID_RESOLUTION) -> Distance_grid:
+    """
+    Returns the baked distance grid of the CSG object - it is baked only once and stored in node.cache,
+    which is cleared automatically when the object is translated, rotated or combined with another object.
+    """
+    grid = node.cache.get("distance_grid")
+    if grid is None or grid.values.shape[0] != resolution:
+        grid = Distance_grid(csg_tape.cached_tape(node),resolution)
+        node.cache["distance_grid"] = grid
+    return grid
@@ -1,6 +1,6 @@
 import tkinter
 from tkinter import ttk
-from tkinter import simpledialog,messagebox
+from tkinter import simpledialog,messagebox,filedialog
 import os
 
 def xyz_coordinates_entries(frame, entry_row):
@@ -562,6 +562,105 @@ def get_resolution():
     return d.result
 
 
+class Dialog_render_settings(simpledialog.Dialog):
+    """
+    A dialog to get the settings of the renderer - the backend, the number of workers and the chunk size,
+    the anti-aliasing, the cone marching, the over-relaxation factor and the normal method.
+    Checks that the numbers are valid positive integers and that the relaxation is at least 1 and less than 2.
+    Attributes:
+        result (tuple): None if the dialog was cancelled, otherwise a tuple (backend,workers,chunksize,antialiasing,cone_marching,relaxation,normals)
+    """
+    def __init__(self, parent=None, title=None, backends=(), backend=None, workers=1, chunksize=1,
+                 antialiasing=False, cone_marching=False, relaxation=1, normal_methods=(), normals=None):
+        self.backends = list(backends)
+        self.normal_methods = list(normal_methods)
+        self.initial = (backend,workers,chunksize,antialiasing,cone_marching,relaxation,normals)
+        super().__init__(parent, title)
+
+    def body(self,master):
+
+        ttk.Label(master, text="Backend:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        self.backend_cb = ttk.Combobox(master=master,values=self.backends,state="readonly")
+        self.backend_cb.set(self.initial[0])
+        self.backend_cb.grid(row=0,column=1,padx=5,pady=5,sticky="ew")
+
+        self.workers_entry = simple_field(master,1,"Workers: ")
+        self.workers_entry.insert(0,str(self.initial[1]))
+        self.chunksize_entry = simple_field(master,2,"Tiles per chunk: ")
+        self.chunksize_entry.insert(0,str(self.initial[2]))
+
+        self.antialiasing_var = tkinter.BooleanVar(master,value=self.initial[3])
+        ttk.Checkbutton(master,text="Anti-aliasing",variable=self.antialiasing_var).grid(row=3,column=0,columnspan=2,padx=5,pady=5,sticky="w")
+        self.cone_marching_var = tkinter.BooleanVar(master,value=self.initial[4])
+        ttk.Checkbutton(master,text="Cone marching",variable=self.cone_marching_var).grid(row=4,column=0,columnspan=2,padx=5,pady=5,sticky="w")
+
+        self.relaxation_entry = simple_field(master,5,"Relaxation (omega): ")
+        self.relaxation_entry.insert(0,str(self.initial[5]))
+
+        ttk.Label(master, text="Normals:").grid(row=6, column=0, padx=5, pady=5, sticky="w")
+        self.normals_cb = ttk.Combobox(master=master,values=self.normal_methods,state="readonly")
+        self.normals_cb.set(self.initial[6])
+        self.normals_cb.grid(row=6,column=1,padx=5,pady=5,sticky="ew")
+
+    def validate(self):
+        backend = self.backend_cb.get()
+        if backend not in self.backends:
+            messagebox.showwarning(
+                    "Illegal value",
+                    f"Please select the backend",
+                    parent = self
+                )
+            return 0
+
+        numbers = []
+        for name,entry in [("number of workers",self.workers_entry),("chunk size",self.chunksize_entry)]:
+            try:
+                numbers.append(int(self.getint(entry.get())))
+                if numbers[-1] <= 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showwarning(
+                    "Illegal value",
+                    f"Invalid {name}"+ "\nPlease enter a positive integer",
+                    parent = self
+                )
+                return 0
+
+        try:
+            relaxation = float(self.relaxation_entry.get())
+            if not 1 <= relaxation < 2:
+                raise ValueError
+        except ValueError:
+            messagebox.showwarning(
+                "Illegal value",
+                f"Invalid relaxation"+ "\nPlease enter a number of at least 1 (standard sphere tracing) and below 2, e.g. 1.2",
+                parent = self
+            )
+            return 0
+
+        normals = self.normals_cb.get()
+        if normals not in self.normal_methods:
+            messagebox.showwarning(
+                    "Illegal value",
+                    f"Please select the normal method",
+                    parent = self
+                )
+            return 0
+
+        self.result = (backend,*numbers,self.antialiasing_var.get(),self.cone_marching_var.get(),relaxation,normals)
+        return 1
+
+def get_render_settings(backends,backend,workers,chunksize,antialiasing,cone_marching,relaxation,normal_methods,normals):
+    """
+    Prompts the user to choose the backend of the renderer, the number of workers, the chunk size, the anti-aliasing, the cone marching,
+    the over-relaxation factor and the normal method, starting from the current settings.
+    Returns a tuple (backend,workers,chunksize,antialiasing,cone_marching,relaxation,normals) or None if cancelled.
+    """
+    d = Dialog_render_settings(title="Render settings",backends=backends,backend=backend,workers=workers,chunksize=chunksize,
+                               antialiasing=antialiasing,cone_marching=cone_marching,relaxation=relaxation,normal_methods=normal_methods,normals=normals)
+    return d.result
+
+
 class Dialog_file_name(simpledialog.Dialog):
     """
     A dialog to get the file name to save the image. Checks that the input is valid and that the file does not already exist.
@@ -603,4 +702,22 @@ def get_file_name():
     Checks that the file does not already exist.
     """
     d = Dialog_file_name(title="Enter file name")
-    return d.result
\ No newline at end of file
+    return d.result
+
+
+SCENE_FILE_TYPES = [("Scene (JSON)","*.json"),("Scene (binary)","*.npz"),("All files","*.*")]
+
+def get_scene_save_path():
+    """
+    Opens a file dialog to choose where to save the scene. Returns the path or None if cancelled.
+    The extension decides the form of the file: .npz for the compact binary form, anything else for JSON.
+    """
+    path = filedialog.asksaveasfilename(title="Save scene",defaultextension=".json",filetypes=SCENE_FILE_TYPES)
+    return path or None
+
+def get_scene_open_path():
+    """
+    Opens a file dialog to choose the scene file to load. Returns the path or None if cancelled.
+    """
+    path = filedialog.askopenfilename(title="Load scene",filetypes=SCENE_FILE_TYPES)
+    return path or None
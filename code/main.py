@@ -2,6 +2,9 @@ import csg
 import rotation
 from input_dialogues import *
 import rendering
+import scene
+import bvh
+from scene import Light_source,camera
 
 
 import numpy as np
@@ -9,72 +12,60 @@ import tkinter as tk
 from tkinter import ttk,messagebox,simpledialog,scrolledtext
 from PIL import Image, ImageTk
 import time
+import copy
+import queue
+import threading
 
-def save_image(imgtk):
+RENDER_POLL_INTERVAL = 50
+"""how often (in milliseconds) the Tkinter thread checks the messages of the background render"""
+
+def save_image(framebuffer):
     """
     Function to save the rendered image to a file. Opens a dialog to get the file name and saves the image as a PNG file.
     Checks if there is an image to save and shows an error message if not.
     The dialog chcecks if there is a file with the same name and asks the user to choose another one if so.
 
-    imgtk: ImageTk.PhotoImage object to be saved
+    framebuffer: numpy array of shape (height,width,3) with the rendered image (the same buffer that is displayed on the canvas)
     
     """
 
-    if imgtk is None:
+    if framebuffer is None:
         tk.messagebox.showerror("Error", "No image to save. Please render the scene first.")
         return
     
     name = get_file_name()
     if name is None:
         return
-    img = ImageTk.getimage( imgtk )
+    img = Image.fromarray(framebuffer)
     img.save(f"{name}.png")
 
-class Light_source:
+def show_framebuffer(canvas,framebuffer):
     """
-    class to store the position and color of the light source
-
-    Attributes:"""
-    """numpy array of shape (3,) representing the position"""
-    position: np.array
-    """Can be one of "white","red","green","blue" """
-    color: str
-
-    def __init__(self,position,color):
-        self.position = position
-        if color not in ["white","red","green","blue"]:
-            raise ValueError("Color must be one of 'white','red','green','blue'")
-        self.color = color
+    Displays the framebuffer on the Tkinter canvas - the whole image is uploaded in one operation.
+    The framebuffer is stored in canvas.framebuffer (used for saving the image) and the Tkinter image in canvas.image.
 
-class camera:
-    """ 
-    class to store the position and rotation of the camera
-
-    To change the position and rotation of the camera use the translate and rotate methods
-"""
+    canvas: Tkinter canvas of the same size as the framebuffer
+    framebuffer: numpy array of shape (height,width,3) and dtype uint8
+    """
+    height,width,_ = framebuffer.shape
 
-    position: np.array
-    """numpy array of shape (3,) representing the position of the camera"""
+    image = ImageTk.PhotoImage(Image.fromarray(framebuffer),master=canvas)
 
-    rotation:np.array
-    """numpy array of shape (3,3) representing the rotation matrix"""
+    canvas.framebuffer = framebuffer
+    canvas.image = image
+    canvas.create_image((width // 2, height // 2), image=image, anchor=tk.CENTER)
 
-    def __init__(self,position=np.array([0,0,0])):
-        self.position = position
-        self.rotation = np.eye(3)
-    def rotate(self,rotation_matrix):
-        """
-        Rotate the camera by the given rotation matrix
 
-        rotation_matrix: numpy array of shape (3,3)
-        """
-        self.rotation = rotation_matrix @ self.rotation
-    def translate(self,translation_vector):
-        """
-        Translate the camera by the given translation vector
-        translation_vector: numpy array of shape (3,)
-        """
-        self.position = self.position + translation_vector
+def next_id(names):
+    """
+    Returns the smallest id that is larger than the numbers at the end of all the given names (e.g. box3, combined-union7 -> 8)
+    """
+    largest = -1
+    for name in names:
+        digits = len(name) - len(name.rstrip("0123456789"))
+        if digits > 0:
+            largest = max(largest,int(name[-digits:]))
+    return largest + 1
 
 class Log():
     """
@@ -138,6 +129,87 @@ class App:
 
     light_id: int
     """used to assign unique ids to light sources"""
+
+    tile_size: int
+    """size of the square tiles the frame is split into when rendering"""
+
+    use_bvh: bool
+    """whether the renderer queries the objects through a bounding volume hierarchy (bvh.BVH) - pays off for scenes with many objects"""
+
+    scene_bvh: bvh.BVH
+    """bounding volume hierarchy over the objects - None if it has to be rebuilt before the next render"""
+
+    use_distance_grids: bool
+    """whether the renderer marches with the baked distance grids of the objects (distance_grid.py) - faster repeated renders of complex objects"""
+
+    progressive: bool
+    """whether full renders are shown progressively - first at 1/8 of the resolution, then refined up to the full resolution"""
+
+    antialiasing: bool
+    """whether the edges are smoothed with extra sub-pixel samples of only the pixels on the edges (see rendering.antialias_frame)"""
+
+    cone_marching: bool
+    """whether the rays of every block of pixels skip the empty space found by one shared cone first (see rendering.cone_distances)"""
+
+    relaxation: float
+    """over-relaxation factor of the sphere tracing (see ray_marching.march_rays) - 1 is the standard sphere tracing"""
+
+    normals: str
+    """how the normals are calculated - one of rendering.NORMAL_METHODS (see rendering.get_normal)"""
+
+    processes: int
+    """number of workers of the renderer - processes or threads, all the available cores by default (see rendering.available_cores)"""
+
+    backend: str
+    """how the renderer runs its tasks - one of rendering.BACKENDS: worker processes, worker threads or one by one (for debugging and profiling)"""
+
+    chunksize: int
+    """number of tiles sent to a worker at once"""
+
+    render_pool: rendering.Render_pool
+    """workers of the renderer - kept between the renders together with the last scene sent to them, restarted when processes or backend change"""
+
+    scene_version: int
+    """counter of the changes of the objects (see objects_changed) - the objects are sent to the workers again only when it changes"""
+
+    prepared_objects: tuple
+    """(scene version, objects prepared by rendering.prepare_objects) of the last render - the objects are prepared again only when the version changes"""
+
+    metrics_file: str
+    """path of the file the timings of every finished render are appended to as JSON lines (see rendering.append_metrics) - None (the default) writes no file"""
+
+    last_frame: np.array
+    """framebuffer of the last render - None before the first render"""
+
+    last_frame_view: tuple
+    """size, camera, light sources and render settings of the last render (see view_key) - the last frame can be reused only for the same view"""
+
+    changed_spheres: list
+    """bounding spheres of the regions of the scene changed since the last render - None if the whole frame has to be rendered again"""
+
+    render_cancel: threading.Event
+    """cancel event of the render running in the background - None if no render is running"""
+
+    render_messages: queue.Queue
+    """messages from the background render to the Tkinter thread - progress, finished frames and errors (see render_in_background)"""
+
+    render_view: tuple
+    """view_key of the render running in the background"""
+
+    render_spheres: list
+    """changed_spheres the render running in the background is updating - restored if the render does not finish"""
+
+    render_start: float
+    """time when the render running in the background was started"""
+
+    render_logged_percent: int
+    """progress of the render running in the background written to the log most recently"""
+
+    render_timings: dict
+    """timings of the phases of the render running in the background (see rendering.RENDER_PHASES)"""
+
+    render_record: dict
+    """description of the render running in the background written to the metrics file - mode, scene size, resolution, worker count, backend and chunk size"""
     
     log: Log
     """Log object to write out actions performed in the application"""
@@ -157,6 +229,7 @@ class App:
         self.canvas = tk.Canvas(self.canvas_window,width=self.width,height=self.height,bg="black")
         self.canvas.pack()
         self.canvas.image = None
+        self.canvas.framebuffer = None
 
         #used for assigning ids to objects
         self.object_id = 0 
@@ -165,12 +238,49 @@ class App:
         self.light_sources = dict()
         self.add_light(position=light_pos)
 
+        self.tile_size = 32
+
+        self.use_bvh = True
+        self.scene_bvh = None
+
+        self.use_distance_grids = False
+
+        self.progressive = True
+
+        self.antialiasing = True
+
+        self.cone_marching = False
+
+        self.relaxation = 1
+
+        self.normals = "tetrahedral"
+
+        self.processes = rendering.available_cores()
+        self.backend = "process"
+        self.chunksize = 1
+        self.render_pool = rendering.Render_pool(self.processes,self.backend,self.chunksize)
+        self.scene_version = 0
+        self.prepared_objects = None
+
+        self.metrics_file = None
+
+        self.last_frame = None
+        self.last_frame_view = None
+        self.changed_spheres = None
 
-    #function to render the scene
+        self.render_cancel = None
+        self.render_messages = queue.Queue()
+
+
+    #functions to render the scene
     def render(self):
         """
-        Renders the scene onto the canvas in the canvas window and starts the Tkinter main loop for that window 
+        Starts rendering the scene onto the canvas in the canvas window. The render runs in a background thread (see render_in_background),
+        so the UI stays responsive - the progress is written to the log and the frame is shown when it is finished.
+        A render that is still running is cancelled and superseded by the new one.
         """
+        if self.render_cancel is not None:
+            self.cancel_render(superseded=True)
 
         #clear the window of any previous canvas
         for widget in self.canvas_window.winfo_children():
@@ -178,17 +288,184 @@ class App:
 
         canvas = tk.Canvas(self.canvas_window,width=self.width,height=self.height,bg="black")
         canvas.pack()
+        canvas.image = None
+        canvas.framebuffer = None
 
         self.canvas = canvas
-        #render the scene and print the time taken
-        start_time = time.time()
-        self.log.write("Rendering scene...")
-        rendering.render_scene(self.canvas,self.objects,self.camera,self.light_sources)
-        end_time = time.time()
-        self.log.write(f"Scene rendered in {end_time - start_time:.2f} seconds")
 
-        print("Rendering complete")
-        self.canvas_window.mainloop()
+        #the prepared objects also depend on the BVH and distance grid settings
+        scene_version = (self.scene_version,self.use_bvh,self.use_distance_grids)
+
+        #the render works on a snapshot of the scene - the objects can be edited while it is running
+        #the snapshot of the last render is reused if the objects did not change since (e.g. only the camera or the light moved)
+        self.render_timings = dict()
+        if self.prepared_objects is None or self.prepared_objects[0] != scene_version:
+            with rendering.timed(self.render_timings,"scene_preparation"):
+                self.prepared_objects = (scene_version,rendering.prepare_objects(self.objects,self.get_bvh(),self.use_distance_grids))
+        objects = self.prepared_objects[1]
+        scene_camera = copy.deepcopy(self.camera)
+        light_sources = copy.deepcopy(self.light_sources)
+
+        view = self.view_key()
+        settings = rendering.Render_settings(self.tile_size,self.processes,self.backend,self.chunksize,self.use_distance_grids,antialiasing=self.antialiasing,cone_marching=self.cone_marching,relaxation=self.relaxation,normals=self.normals)
+        arguments = dict(settings=settings,pool=self.render_pool,scene_version=scene_version,timings=self.render_timings)
+        if self.last_frame is not None and self.changed_spheres is not None and view == self.last_frame_view:
+            #only the objects changed since the last render - the pixels that cannot see the changes are reused
+            show_framebuffer(self.canvas,self.last_frame)
+            #the changed pixels are found by the render in the background
+            self.log.write("Rendering the pixels changed since the last render...")
+            mode = "incremental"
+            arguments.update(previous_frame=self.last_frame,changed_spheres=list(self.changed_spheres))
+        else:
+            self.log.write("Rendering scene...")
+            mode = "progressive" if self.progressive else "full"
+
+        self.render_cancel = threading.Event()
+        self.render_view = view
+        self.render_spheres = self.changed_spheres
+        self.render_start = time.time()
+        self.render_logged_percent = 0
+        self.render_record = dict(mode=mode,**rendering.scene_size(self.objects),resolution=[self.width,self.height],workers=self.processes,backend=self.backend,chunksize=self.chunksize)
+        #changes made while the render is running are collected for the next render
+        self.changed_spheres = []
+
+        thread = threading.Thread(target=self.render_in_background,args=(self.render_cancel,mode,self.width,self.height,objects,scene_camera,light_sources,arguments),daemon=True)
+        thread.start()
+        self.canvas_window.after(RENDER_POLL_INTERVAL,self.poll_render)
+
+    def render_in_background(self,cancel,mode,width,height,objects,scene_camera,light_sources,arguments):
+        """
+        Runs in the background thread - renders the scene and sends the results to the Tkinter thread through render_messages
+        (Tkinter must only be used from its own thread). Every message starts with the cancel event of the render it belongs to.
+
+        cancel: threading.Event that cancels this render
+        mode: "incremental", "progressive" or "full"
+        width, height: size of the frame
+        objects, scene_camera, light_sources: snapshot of the scene (objects prepared by rendering.prepare_objects)
+        arguments: other keyword arguments of the render function
+        """
+        progress = lambda done,total: self.render_messages.put((cancel,"progress",done,total))
+        try:
+            if mode == "progressive":
+                for stride,framebuffer in rendering.render_progressive(width,height,objects,scene_camera,light_sources,cancel=cancel,progress=progress,**arguments):
+                    self.render_messages.put((cancel,"frame" if stride > 1 else "done",stride,framebuffer))
+            else:
+                framebuffer = rendering.render_frame(width,height,objects,scene_camera,light_sources,cancel=cancel,progress=progress,**arguments)
+                self.render_messages.put((cancel,"done",1,framebuffer))
+        except rendering.Render_cancelled:
+            pass
+        except Exception as error:
+            self.render_messages.put((cancel,"error",error,None))
+
+    def poll_render(self):
+        """
+        Handles the messages of the background render in the Tkinter thread - writes the progress to the log and shows the frames.
+        Reschedules itself while the render is running, messages of cancelled renders are ignored.
+        """
+        while not self.render_messages.empty():
+            cancel,kind,value,data = self.render_messages.get()
+            if cancel is not self.render_cancel:
+                continue
+
+            if kind == "progress":
+                percent = 100 * value // data
+                if self.render_logged_percent + 25 <= percent < 100:
+                    self.render_logged_percent = percent - percent % 25
+                    self.log.write(f"Rendering... {self.render_logged_percent}%")
+            elif kind == "frame":
+                with rendering.timed(self.render_timings,"canvas_upload"):
+                    show_framebuffer(self.canvas,data)
+                self.log.write(f"Rendered 1/{value} resolution preview in {time.time() - self.render_start:.2f} seconds")
+            elif kind == "done":
+                self.last_frame = data
+                self.last_frame_view = self.render_view
+                self.render_cancel = None
+                with rendering.timed(self.render_timings,"canvas_upload"):
+                    show_framebuffer(self.canvas,data)
+                self.log.write(f"Scene rendered in {time.time() - self.render_start:.2f} seconds")
+                self.log_timings()
+                return
+            else:
+                self.forget_render()
+                self.log.write(f"Rendering failed: {value}")
+                tk.messagebox.showerror("Error", f"Rendering failed:\n{value}")
+                return
+
+        if self.render_cancel is not None:
+            self.canvas_window.after(RENDER_POLL_INTERVAL,self.poll_render)
+
+    def log_timings(self):
+        """
+        Writes the timings of the phases of the finished render to the log and appends them to the metrics file
+        """
+        self.log.write(f"Phases: {rendering.format_timings(self.render_timings)}")
+        if self.metrics_file is None:
+            return
+        try:
+            rendering.append_metrics(self.metrics_file,self.render_timings,**self.render_record)
+        except OSError as error:
+            self.log.write(f"Could not write the metrics file {self.metrics_file}: {error}")
+
+    def cancel_render(self,superseded=False):
+        """
+        Cancels the render running in the background - its workers are terminated
+
+        superseded: True if a new render is started in place of the cancelled one
+        """
+        if self.render_cancel is None:
+            return
+        self.render_cancel.set()
+        self.forget_render()
+        self.log.write("Render superseded by a new render" if superseded else "Render cancelled")
+
+    def forget_render(self):
+        """
+        Forgets the render in flight after it was cancelled or failed - the changes it was supposed to show are kept for the next render
+        """
+        if self.render_spheres is None or self.changed_spheres is None:
+            self.changed_spheres = None
+        else:
+            self.changed_spheres = self.render_spheres + self.changed_spheres
+        self.render_cancel = None
+
+    def get_bvh(self):
+        """
+        Returns the bounding volume hierarchy over the objects (rebuilt if the objects were added or removed since the last render)
+        or None if it is turned off or there are too few objects for it to pay off
+        """
+        if not self.use_bvh or len(self.objects) <= bvh.LEAF_SIZE:
+            return None
+        if self.scene_bvh is None:
+            self.scene_bvh = bvh.BVH(self.objects.values())
+        return self.scene_bvh
+
+    def view_key(self):
+        """
+        Returns a tuple describing everything except the objects that the rendered frame depends on - size, camera, light sources
+        and the render settings that change the pixels (anti-aliasing, cone marching, relaxation, normals and distance grids)
+        """
+        lights = tuple((name,light.color,tuple(np.asarray(light.position,dtype=float))) for name,light in self.light_sources.items())
+        settings = (self.antialiasing,self.cone_marching,self.relaxation,self.normals,self.use_distance_grids)
+        return (self.width,self.height,tuple(np.asarray(self.camera.position,dtype=float)),self.camera.rotation.tobytes(),lights,settings)
+
+    def objects_changed(self,moved_only=False,changed_spheres=None):
+        """
+        Has to be called after every change of the objects, keeps the bounding volume hierarchy and the scene version up to date
+        and collects the regions of the scene the next render has to update
+
+        moved_only: True if objects were only translated or rotated - the BVH is refitted, otherwise it is rebuilt before the next render
+        changed_spheres: old and new bounding spheres of the changed objects - None if the whole frame has to be rendered again
+        """
+        self.scene_version += 1
+        if moved_only and self.scene_bvh is not None:
+            self.scene_bvh.refit()
+        else:
+            self.scene_bvh = None
+
+        if changed_spheres is None:
+            self.changed_spheres = None
+        elif self.changed_spheres is not None:
+            self.changed_spheres += changed_spheres
 
     #function to clear the scene
 
@@ -197,12 +474,53 @@ class App:
         Clears the scene by removing all objects and light sources from the scene
         """
         self.objects = dict()
+        self.objects_changed()
         self.light_sources = dict()
         self.object_id = 0
         self.light_id = 0
         self.log.clear()
         self.log.write("Cleared scene - all objects and light sources removed")
 
+    #functions for saving and loading the scene
+    def save_scene(self,path=None):
+        """
+        Saves the objects, the camera and the light sources to a scene file or opens a dialog to get the path if not provided
+        The .npz extension saves the compact binary form, any other extension the JSON form
+        """
+        if path is None:
+            path = get_scene_save_path()
+        if path is None:
+            return
+
+        scene.save_scene(path,self.objects,self.camera,self.light_sources)
+        self.log.write(f"Saved scene to {path}")
+
+    def load_scene(self,path=None):
+        """
+        Replaces the current scene with the scene from a scene file or opens a dialog to get the path if not provided
+        """
+        if path is None:
+            path = get_scene_open_path()
+        if path is None:
+            return
+
+        try:
+            objects,scene_camera,light_sources = scene.load_scene(path)
+        except (OSError,ValueError,KeyError) as error:
+            tk.messagebox.showerror("Error", f"Could not load scene {path}:\n{error}")
+            return
+
+        self.objects = objects
+        self.objects_changed()
+        self.camera = scene_camera
+        self.light_sources = light_sources
+
+        #new objects and lights must not reuse the ids of the loaded ones
+        self.object_id = next_id(objects.keys())
+        self.light_id = next_id(light_sources.keys())
+
+        self.log.write(f"Loaded scene from {path} - {len(objects)} objects, {len(light_sources)} light sources")
+
     #fuctions for adding, removing and manipulating objects
     def add_box(self):
         """
@@ -215,6 +533,7 @@ class App:
         
         #create the box and add it to the objects dictionary
         self.objects[f"box{self.object_id}"] = csg.CSG_object_node(csg.Box(d[0],d[1],d[2]))
+        self.objects_changed(changed_spheres=[self.objects[f"box{self.object_id}"].bounding_sphere()])
 
         #wrtite to log
         self.log.write(f"Added box{self.object_id} with dimensions {d[0]}, {d[1]}, {d[2]}")
@@ -233,6 +552,7 @@ class App:
             return
 
         self.objects[f"sphere{self.object_id}"] = csg.CSG_object_node(csg.Sphere(d[0]))
+        self.objects_changed(changed_spheres=[self.objects[f"sphere{self.object_id}"].bounding_sphere()])
         #wrtite to log
         self.log.write(f"Added sphere{self.object_id} with radius {d[0]}")
          #increment the object id
@@ -250,6 +570,7 @@ class App:
 
 
         self.objects[f"cylinder{self.object_id}"] = csg.CSG_object_node(csg.Cylinder(d[0],d[1]))
+        self.objects_changed(changed_spheres=[self.objects[f"cylinder{self.object_id}"].bounding_sphere()])
         self.log.write(f"Added cylinder{self.object_id} with radius {d[0]} and height {d[1]}")
         self.object_id += 1   
 
@@ -264,7 +585,8 @@ class App:
 
         if object_name in self.objects:
             self.log.write(f"Removed object {object_name}")
-            del self.objects[object_name]
+            removed = self.objects.pop(object_name)
+            self.objects_changed(changed_spheres=[removed.bounding_sphere()])
         else:
             print(f"Object {object_name} not found")
 
@@ -277,7 +599,9 @@ class App:
         object_name,translation_vector = get_translation(objects=self.objects)
 
         if object_name in self.objects:
+            old_sphere = self.objects[object_name].bounding_sphere()
             self.objects[object_name].translate(np.array(translation_vector))
+            self.objects_changed(moved_only=True,changed_spheres=[old_sphere,self.objects[object_name].bounding_sphere()])
             self.log.write(f"Translated object {object_name} by vector {translation_vector}")
         else:
             print(f"Object {object_name} not found")
@@ -298,7 +622,9 @@ class App:
             inverse_rot_mat = rotation.rotation_matrix(angle,rotation_axis,inverse=True)
 
 
+            old_sphere = self.objects[object_name].bounding_sphere()
             self.objects[object_name].rotate(rot_mat,inverse_rot_mat)
+            self.objects_changed(moved_only=True,changed_spheres=[old_sphere,self.objects[object_name].bounding_sphere()])
             self.log.write(f"Rotated object {object_name} by {np.degrees(angle)} degrees along the {rotation_axis} axis")
 
         else:
@@ -328,9 +654,11 @@ class App:
             self.log.write(f"Combined objects {obj_name1} and {obj_name2} using {operation} to create combined-{operation}{self.object_id}")
             self.object_id += 1
 
-            #remove the original objects
+            #remove the original objects - the combined object lies inside of their bounding spheres
+            changed_spheres = [self.objects[obj_name1].bounding_sphere(),self.objects[obj_name2].bounding_sphere()]
             del self.objects[obj_name1]
             del self.objects[obj_name2]
+            self.objects_changed(changed_spheres=changed_spheres)
         else:
             print(f"One or both objects not found: {obj_name1}, {obj_name2}")
 
@@ -404,6 +732,20 @@ class App:
         self.height = height
         self.log.write(f"Changed resolution to {width}x{height}")
 
+    def change_render_settings(self):
+        """
+        Opens a dialog to choose the backend, the number of workers, the chunk size, the anti-aliasing, the cone marching,
+        the over-relaxation factor and the normal method of the renderer - used from the next render
+        """
+        settings = get_render_settings(rendering.BACKENDS,self.backend,self.processes,self.chunksize,
+                                       self.antialiasing,self.cone_marching,self.relaxation,rendering.NORMAL_METHODS,self.normals)
+        if settings is None:
+            return
+        self.backend,self.processes,self.chunksize,self.antialiasing,self.cone_marching,self.relaxation,self.normals = settings
+        self.log.write(f"Rendering with the {self.backend} backend, {self.processes} workers and {self.chunksize} tiles per chunk")
+        options = [name for name,used in (("anti-aliasing",self.antialiasing),("cone marching",self.cone_marching)) if used]
+        self.log.write(f"Relaxation {self.relaxation:g}, {self.normals} normals" + "".join(f", {option}" for option in options))
+
     
     #UI
     def setup_ui(self):
@@ -417,10 +759,11 @@ class App:
             4. Camera and lighting controls : move camera, rotate camera, add light, remove light
             5. Log of actions performed: shows all the actions performed in the application
 
-        3 buttons:
+        buttons:
             button to render the scene 
             button to change the resolution of the rendering screen
             button to save the rendered image
+            buttons to save and load the scene
 
         """
         root = tk.Tk()
@@ -491,7 +834,7 @@ class App:
         clear_scene_button.grid(row=1,column=1,padx=10,pady=10)
 
         #save image button
-        save_image_button = ttk.Button(main_container,command=lambda: save_image(self.canvas.image),text="Save image")
+        save_image_button = ttk.Button(main_container,command=lambda: save_image(self.canvas.framebuffer),text="Save image")
         save_image_button.grid(row=1,column=2,padx=10,pady=10)
 
 
@@ -512,7 +855,7 @@ class App:
         
         #Log of all the actions that were performed
         panel5 = ttk.Frame(main_container)
-        panel5.grid(row=0,column=4, padx=5,rowspan=2)
+        panel5.grid(row=0,column=4, padx=5,rowspan=3)
         log_container = ttk.LabelFrame(panel5,text="Action log",padding=10)
         log_container.grid(row=0,column=3,padx=5,pady=5)
         
@@ -521,6 +864,21 @@ class App:
         resolution_button = ttk.Button(main_container, text="Change resolution", command=lambda: self.change_resolution())
         resolution_button.grid(row=1,column=3,padx=5,pady=5)
 
+        #backend, number of workers, chunk size, anti-aliasing, cone marching, relaxation and normals of the renderer
+        render_settings_button = ttk.Button(main_container, text="Render settings", command=self.change_render_settings)
+        render_settings_button.grid(row=2,column=3,padx=5,pady=5)
+
+        #saving and loading the scene
+        save_scene_button = ttk.Button(main_container,command=self.save_scene,text="Save scene")
+        save_scene_button.grid(row=2,column=0,padx=10,pady=10)
+
+        load_scene_button = ttk.Button(main_container,command=self.load_scene,text="Load scene")
+        load_scene_button.grid(row=2,column=1,padx=10,pady=10)
+
+        #cancel button - stops the render running in the background
+        cancel_render_button = ttk.Button(main_container,command=self.cancel_render,text="Cancel render")
+        cancel_render_button.grid(row=2,column=2,padx=10,pady=10)
+
 
 
         self.log = Log(log_container)
@@ -530,6 +888,7 @@ class App:
         self.log.write("Added light source white0 at position " + str(self.light_sources["white0"].position))
 
         root.mainloop()
+        self.render_pool.close()
     
 if __name__ == "__main__":
     #resolution of the image
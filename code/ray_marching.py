@@ -1,23 +1,83 @@
+import bvh
+
 import numpy as np
+import functools
+
+TERMINATION_REASONS = ("hit","iteration_limit","clipping_distance","inside")
+"""why a ray stopped marching - the codes in the "reason" arrays of march_rays are the indices in this tuple:
+hit the surface, ran out of iterations, passed the clipping distance, ended up inside of an object (d < 0)"""
 
-def scene_sdf(objects,p):
+HIT,ITERATION_LIMIT,CLIPPING_DISTANCE,INSIDE = range(len(TERMINATION_REASONS))
+
+def scene_sdf(objects,p,with_ids=False,rays=None):
     """
     Calculate the signed distance from point p to the nearest object in the scene.
     If there are no objects in the scene, returns a large value 1000.
 
-    p: point in space where we want to calculate the SDF
+    p: point in space where we want to calculate the SDF - shape (3,) or a batch of points of shape (N,3)
     objects: list of all the CSG objects in the scene used to calculate the SDF
+    with_ids: also return which object and which of its primitives produced the distance (only for a batch of points)
+    rays: optional array of shape (N,) with the index of the ray every point lies on (see march_rays) - the objects with the method sdf_rays
+          get it, so they can leave out the rays that never come near them (see rendering.cull_objects)
+
+    returns: the distances - with with_ids also the object ids (the object_id of the nearest object, see rendering.prepare_objects)
+    and the leaf ids (index of the primitive within that object, see CSG_tape.sdf_leaf), -1 where unknown
     """
+    if with_ids:
+        return scene_sdf_ids(objects,p)
 
     if len(objects) == 0:
-        return 1000
+        return np.full(np.shape(p)[:-1],1000.0) if np.ndim(p) > 1 else 1000
     else:
         #return the maximum distance the ray can march without hitting an object
-        return min(map(lambda object: object.sdf(p),objects)) 
+        if rays is not None:
+            return functools.reduce(np.minimum,map(lambda object: object.sdf_rays(p,rays) if hasattr(object,"sdf_rays") else object.sdf(p),objects))
+        return functools.reduce(np.minimum,map(lambda object: object.sdf(p),objects))
+
+
+def scene_sdf_ids(objects,p):
+    """
+    scene_sdf with with_ids=True - the distances, object ids and leaf ids of a batch of points of shape (N,3)
+    """
+    distance = np.full(len(p),1000.0)
+    object_ids = np.full(len(p),-1)
+    leaf_ids = np.full(len(p),-1)
+    for object in objects:
+        if isinstance(object,bvh.BVH):
+            #a BVH reports the ids of its own items
+            object_distance,object_object_ids,object_leaf_ids = object.sdf_ids(p)
+        else:
+            object_distance,object_leaf_ids = object.sdf_leaf(p)
+            object_object_ids = getattr(object,"object_id",-1)
+        closer = object_distance < distance
+        distance = np.where(closer,object_distance,distance)
+        object_ids = np.where(closer,object_object_ids,object_ids)
+        leaf_ids = np.where(closer,object_leaf_ids,leaf_ids)
+    return distance,object_ids,leaf_ids
+
+
+def scene_sdf_gradient(objects,p):
+    """
+    Calculate the signed distance from point p to the nearest object in the scene and the gradient of the SDF of that object
+    (see CSG_object_node.sdf_gradient) - the analytic normal of the surface.
+
+    p: a batch of points of shape (N,3)
+    objects: list of all the CSG objects in the scene
+
+    returns: (distances of shape (N,), gradients of shape (N,3))
+    """
+    distance = np.full(len(p),1000.0)
+    gradient = np.zeros((len(p),3))
+    for object in objects:
+        object_distance,object_gradient = object.sdf_gradient(p)
+        closer = object_distance < distance
+        distance = np.where(closer,object_distance,distance)
+        gradient[closer] = object_gradient[closer]
+    return distance,gradient
 
 
 
-def cast_ray(objects,starting_point,direction_vector, iteration_limit= 100,precision = 0.001,clipping_distance=100):
+def cast_ray(objects,starting_point,direction_vector, iteration_limit= 100,precision = 0.001,clipping_distance=100,relaxation=1,with_stats=False):
     """
     Cast a ray from a starting point in a given direction using the ray marching algorithm.
     Is limited by iteration_limit(maximum number of iterations) and clipping_distance(maximum distance from the starting point).
@@ -28,33 +88,206 @@ def cast_ray(objects,starting_point,direction_vector, iteration_limit= 100,preci
     iteration_limit: maximum number of iterations to perform
     precision: minimum distance to consider a hit
     clipping_distance: maximum distance the ray can travel before we consider it a miss
+    relaxation: over-relaxation factor omega - the ray steps by omega * d instead of d (see march_rays), 1 is the standard sphere tracing
+    with_stats: also return how the ray was marched - see the keys "steps", "evaluations" and "reason"
 
     returns: dictionary with keys "hit" (boolean), "distance" (float), "point" (numpy array)
+    - with with_stats also "steps" (number of steps forward), "evaluations" (number of SDF evaluations) and "reason" (one of TERMINATION_REASONS)
     """
 
     p = starting_point
     dist = 0
+    previous_d = 0
+    step = 0
+    steps = 0
+    evaluations = 0
+
+    def finished(reason,**result):
+        if with_stats:
+            result.update(steps=steps,evaluations=evaluations,reason=TERMINATION_REASONS[reason])
+        return result
+
     for _ in range(iteration_limit):
         # TODO inside of the pbject 
         p = starting_point + dist * direction_vector
 
         d = scene_sdf(objects,p)
+        evaluations += 1
+
+        if step > previous_d and (d < 0 or d + previous_d < step):
+            #the relaxed step was too long - go back and take the standard step instead
+            dist += previous_d - step
+            step = previous_d
+            continue
 
         if d < 0:
             # the ray is inside of an object
-            return {"hit":False}
+            return finished(INSIDE,hit=False)
         
         if d < precision:
-            return {"hit":True,"distance" :dist,"point": p}
+            return finished(HIT,hit=True,distance=dist,point=p)
         
-        dist += d
+        previous_d = d
+        step = relaxation * d
+        dist += step
+        steps += 1
 
         if dist > clipping_distance:
             #the the ray is too far so we say it did not hit
-            return {"hit":False}
+            return finished(CLIPPING_DISTANCE,hit=False)
 
     #the ray did not hit anythig after the set about of iterations
-    return {"hit":False}
+    return finished(ITERATION_LIMIT,hit=False)
     
 
 
+
+
+def march_rays(objects,starting_point,direction_vectors, iteration_limit= 100,precision = 0.001,clipping_distance=100,start_distance=None,relaxation=1,with_stats=False):
+    """
+    Cast many rays at once using the ray marching algorithm - the vectorized version of cast_ray.
+    All the rays are advanced together as numpy arrays. Rays that hit, end up inside an object or pass the clipping distance
+    are removed from the active set so later iterations only work on the rays that are still marching.
+
+    objects: list of all the CSG objects in the scene - used to calculate the SDF, the objects culled for some of the rays
+             (see rendering.cull_objects) get the indices of the rays of the points (see scene_sdf)
+    starting_point: the point from which the rays are cast - numpy array of shape (3,) or (N,3) (one starting point per ray)
+    direction_vectors: normalized direction vectors of the rays - numpy array of shape (N,3)
+    iteration_limit: maximum number of iterations to perform
+    precision: minimum distance to consider a hit
+    clipping_distance: maximum distance a ray can travel before we consider it a miss
+    start_distance: optional array of shape (N,) with the distances along the rays at which the marching starts -
+                    the rays have to be known to be empty up to them (e.g. from march_cones)
+    relaxation: over-relaxation factor omega (1 - standard sphere tracing, usually 1.2 - 1.8) - the rays step by omega * d.
+                The step is safe as long as the spheres of radius d before and after the step overlap (d + previous d >= step).
+                When they do not (or the ray ends up inside of an object) the ray goes back and takes the standard step instead,
+                so no surface is skipped and the hits are the same as with the standard sphere tracing (within precision)
+    with_stats: also return how every ray was marched (the keys "steps", "evaluations" and "reason")
+
+    returns: dictionary with keys 
+        "hit" - boolean array of shape (N,)
+        "distance" - array of shape (N,) with the distance travelled by each ray (np.inf for rays that did not hit)
+        "point" - array of shape (N,3) with the hit points (np.nan for rays that did not hit)
+        with with_stats also
+        "steps" - int array of shape (N,) with the number of steps forward of each ray
+        "evaluations" - int array of shape (N,) with the number of SDF evaluations of each ray (the steps that went back included)
+        "reason" - int array of shape (N,) with the index of the reason the ray stopped in TERMINATION_REASONS
+    """
+    starting_point = np.asarray(starting_point,dtype=float)
+    direction_vectors = np.asarray(direction_vectors,dtype=float)
+    n = len(direction_vectors)
+
+    hit = np.zeros(n,dtype=bool)
+    distance = np.full(n,np.inf)
+    point = np.full((n,3),np.nan)
+
+    dist = np.zeros(n) if start_distance is None else np.array(start_distance,dtype=float)
+    #indices of the rays that are still marching
+    active = np.arange(n)[dist <= clipping_distance]
+
+    if with_stats:
+        steps = np.zeros(n,dtype=int)
+        evaluations = np.zeros(n,dtype=int)
+        reason = np.full(n,ITERATION_LIMIT)
+        reason[dist > clipping_distance] = CLIPPING_DISTANCE
+
+    relaxed = relaxation > 1
+    if relaxed:
+        #the SDF at the previous point and the length of the last step of every ray
+        previous_d = np.zeros(n)
+        step = np.zeros(n)
+
+    for _ in range(iteration_limit):
+        if len(active) == 0:
+            break
+
+        origins = starting_point[active] if starting_point.ndim == 2 else starting_point
+        p = origins + dist[active,None] * direction_vectors[active]
+
+        d = scene_sdf(objects,p,rays=active)
+        if with_stats:
+            evaluations[active] += 1
+
+        if relaxed:
+            # the rays whose relaxed step was too long go back and take the standard step from the previous point
+            failed = (step[active] > previous_d[active]) & ((d < 0) | (d + previous_d[active] < step[active]))
+            if failed.any():
+                back = active[failed]
+                dist[back] += previous_d[back] - step[back]
+                step[back] = previous_d[back]
+                d = np.where(failed,np.inf,d)
+
+        # the rays with d < 0 are inside of an object - they did not hit
+        hits = (d >= 0) & (d < precision)
+        hit[active[hits]] = True
+        distance[active[hits]] = dist[active[hits]]
+        point[active[hits]] = p[hits]
+
+        marching = d >= precision
+        if with_stats:
+            reason[active[hits]] = HIT
+            reason[active[d < 0]] = INSIDE
+            steps[active[marching & ~failed if relaxed else marching]] += 1
+        if relaxed:
+            #the rays that went back already moved, the others step by omega * d
+            stepping = marching & ~failed
+            forward = active[stepping]
+            previous_d[forward] = d[stepping]
+            step[forward] = relaxation * d[stepping]
+            dist[forward] += step[forward]
+            active = active[marching]
+        else:
+            active = active[marching]
+            dist[active] += d[marching]
+
+        #the rays that are too far are considered a miss
+        clipped = dist[active] > clipping_distance
+        if with_stats:
+            reason[active[clipped]] = CLIPPING_DISTANCE
+        active = active[~clipped]
+
+    #the rays that are still active did not hit anything after the set amount of iterations
+    if with_stats:
+        return {"hit":hit,"distance":distance,"point":point,"steps":steps,"evaluations":evaluations,"reason":reason}
+    return {"hit":hit,"distance":distance,"point":point}
+
+
+
+def march_cones(objects,starting_point,axes,spreads,iteration_limit=100,precision=0.001,clipping_distance=100):
+    """
+    Marches cones of rays - every cone is a group of neighbouring rays with the same starting point, described by its axis
+    and its spread (the largest distance between the axis and a normalized direction of the group, see rendering.cone_distances).
+    The result is the distance each ray of the cone can skip before it is marched on its own.
+
+    At the distance t along the axis every ray of the cone is at most t * spread away from the point on the axis,
+    so its distance to the nearest surface is at least d - t * spread, where d is the scene SDF on the axis.
+    All the rays can therefore step by d - t * spread together. A cone stops when the step becomes smaller than
+    the width of the cone (or than precision) - the rays are then close to a surface and have to be marched separately.
+
+    objects: list of all the CSG objects in the scene - used to calculate the SDF
+    starting_point: the point from which the rays are cast - numpy array of shape (3,)
+    axes: normalized axes of the cones - numpy array of shape (M,3)
+    spreads: numpy array of shape (M,) with the spreads of the cones
+    iteration_limit, precision, clipping_distance: same as march_rays
+
+    returns: numpy array of shape (M,) with the distances the rays of each cone can skip
+    (more than clipping_distance if the whole cone is empty up to the clipping distance)
+    """
+    starting_point = np.asarray(starting_point,dtype=float)
+    n = len(axes)
+    dist = np.zeros(n)
+    active = np.arange(n)
+
+    for _ in range(iteration_limit):
+        if len(active) == 0:
+            break
+
+        p = starting_point + dist[active,None] * axes[active]
+        width = dist[active] * spreads[active]
+        step = scene_sdf(objects,p) - width
+
+        #the last step of a stopping cone is still safe
+        dist[active] += np.maximum(step,0)
+        active = active[(step >= np.maximum(width,precision)) & (dist[active] <= clipping_distance)]
+
+    return dist
@@ -0,0 +1,105 @@
+"""
+Headless command line renderer - renders a scene file straight to an image file without opening any window.
+
+usage (from the code directory):
+    python -m render scene.json --out frame.png --size 1920x1080 --workers 4 --backend process
+"""
+import rendering
+import scene
+import bvh
+
+import argparse
+import json
+import time
+import numpy as np
+from PIL import Image
+
+
+def parse_size(text:str):
+    """
+    Parses a resolution in the form WIDTHxHEIGHT (e.g. 1920x1080) and returns the tuple (width,height)
+    """
+    try:
+        width,height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size {text} - expected WIDTHxHEIGHT, e.g. 1920x1080")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"Invalid size {text} - width and height must be positive")
+    return width,height
+
+
+def positive_int(text:str):
+    """
+    Parses a positive integer (e.g. the number of workers) and returns it
+    """
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid number {text} - expected a positive integer")
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"Invalid number {text} - expected a positive integer")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a CSG scene file to an image without the GUI")
+    parser.add_argument("scene",help="scene file (.json or .npz)")
+    parser.add_argument("--out",default="frame.png",help="path of the output image (default: frame.png)")
+    parser.add_argument("--size",type=parse_size,default=(400,400),help="resolution WIDTHxHEIGHT (default: 400x400)")
+    parser.add_argument("--workers",type=positive_int,default=None,help="number of workers (default: all the available cores)")
+    parser.add_argument("--backend",choices=rendering.BACKENDS,default="process",help="how the tiles are rendered - worker processes, worker threads or one by one for debugging and profiling (default: process)")
+    parser.add_argument("--chunk-size",type=positive_int,default=1,help="number of tiles sent to a worker at once (default: 1)")
+    parser.add_argument("--tile-size",type=positive_int,default=32,help="size of the square tiles the frame is split into (default: 32)")
+    parser.add_argument("--bvh",action="store_true",help="query the objects through a bounding volume hierarchy (faster for scenes with many objects)")
+    parser.add_argument("--distance-grids",action="store_true",help="bake complex objects into distance grids before marching (see distance_grid.py)")
+    parser.add_argument("--antialias",action="store_true",help="smooth the edges with extra sub-pixel samples of the pixels on the edges")
+    parser.add_argument("--relaxation",type=float,default=1,help="over-relaxation factor omega of the sphere tracing, e.g. 1.2 (default: 1 - standard sphere tracing)")
+    parser.add_argument("--normals",choices=rendering.NORMAL_METHODS,default="tetrahedral",help="how the normals are calculated (default: tetrahedral)")
+    parser.add_argument("--cone-marching",action="store_true",help="march one cone per block of 8x8 pixels before the rays (see rendering.cone_distances)")
+    parser.add_argument("--object-ids",metavar="FILE",help="also save the object id buffer to FILE (.npz with the array ids - the index of the hit object of every pixel, -1 for misses - and the array names of the objects)")
+    parser.add_argument("--buffers",metavar="FILE",help="also save the depth, normal and object id buffers of the frame to FILE (.npz with the arrays depth, normal and object_id)")
+    parser.add_argument("--heatmap",metavar="FILE",help="also render the scene instrumented and save the heatmap of the number of steps of every ray to FILE")
+    parser.add_argument("--heatmap-values",choices=("steps","evaluations"),default="steps",help="what the heatmap shows - the steps or the SDF evaluations of every pixel (default: steps)")
+    parser.add_argument("--stats",metavar="FILE",help="also render the scene instrumented and save the summary (termination reasons, histogram of the steps) as JSON to FILE")
+    parser.add_argument("--metrics",metavar="FILE",help="append the timings of the phases of the render as a JSON line to FILE (with the scene size, resolution and worker count)")
+    args = parser.parse_args(argv)
+
+    objects,camera,light_sources = scene.load_scene(args.scene)
+    width,height = args.size
+
+    #the workers are set by the pool
+    settings = rendering.Render_settings(tile_size=args.tile_size,use_distance_grids=args.distance_grids,antialiasing=args.antialias,cone_marching=args.cone_marching,relaxation=args.relaxation,normals=args.normals)
+    #the statistics render reuses the workers and the scene of the render
+    with rendering.Render_pool(args.workers,args.backend,args.chunk_size) as pool:
+        timings = dict()
+        start_time = time.time()
+        scene_bvh = bvh.BVH(objects.values()) if args.bvh else None
+        framebuffer = rendering.render_frame(width,height,objects,camera,light_sources,settings,pool=pool,scene_version=0,scene_bvh=scene_bvh,return_buffers=args.object_ids is not None or args.buffers is not None,timings=timings)
+        end_time = time.time()
+
+        if isinstance(framebuffer,tuple):
+            framebuffer,buffers = framebuffer
+            if args.object_ids is not None:
+                np.savez_compressed(args.object_ids,ids=buffers["object_id"],names=np.array(list(objects.keys())))
+            if args.buffers is not None:
+                np.savez_compressed(args.buffers,**buffers)
+        Image.fromarray(framebuffer).save(args.out)
+        print(f"Rendered {len(objects)} objects at {width}x{height} in {end_time - start_time:.2f} seconds -> {args.out}")
+        if args.metrics is not None:
+            print(f"Phases: {rendering.format_timings(timings)}")
+            rendering.append_metrics(args.metrics,timings,mode="headless",**rendering.scene_size(objects),resolution=[width,height],workers=pool.processes,backend=pool.backend,chunksize=pool.chunksize)
+
+        if args.heatmap is not None or args.stats is not None:
+            statistics = rendering.render_statistics(width,height,objects,camera,light_sources,settings,pool=pool,scene_version=0,scene_bvh=scene_bvh)
+            summary = rendering.statistics_summary(statistics)
+            if args.heatmap is not None:
+                Image.fromarray(rendering.heatmap(statistics[args.heatmap_values])).save(args.heatmap)
+            if args.stats is not None:
+                with open(args.stats,"w") as file:
+                    json.dump(summary,file,indent=2)
+            reasons = ", ".join(f"{name}: {values['rays']}" for name,values in summary["reasons"].items())
+            print(f"Mean {summary['mean_steps']:.1f} steps and {summary['mean_evaluations']:.1f} SDF evaluations per pixel (max {summary['max_steps']} steps) - {reasons}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,165 @@
-import tkinter as tk
 import ray_marching
+import csg
+import csg_tape
+import bvh
+import distance_grid
 import numpy as np
+import os
 import multiprocessing
+import multiprocessing.pool
+from multiprocessing import shared_memory
+import threading
+import contextlib
+import copy
+import json
+import pickle
+import time
 
 
-def get_normal(objects,point,epsilon=0.001):
+NORMAL_METHODS = ("tetrahedral","central","analytic")
+"""ways to calculate the normals - see get_normal"""
+
+# the four offsets of the tetrahedral estimator - the corners of a tetrahedron around the point
+TETRAHEDRON = np.array([[1,-1,-1],[-1,-1,1],[-1,1,-1],[1,1,1]],dtype=float)
+
+# the six offsets of the central differences
+CENTRAL_OFFSETS = np.array([[1,0,0],[-1,0,0],[0,1,0],[0,-1,0],[0,0,1],[0,0,-1]],dtype=float)
+
+NORMAL_EVALUATIONS = {"tetrahedral": len(TETRAHEDRON),"central": len(CENTRAL_OFFSETS),"analytic": 1}
+"""number of SDF evaluations of one normal with each of the NORMAL_METHODS"""
+
+
+RENDER_PHASES = ("scene_preparation","cone_marching","pool_startup","scene_broadcast","task_serialization","ray_generation","marching","normals","shading","image_assembly","canvas_upload")
+"""phases of a render timed separately (see timed) - the phases in WORKER_PHASES are CPU times summed over all the workers,
+the others are wall-clock times of the process that runs the render - image_assembly and scene_broadcast also include the CPU time of the workers
+writing their pixels into the shared frame (see Shared_frame) and loading the shared scene (see Render_pool),
+ray_generation also includes the time the render process spends calculating the shared ray directions of a new view (see Render_pool.share_ray_directions)"""
+
+WORKER_PHASES = ("ray_generation","marching","normals","shading")
+"""phases of a render that run in the worker processes - see RENDER_PHASES"""
+
+
+@contextlib.contextmanager
+def timed(timings,phase,clock=time.perf_counter):
+    """
+    Adds the time spent in the with block to timings[phase] - does nothing if timings is None
+
+    timings: dictionary phase -> seconds (see RENDER_PHASES)
+    clock: the clock - wall-clock time by default, time.thread_time for the CPU time of the thread
+           (the work of the workers, which can share the cores with each other)
+    """
+    if timings is None:
+        yield
+        return
+    start_time = clock()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase,0) + clock() - start_time
+
+
+def format_timings(timings):
+    """
+    Returns the timings of the phases of a render as one line of text for the log - the phases in the order of RENDER_PHASES
+    """
+    parts = [f"{phase.replace('_',' ')} {timings[phase]:.3f} s" for phase in RENDER_PHASES if phase in timings]
+    return ", ".join(parts) + " (ray generation, marching, normals and shading: CPU time of all the workers)"
+
+
+def scene_size(all_objects):
+    """
+    Returns the size of the scene - dictionary with the number of objects and primitives (all_objects: dictionary of CSG objects)
     """
-    Calculate the normal vector at a given point on the surface of an object using central differences.
+    return {"objects": len(all_objects),"primitives": sum(node.leaf_count() for node in all_objects.values())}
+
+
+def append_metrics(path,timings,**record):
+    """
+    Appends one render to the metrics file as a JSON line - the time, the fields of record (e.g. scene size, resolution, worker count)
+    and the timings of the phases
+
+    path: path of the metrics file (JSON lines - one JSON object per line)
+    timings: dictionary phase -> seconds (see RENDER_PHASES)
+    """
+    line = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),**record,"phases": {phase: timings[phase] for phase in RENDER_PHASES if phase in timings}}
+    if "total" in timings:
+        line["total"] = timings["total"]
+    with open(path,"a") as file:
+        file.write(json.dumps(line) + "\n")
+
+
+def get_normal(objects,point,epsilon=0.001,method="tetrahedral",object_ids=None):
+    """
+    Calculate the normal vector at a given point on the surface of an object - the normalized gradient of the scene SDF.
 
     objects: list of all the CSG objects in the scene - used to calculate the SDF
-    point: the point on the surface of the object where we want to calculate the normal vector
-    epsilon: small value used for central differences
-
-    returns: normal vector as a numpy array
-    """
-    #calculate the normal at a point on the surface of an object using central differences
-    #the gradient of the SDF at that point should be perpendicular to the surface 
-    dx = np.array([epsilon,0,0])
-    dy = np.array([0,epsilon,0])
-    dz = np.array([0,0,epsilon])
-
-    #this  might be a bit too expensive but well see
-    normal = np.array([
-        ray_marching.scene_sdf(objects,point + dx) - ray_marching.scene_sdf(objects,point - dx),
-        ray_marching.scene_sdf(objects,point + dy) - ray_marching.scene_sdf(objects,point - dy),
-        ray_marching.scene_sdf(objects,point + dz) - ray_marching.scene_sdf(objects,point - dz),
-    ])
-    normal /= np.linalg.norm(normal)
+    point: the point on the surface of the object where we want to calculate the normal vector - shape (3,) or a batch of points (N,3)
+    epsilon: small value used for the finite differences
+    method: one of NORMAL_METHODS
+        "tetrahedral" - the SDF at the four corners of a tetrahedron around the point, sum(f(p + epsilon * k) * k) is the gradient
+                        up to a constant factor - 4 SDF evaluations per point instead of 6
+        "central" - central differences along the three axes - 6 SDF evaluations per point
+        "analytic" - the exact gradient of the primitive that produces the distance, passed through the CSG operations
+                     (see CSG_object_node.sdf_gradient) - one evaluation of the scene with gradients, no finite differences
+    object_ids: optional array of shape (N,) with the object_id of the object each point lies on (see ray_marching.scene_sdf with with_ids=True) -
+                the normal is then calculated from the SDF of only that object, so its cost does not depend on the number of objects in the scene
+
+    returns: normal vector as a numpy array (one normal per row for a batch of points)
+    """
+    if np.ndim(point) == 1:
+        return get_normal(objects,np.asarray(point)[None],epsilon,method)[0]
+
+    if object_ids is not None:
+        normal = np.zeros((len(point),3))
+        by_id = objects_by_id(objects)
+        unknown = np.ones(len(point),dtype=bool)
+        for object_id in np.unique(object_ids):
+            if object_id in by_id:
+                selected = object_ids == object_id
+                normal[selected] = get_normal([by_id[object_id]],point[selected],epsilon,method)
+                unknown &= ~selected
+        if unknown.any():
+            normal[unknown] = get_normal(objects,point[unknown],epsilon,method)
+        return normal
+
+    if method == "analytic":
+        if len(objects) == 0:
+            return np.zeros((len(point),3))
+        _,normal = ray_marching.scene_sdf_gradient(objects,point)
+        return normal
+    elif method == "tetrahedral":
+        offsets = TETRAHEDRON
+    elif method == "central":
+        offsets = CENTRAL_OFFSETS
+    else:
+        raise ValueError(f"Unknown normal method {method}")
+
+    #all the offset points are evaluated in one call of the scene SDF - (offsets,N,3) -> (offsets,N)
+    samples = point[None,:,:] + epsilon * offsets[:,None,:]
+    distances = ray_marching.scene_sdf(objects,samples.reshape(-1,3)).reshape(len(offsets),len(point))
+    normal = np.einsum("kn,kj->nj",distances,offsets)
+    normal /= np.linalg.norm(normal,axis=-1,keepdims=True)
     return normal
 
 
+def objects_by_id(objects):
+    """
+    Returns a dictionary object_id -> object of the objects in the list (the items of a BVH are included) - see prepare_objects
+    """
+    by_id = dict()
+    for obj in objects:
+        for item in (obj.items if isinstance(obj,bvh.BVH) else [obj]):
+            if getattr(item,"object_id",-1) >= 0:
+                by_id[item.object_id] = item
+    return by_id
+
+
 def light_intensity(normal_vector,point,light_source):
     """
     Calculate the light intensity at a given point on the surface of an object. 
     Uses ambient and diffuse lighting model.
 
-    point: point on the surface of the object - numpy array
+    point: point on the surface of the object - numpy array of shape (3,) or a batch of points (N,3)
     normal_vector: normal vector at the point to the surface of the object - should be normalized
     light_source: position of the light source - numpy array
 
@@ -45,32 +169,122 @@ def light_intensity(normal_vector,point,light_source):
 
     #diffuse - depends on the angle between the light source and the normal vector
     light_direction = light_source - point
-    light_direction /= np.linalg.norm(light_direction)
+    light_direction = light_direction / np.linalg.norm(light_direction,axis=-1,keepdims=True)
     
-    diffuse_light = max(np.dot(normal_vector,light_direction),0)
+    diffuse_light = np.maximum(np.sum(normal_vector * light_direction,axis=-1),0)
+
+    return np.minimum(ambient_lighting + diffuse_light,1)
+
+
+class Culled_object:
+    """
+    An object of the scene together with the rays of a batch that intersect its bounding sphere (see cull_objects).
+    When the batch is marched (see ray_marching.march_rays) the object is evaluated only at the points of those rays,
+    the other rays get the distance 1000 of an empty scene - the distances a ray sees depend only on the ray itself,
+    not on the other rays of the batch, so the rendered image does not depend on how the frame is split into tiles or passes.
+    Outside of the marching (normals, object ids) it is the same as the object.
+    """
+
+    item: object
+    """the object - compiled CSG tape, distance grid or CSG_object_node"""
+
+    visible: np.array
+    """boolean np.array of shape (N,) - whether the ray of the batch intersects the bounding sphere of the object"""
+
+    def __init__(self,item,visible):
+        self.item = item
+        self.visible = visible
+        self.object_id = getattr(item,"object_id",-1)
+
+    def sdf_rays(self,p:np.array,rays):
+        """
+        calculates the signed distance at the points p of shape (M,3) lying on the rays (indices of shape (M,)) - 1000 for the rays
+        that do not intersect the bounding sphere of the object
+        """
+        selected = self.visible[rays]
+        if selected.all():
+            return self.item.sdf(p)
+        distance = np.full(len(p),1000.0)
+        if selected.any():
+            distance[selected] = self.item.sdf(p[selected])
+        return distance
+
+    def sdf(self,p:np.array):
+        return self.item.sdf(p)
+
+    def sdf_leaf(self,p:np.array):
+        return self.item.sdf_leaf(p)
+
+    def sdf_gradient(self,p:np.array):
+        return self.item.sdf_gradient(p)
 
-    return min(ambient_lighting + diffuse_light,1)
+    def bounding_sphere(self):
+        return self.item.bounding_sphere()
 
+    def bounding_sphere_intersection(self,ray_origin,ray_direction,margin=0):
+        return self.item.bounding_sphere_intersection(ray_origin,ray_direction,margin)
 
-def render_pixel(pos,width,height,objects,camera,light_sources):
 
+def cull_objects(objects,ray_origin,ray_directions):
     """
-    calculates the color of a single pixel at position pos (x,y) on the screen using ray marching.
+    Leaves out the objects whose bounding sphere is not intersected by any of the rays - they can be left out for the whole batch of rays.
+    The objects intersected by only some of the rays are wrapped in Culled_object, so they are marched only with those rays -
+    a ray never sees the objects it cannot hit, whatever the other rays of the batch are.
+    A BVH is replaced by its objects that are intersected by the rays (found with BVH.intersected_items) - every ray is then marched
+    with only the few objects it can hit, a smaller BVH over them would only add the cost of the traversal.
 
-    pos: (x,y) tuple representing the pixel position on the screen
-    width: width of the screen in pixels
-    height: height of the screen in pixels
-    objects: dictionary of CSG objects in the scene
+    objects: list of the objects in the scene (compiled CSG tapes, CSG_object_nodes or a bvh.BVH)
+    ray_origin: starting point of the rays - shape (3,)
+    ray_directions: normalized direction vectors of the rays - shape (N,3)
+
+    returns: list of the objects that can be hit by the rays
+    """
+    def culled(item,visible):
+        if visible.all():
+            return item
+        return Culled_object(item,visible)
+
+    visible = []
+    for obj in objects:
+        if isinstance(obj,bvh.BVH):
+            for item,rays in obj.intersected_items(ray_origin,ray_directions,margin=csg_tape.BOUND_MARGIN,with_rays=True):
+                mask = np.zeros(len(ray_directions),dtype=bool)
+                mask[rays] = True
+                visible.append(culled(item,mask))
+        else:
+            mask = obj.bounding_sphere_intersection(ray_origin,ray_directions,margin=csg_tape.BOUND_MARGIN)
+            if mask.any():
+                visible.append(culled(obj,mask))
+    return visible
+
+
+FIELD_OF_VIEW = np.pi / 3
+"""vertical field of view of the camera in radians (60 degrees)"""
+
+_ray_direction_cache = None
+"""(key of the view - see ray_direction_key, ray direction buffer) of the last view whose buffer was asked for - see ray_direction_buffer"""
+
+_ray_direction_lock = threading.Lock()
+"""guards _ray_direction_cache - the render threads of several pools can ask for it at once"""
+
+
+def camera_ray_directions(pixels,width,height,camera):
+    """
+    calculates the normalized directions of the camera rays through a batch of pixels
+
+    pixels: numpy array of shape (N,2) with the (x,y) pixel positions on the screen
+    width, height: size of the screen in pixels
     camera: camera object with position and rotation
-    light_sources: dictionary of light source objects 
-    
+
+    returns: numpy array of shape (N,3) with the ray directions
     """
     WIDTH = width
     HEIGHT = height
-    fov = np.pi / 3  # 60 degrees field of view
+    fov = FIELD_OF_VIEW
     aspect_ratio = WIDTH / HEIGHT
 
-    x,y = pos
+    x = pixels[:,0]
+    y = pixels[:,1]
     # Normalized device coordinates
     ndc_x = (x / WIDTH ) * 2 - 1
     ndc_y = (y / HEIGHT ) * 2 - 1
@@ -79,68 +293,1269 @@ def render_pixel(pos,width,height,objects,camera,light_sources):
     screen_x = (ndc_x) * aspect_ratio * np.tan(fov / 2)
     screen_y = (ndc_y) * np.tan(fov / 2)
 
-    # Ray direction
-    ray_direction = np.array([screen_x, screen_y,1]) @ camera.rotation
-    ray_direction /= np.linalg.norm(ray_direction)  # Normalize the direction
-    
-    objects = [obj for obj in objects.values() if obj.bounding_sphere_intersection]
+    # Ray directions
+    ray_directions = np.stack([screen_x, screen_y, np.ones(len(pixels))],axis=-1) @ camera.rotation
+    ray_directions /= np.linalg.norm(ray_directions,axis=-1,keepdims=True)  # Normalize the directions
+    return ray_directions
+
+
+def ray_direction_key(width,height,camera):
+    """
+    Returns the key of the ray directions of a view - they depend only on the resolution, the field of view and the rotation of the camera
+    """
+    return (width,height,FIELD_OF_VIEW,np.asarray(camera.rotation,dtype=float).tobytes())
+
+
+def all_ray_directions(width,height,camera,out=None):
+    """
+    calculates the directions of the camera rays through all the pixels of the screen
+
+    out: optional numpy array of shape (height,width,3) the directions are written into
+
+    returns: numpy array of shape (height,width,3)
+    """
+    ys,xs = np.mgrid[0:height,0:width]
+    ray_directions = camera_ray_directions(np.stack([xs.ravel(),ys.ravel()],axis=-1),width,height,camera).reshape(height,width,3)
+    if out is None:
+        return ray_directions
+    out[...] = ray_directions
+    return out
+
+
+def ray_direction_buffer(width,height,camera):
+    """
+    Returns the directions of the camera rays through all the pixels of the screen. The buffer of the last view is kept and reused
+    by the following calls - moving the camera or editing the objects keeps it. Only one view is kept, the worker processes
+    get the buffer of their render from the Render_pool (see Render_pool.share_ray_directions) instead.
+
+    returns: numpy array of shape (height,width,3) - the cached buffer itself, it must not be changed
+    """
+    global _ray_direction_cache
+    key = ray_direction_key(width,height,camera)
+    with _ray_direction_lock:
+        if _ray_direction_cache is None or _ray_direction_cache[0] != key:
+            _ray_direction_cache = (key,all_ray_directions(width,height,camera))
+        return _ray_direction_cache[1]
+
+
+def pixel_ray_directions(pixels,width,height,camera,buffer=None):
+    """
+    Returns the directions of the camera rays through a batch of pixels - the directions of whole pixels are looked up in buffer,
+    the directions of sub-pixel samples (or of all the pixels without buffer) are calculated (see camera_ray_directions)
+
+    pixels: numpy array of shape (N,2) with the (x,y) pixel positions on the screen
+    buffer: optional numpy array of shape (height,width,3) with the directions of all the pixels of the view (see ray_direction_buffer)
+
+    returns: numpy array of shape (N,3)
+    """
+    pixels = np.asarray(pixels)
+    if buffer is None or not np.issubdtype(pixels.dtype,np.integer):
+        return camera_ray_directions(pixels,width,height,camera)
+    return buffer[pixels[:,1],pixels[:,0]]
+
+
+def cone_distances(width,height,objects,camera,block_size=None):
+    """
+    Cone marching pre-pass - splits the screen into square blocks of block_size x block_size pixels and marches one cone enclosing
+    all the rays of each block (see ray_marching.march_cones), so the rays of neighbouring pixels share the steps through the empty space in front of the camera.
+    All the cones of the frame are marched together in one batch.
+
+    A block covers the screen positions from its first pixel - 0.5 to its last pixel + 0.5, so it also encloses the sub-pixel samples of its pixels.
+    The directions of the rays through a rectangle of the screen are farthest from the axis in the corners of the rectangle.
+
+    width, height: size of the screen in pixels
+    objects: list of the objects in the scene (see prepare_objects)
+    block_size: size of the blocks in pixels (CONE_BLOCK_SIZE by default)
+
+    returns: numpy array of shape (ceil(height/block_size),ceil(width/block_size)) with the distance the rays of each block can skip - see cone_start_distance
+    """
+    if block_size is None:
+        block_size = CONE_BLOCK_SIZE
+    ys,xs = np.mgrid[0:-(-height // block_size),0:-(-width // block_size)]
+    x0,y0 = xs.ravel() * block_size - 0.5,ys.ravel() * block_size - 0.5
+    x1,y1 = x0 + block_size,y0 + block_size
+
+    centers = camera_ray_directions(np.stack([(x0 + x1) / 2,(y0 + y1) / 2],axis=-1),width,height,camera)
+    spreads = np.zeros(len(centers))
+    for x,y in ((x0,y0),(x1,y0),(x0,y1),(x1,y1)):
+        corners = camera_ray_directions(np.stack([x,y],axis=-1),width,height,camera)
+        spreads = np.maximum(spreads,np.linalg.norm(corners - centers,axis=-1))
 
-    result = ray_marching.cast_ray(objects,camera.position, ray_direction)
+    return ray_marching.march_cones(objects,camera.position,centers,spreads).reshape(xs.shape)
+
+
+def cone_start_distance(distances,pixels,block_size=None):
+    """
+    Looks up the distances the rays through the pixels can skip in the result of cone_distances
+
+    pixels: numpy array of shape (N,2) with the (x,y) pixel positions on the screen - can be fractional for sub-pixel samples
+
+    returns: numpy array of shape (N,)
+    """
+    if block_size is None:
+        block_size = CONE_BLOCK_SIZE
+    pixels = np.asarray(pixels)
+    bx = np.clip(np.floor((pixels[:,0] + 0.5) / block_size).astype(int),0,distances.shape[1] - 1)
+    by = np.clip(np.floor((pixels[:,1] + 0.5) / block_size).astype(int),0,distances.shape[0] - 1)
+    return distances[by,bx]
+
+
+def changed_pixels(width,height,camera,spheres):
+    """
+    Finds the pixels whose rays intersect at least one of the spheres (enlarged by csg_tape.BOUND_MARGIN) - after an object is edited,
+    only the pixels whose rays intersect its old or new bounding sphere can change, the rays of the other pixels never come near it.
+
+    spheres: list of the bounding spheres (center, radius) of the changed regions
+
+    returns: boolean numpy array of shape (height,width)
+    """
+    mask = np.zeros(height * width,dtype=bool)
+    if len(spheres) == 0:
+        return mask.reshape(height,width)
+
+    ray_directions = ray_direction_buffer(width,height,camera).reshape(-1,3)
+    for center,radius in spheres:
+        mask |= csg.ray_sphere_intersection(center,radius + csg_tape.BOUND_MARGIN,camera.position,ray_directions)
+    return mask.reshape(height,width)
+
+
+def render_pixels(pixels,width,height,objects,camera,light_sources,with_buffers=False,cone_starts=None,relaxation=1,normals="tetrahedral",direction_buffer=None,with_stats=False,timings=None):
+
+    """
+    calculates the colors of a batch of pixels on the screen using ray marching.
+    All the rays of the batch are marched together using ray_marching.march_rays.
+
+    pixels: numpy array of shape (N,2) with the (x,y) pixel positions on the screen - can be fractional for sub-pixel samples
+    width: width of the screen in pixels
+    height: height of the screen in pixels
+    objects: list of the objects in the scene - compiled CSG tapes (csg_tape.py) or CSG_object_nodes
+    camera: camera object with position and rotation
+    light_sources: dictionary of light source objects 
+    with_buffers: also return the distances to the hit points, the ids of the hit objects and the normals of the hit points (the buffers of the frame, see FRAME_BUFFERS)
+    cone_starts: optional result of the cone marching pre-pass (see cone_distances) - the rays start where the cone of their block stopped
+    relaxation: over-relaxation factor of the sphere tracing (see ray_marching.march_rays) - 1 is the standard sphere tracing
+    normals: how the normals are calculated - one of NORMAL_METHODS (see get_normal)
+    direction_buffer: optional numpy array of shape (height,width,3) with the ray directions of all the pixels of the view (see pixel_ray_directions) -
+                      the workers of a Render_pool get the buffer shared by the render process (see Render_pool.share_ray_directions)
+    with_stats: also return how the rays were marched - the dictionary of ray_marching.march_rays with_stats ("steps", "reason" and "evaluations" arrays of shape (N,)),
+                the evaluations include the ones of the normals (NORMAL_EVALUATIONS and the object id lookup of every hit pixel)
+    timings: optional dictionary the CPU times of the phases ray_generation, marching, normals and shading are added to (see timed)
+
+    returns: numpy array of shape (N,3) and dtype uint8 with the rgb colors of the pixels
+    - if with_buffers is True also an array of shape (N,) with the distances to the hit points (np.inf for misses)
+    , an array of shape (N,) with the object_id of the hit objects (see prepare_objects, -1 for misses)
+    and an array of shape (N,3) with the normals of the hit points (zero for misses)
+    - if with_stats is True the statistics of the rays as the last item
+    """
+    with timed(timings,"ray_generation",time.thread_time):
+        ray_directions = pixel_ray_directions(pixels,width,height,camera,direction_buffer)
+
+    with timed(timings,"marching",time.thread_time):
+        objects = cull_objects(objects,camera.position,ray_directions)
+
+        start_distance = None if cone_starts is None else cone_start_distance(cone_starts,pixels)
+        result = ray_marching.march_rays(objects,camera.position, ray_directions,start_distance=start_distance,relaxation=relaxation,with_stats=with_stats)
     
-    rgb = [0,0,0]
-    if result["hit"]:
-        point = result["point"]
-        normal_vector = get_normal(objects,point)
-        for light_source in light_sources.values():
-            intensity = light_intensity(normal_vector,point,light_source.position)
+    rgb = np.zeros((len(pixels),3))
+    object_ids = np.full(len(pixels),-1)
+    pixel_normals = np.zeros((len(pixels),3))
+    hit = result["hit"]
+    if hit.any():
+        points = result["point"][hit]
+        with timed(timings,"normals",time.thread_time):
+            #the object that produced the distance at the hit point - only its SDF is needed for the normal
+            _,object_ids[hit],_ = ray_marching.scene_sdf(objects,points,with_ids=True)
+            normal_vectors = get_normal(objects,points,method=normals,object_ids=object_ids[hit])
+            pixel_normals[hit] = normal_vectors
+        with timed(timings,"shading",time.thread_time):
+            colors = np.zeros((len(points),3))
+            for light_source in light_sources.values():
+                intensity = light_intensity(normal_vectors,points,light_source.position)
+
+                if light_source.color == "white":
+                    colors += intensity[:,None]
+                elif light_source.color == "red":
+                    colors[:,0] += intensity
+                elif light_source.color == "green":
+                    colors[:,1] += intensity
+                elif light_source.color == "blue":
+                    colors[:,2] += intensity
+            rgb[hit] = np.minimum(colors,1)
 
-            if light_source.color == "white":
-                rgb[0] = min(rgb[0]+ intensity,1)
-                rgb[1] = min(rgb[1]+ intensity,1)
-                rgb[2] = min(rgb[2]+ intensity,1)
+    with timed(timings,"shading",time.thread_time):
+        returned = [(rgb * 255).astype(np.uint8)]
+    if with_buffers:
+        returned += [result["distance"],object_ids,pixel_normals]
+    if with_stats:
+        stats = {key: result[key] for key in ("steps","evaluations","reason")}
+        #the object id lookup and the normal of the hit pixels
+        stats["evaluations"][hit] += 1 + NORMAL_EVALUATIONS[normals]
+        returned.append(stats)
+    return returned[0] if len(returned) == 1 else tuple(returned)
 
-            elif light_source.color == "red":
-                rgb[0] = min(rgb[0]+ intensity,1)
-            elif light_source.color == "green":
-                rgb[1] = min(rgb[1]+ intensity,1)
 
-            elif light_source.color == "blue":
-                rgb[2] = min(rgb[2]+ intensity,1) 
-    rgb = [*map(lambda x: int(x*255),rgb)]
-    return (x,y,rgb)
+def make_tiles(width,height,tile_size):
+    """
+    Splits the frame into rectangular tiles.
 
+    width, height: size of the frame in pixels
+    tile_size: int for square tiles or a tuple (tile_width,tile_height) - e.g. (width,8) splits the frame into blocks of 8 rows
 
-def render_scene(canvas,all_objects,camera,light_sources):
+    returns: list of tiles (x0,y0,x1,y1) - the tile covers the pixels x0 <= x < x1, y0 <= y < y1
     """
-    Render the scene onto the given Tkinter canvas using ray marching.
-    Uses multiprocessing to speed up the rendering process.
+    if isinstance(tile_size,int):
+        tile_width,tile_height = tile_size,tile_size
+    else:
+        tile_width,tile_height = tile_size
+
+    return [(x0,y0,min(x0 + tile_width,width),min(y0 + tile_height,height))
+            for y0 in range(0,height,tile_height)
+            for x0 in range(0,width,tile_width)]
+
+
+CONE_BLOCK_SIZE = 8
+"""size (in pixels) of the square blocks of the screen that share one cone when cone marching (see cone_distances and cone_start_distance)"""
+
+PROGRESSIVE_STRIDES = (8,4,2,1)
+"""strides of the passes of progressive rendering - 1/8, 1/4, 1/2 and full resolution"""
+
+CANCEL_POLL_INTERVAL = 0.05
+"""how often (in seconds) a render waiting for the next tile checks whether it was cancelled"""
+
+
+ANTIALIAS_OFFSETS = np.array([[-0.375,-0.125],[0.125,-0.375],[0.375,0.125],[-0.125,0.375]])
+"""offsets of the extra samples of an anti-aliased pixel from its primary sample - a rotated grid inside of the pixel (the primary sample is its center)"""
+
+ANTIALIAS_COLOR_THRESHOLD = 16
+"""neighbouring pixels whose colors differ by more than this in any channel (0-255) are anti-aliased"""
+
+ANTIALIAS_DEPTH_THRESHOLD = 0.05
+"""neighbouring pixels whose hit distances differ by more than this fraction of the smaller one are anti-aliased"""
+
+
+class Render_cancelled(Exception):
+    """Raised by the render functions when their cancel event is set - the worker processes are terminated"""
+
+
+FRAME_BUFFERS = {
+    "color": ((3,),np.uint8,0),
+    "depth": ((),np.float64,np.nan),
+    "object_id": ((),np.int32,-2),
+    "normal": ((3,),np.float32,0),
+}
+"""buffers of a frame in shared memory (see Shared_frame) - name -> (channels, dtype, value of the pixels that were not rendered):
+the rgb colors, the distances to the hit points (np.inf for misses), the ids of the hit objects (-1 for misses, see prepare_objects)
+and the normals of the hit points (zero for misses)"""
+
+
+class Shared_frame:
+    """
+    The buffers of a frame (see FRAME_BUFFERS) in shared memory - numpy arrays of shape (height,width) or (height,width,channels)
+    the worker processes write the rendered pixels into directly (see attach_frame), so the tasks only send back which tile is finished
+    and the render process never holds more than the frame itself.
+    Used as a context manager - the shared memory is released at the end of the with block, so the arrays have to be copied before
+    and no views of them may be kept.
+    """
+
+    blocks: dict
+    """name -> multiprocessing.shared_memory.SharedMemory block of the buffer"""
+
+    arrays: dict
+    """name -> numpy array in the shared memory block"""
+
+    def __init__(self,width,height,names=("color","depth","object_id")):
+        self.blocks = dict()
+        self.arrays = dict()
+        for name in names:
+            channels,dtype,fill = FRAME_BUFFERS[name]
+            shape = (height,width) + channels
+            block = shared_memory.SharedMemory(create=True,size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize,1))
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(shape,dtype=dtype,buffer=block.buf)
+            self.arrays[name][...] = fill
+
+    def __getitem__(self,name):
+        return self.arrays[name]
+
+    def __contains__(self,name):
+        return name in self.arrays
+
+    def description(self) -> dict:
+        """
+        Returns the description of the buffers sent to the worker processes - name -> (name of the shared memory block, shape, dtype)
+        """
+        return {name: (block.name,self.arrays[name].shape,self.arrays[name].dtype.str) for name,block in self.blocks.items()}
+
+    def release(self):
+        """Releases the shared memory - the arrays cannot be used afterwards"""
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exception):
+        self.release()
+
+
+def attach_frame(description):
+    """
+    Opens the shared buffers of a frame in a worker process
+
+    description: see Shared_frame.description
+
+    returns: (name -> numpy array in the shared memory, list of the opened shared memory blocks - they have to be kept open while the arrays are used)
+    """
+    arrays = dict()
+    blocks = []
+    for name,(block_name,shape,dtype) in description.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape,dtype=dtype,buffer=block.buf)
+    return arrays,blocks
+
+
+BACKENDS = ("process","thread","serial")
+"""execution backends of the renderer (see Render_pool) - worker processes, worker threads of the render process
+(the numpy kernels release the GIL) or the tasks one by one in the thread of the render (for debugging and profiling)"""
+
+
+def available_cores():
+    """
+    Returns the number of cores the process may run on - the default number of workers
+    """
+    if hasattr(os,"sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class Serial_pool:
+    """
+    Pool of the serial backend - runs every task in the thread of the render when its result is asked for (see Render_pool)
+    """
+
+    def imap_unordered(self,function,tasks,chunksize=1):
+        return _Serial_results(map(function,tasks))
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class _Serial_results:
+    """Iterator over the results of Serial_pool.imap_unordered - next takes the timeout of the multiprocessing iterators"""
+
+    def __init__(self,results):
+        self.results = results
+
+    def next(self,timeout=None):
+        return next(self.results)
+
+
+class _Chunked_results:
+    """Iterator over the results of the tasks of the chunks - see Render_pool.imap_unordered"""
+
+    def __init__(self,chunks):
+        self.chunks = chunks
+        self.pending = []
+
+    def next(self,timeout=None):
+        if not self.pending:
+            self.pending = self.chunks.next(timeout=timeout)
+        return self.pending.pop(0)
+
+
+class Render_pool:
+    """
+    Long-lived pool of workers used for many renders - the workers are started once and keep the scene between the renders.
+    The workers are processes, threads or the thread of the render itself, depending on the backend (see BACKENDS).
+    The values the workers need (the prepared objects - "scene", the size, camera, light sources and options of a render - "view")
+    are broadcast once (see share): for the process backend every value is pickled once into a shared memory block, the tasks only carry
+    the names of the blocks and every worker unpickles a value only when its block changed since its previous task (see _Worker_state.load_shared);
+    the threads of the other backends use the values of the render process directly.
+    A value shared with a version that did not change (e.g. the scene between renders that only move the camera) is not sent again.
+    Used as a context manager - the workers are terminated and the shared memory is released at the end of the with block (see close).
+    """
+
+    processes: int
+    """number of workers - processes or threads"""
+
+    backend: str
+    """one of BACKENDS"""
+
+    chunksize: int
+    """number of tasks sent to a worker at once - larger chunks cost less communication, smaller ones balance the load better"""
+
+    pool: multiprocessing.pool.Pool
+    """the pool of workers (multiprocessing.pool.ThreadPool or Serial_pool for the other backends) - None before the first render
+    and after the pool was terminated (see session)"""
+
+    lock: threading.Lock
+    """held by the render using the pool - a render waits for the previous one to finish or to be cancelled"""
+
+    shared: dict
+    """key -> (version, multiprocessing.shared_memory.SharedMemory block with the pickled value, size of the pickled value)
+    - for the thread and serial backends (version, None, the value)"""
+
+    local_scene: tuple
+    """the scene of the threads of the thread and serial backends - see _open_scene, None before the first render"""
+
+    ray_directions: tuple
+    """(key of the view - see ray_direction_key, multiprocessing.shared_memory.SharedMemory block) with the ray directions of all the pixels
+    of the view of the last render - see share_ray_directions, None before the first render that uses them"""
 
-    canvas: Tkinter canvas where the scene will be rendered, also stores the width and height
-    objects: dictionary of CSG objects in the scene
+    def __init__(self,processes=None,backend=None,chunksize=None):
+        self.processes = available_cores()
+        self.backend = "process"
+        self.chunksize = 1
+        self.pool = None
+        self.lock = threading.Lock()
+        self.shared = dict()
+        self.local_scene = None
+        self.ray_directions = None
+        self.configure(processes,backend,chunksize)
+
+    def configure(self,processes=None,backend=None,chunksize=None):
+        """
+        Changes the settings of the pool, None keeps a setting. The workers are terminated if their number or the backend changes
+        and the next render starts new ones.
+        """
+        if backend is not None and backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend} - expected one of {', '.join(BACKENDS)}")
+        if processes is not None and processes < 1:
+            raise ValueError(f"Invalid number of workers {processes} - expected a positive integer")
+        if chunksize is not None and chunksize < 1:
+            raise ValueError(f"Invalid chunk size {chunksize} - expected a positive integer")
+
+        if (processes is not None and processes != self.processes) or (backend is not None and backend != self.backend):
+            #the values shared with the processes are not seen by the threads and the other way round
+            self.close()
+        if processes is not None:
+            self.processes = processes
+        if backend is not None:
+            self.backend = backend
+        if chunksize is not None:
+            self.chunksize = chunksize
+
+    @contextlib.contextmanager
+    def session(self,timings=None,processes=None,backend=None,chunksize=None):
+        """
+        Context manager for one render - waits for the pool, applies the settings of the render (see configure),
+        starts the workers if they are not running and terminates them if the render is cancelled or fails,
+        so they do not keep working on its tasks.
+
+        timings: optional dictionary of the times of the phases of the render (see RENDER_PHASES)
+        """
+        with self.lock:
+            self.configure(processes,backend,chunksize)
+            if self.pool is None:
+                with timed(timings,"pool_startup"):
+                    if self.backend == "process":
+                        self.pool = multiprocessing.Pool(processes=self.processes)
+                    elif self.backend == "thread":
+                        self.pool = multiprocessing.pool.ThreadPool(processes=self.processes)
+                    else:
+                        self.pool = Serial_pool()
+            try:
+                yield self
+            except Exception:
+                self.terminate()
+                raise
+
+    def share(self,key,value,version=None,timings=None):
+        """
+        Broadcasts value to the workers under key - they get it with their next task
+
+        version: any value that changes whenever value changes - value is not sent again if it was last shared with the same version,
+                 None always sends it
+        timings: optional dictionary the time spent pickling value is added to (scene_broadcast)
+        """
+        current = self.shared.get(key)
+        if version is not None and current is not None and current[0] == version:
+            return
+        if self.backend != "process":
+            self.shared[key] = (version,None,value)
+            return
+        with timed(timings,"scene_broadcast"):
+            payload = pickle.dumps(value,protocol=pickle.HIGHEST_PROTOCOL)
+            block = shared_memory.SharedMemory(create=True,size=max(len(payload),1))
+            block.buf[:len(payload)] = payload
+        self.shared[key] = (version,block,len(payload))
+        #no task of an earlier render is running any more (see session), so the old block is not read again
+        if current is not None:
+            current[1].close()
+            current[1].unlink()
+
+    def share_ray_directions(self,width,height,camera,timings=None):
+        """
+        Returns the description of the shared buffer with the ray directions of all the pixels of the view (see Shared_frame.description) -
+        the buffer is calculated once in the render process and all the workers read it, it is calculated again only when the view changes
+        (the resolution or the rotation of the camera, see ray_direction_key). Only the buffer of the last view is kept.
+
+        timings: optional dictionary the time spent calculating the buffer is added to (ray_generation)
+        """
+        key = ray_direction_key(width,height,camera)
+        if self.ray_directions is None or self.ray_directions[0] != key:
+            self.release_ray_directions()
+            with timed(timings,"ray_generation"):
+                block = shared_memory.SharedMemory(create=True,size=max(height * width * 3 * np.dtype(np.float64).itemsize,1))
+                all_ray_directions(width,height,camera,out=np.ndarray((height,width,3),dtype=np.float64,buffer=block.buf))
+            self.ray_directions = (key,block)
+        return {"ray_directions": (self.ray_directions[1].name,(height,width,3),np.dtype(np.float64).str)}
+
+    def release_ray_directions(self):
+        """Releases the shared buffer of the ray directions - no task of an earlier render is running any more (see session)"""
+        if self.ray_directions is not None:
+            block = self.ray_directions[1]
+            self.ray_directions = None
+            block.close()
+            block.unlink()
+
+    def imap_unordered(self,function,tasks,timed_tasks=False):
+        """
+        Runs function for all the tasks in the workers with the shared values, chunksize tasks at once -
+        returns an iterator over the results in the order they are finished, its next method takes a timeout like the multiprocessing iterators
+
+        timed_tasks: return the results together with the timings of the phases of the tasks - pickled by the worker processes (see _run_task)
+        """
+        if self.backend == "process":
+            references = {key: (block.name,size) for key,(_,block,size) in self.shared.items()}
+            scene = frame = None
+        else:
+            #the threads run in this process and get the scene with the tasks - no task of an earlier call is running any more
+            #(the previous call finished all its tasks or its workers were terminated and joined, see terminate), so it can be replaced
+            self.close_local_scene()
+            self.local_scene = _open_scene(self.shared["scene"][2],self.shared["view"][2])
+            references = None
+            scene,frame,_ = self.local_scene
+        tasks = [(references,scene,frame,function,task,timed_tasks) for task in tasks]
+        #the chunks are made here - the iterator of Pool.imap_unordered with a chunksize has no timeout (see tile_results)
+        chunks = [tasks[i:i + self.chunksize] for i in range(0,len(tasks),self.chunksize)]
+        return _Chunked_results(self.pool.imap_unordered(_run_chunk,chunks))
+
+    def close_local_scene(self):
+        """Closes the buffers of the frame opened for the threads of the render process"""
+        if self.local_scene is not None:
+            blocks = self.local_scene[2]
+            self.local_scene = None
+            for block in blocks:
+                block.close()
+
+    def terminate(self):
+        """
+        Terminates the workers and waits for them to stop - the next render starts new ones, the shared values are kept.
+        The threads of a ThreadPool cannot be stopped in the middle of a task, they finish their current chunk first -
+        until then they still write into the buffers of the frame opened for them (see close_local_scene)
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def close(self):
+        """Terminates the workers and releases the shared values"""
+        self.terminate()
+        self.close_local_scene()
+        self.release_ray_directions()
+        for _,block,_ in self.shared.values():
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.shared.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exception):
+        self.close()
+
+
+@contextlib.contextmanager
+def render_session(pool,processes=None,backend=None,chunksize=None,timings=None):
+    """
+    Yields the Render_pool of one render (see Render_pool.session) - pool with the settings of the render (None keeps the setting of the pool),
+    or a new one that is closed after the render if pool is None
+    """
+    if pool is None:
+        with Render_pool(processes,backend,chunksize) as pool, pool.session(timings):
+            yield pool
+    else:
+        with pool.session(timings,processes,backend,chunksize):
+            yield pool
+
+
+class _Worker_state(threading.local):
+    """
+    State of a worker - everything the worker keeps between its tasks and the task it is running.
+    Every thread has its own state: a worker process runs its tasks in one thread, the workers of the thread backend run their tasks side by side
+    and the pools of one process can have different scenes.
+    """
+
+    shared: dict
+    """key -> (name of the shared memory block, value) of the values shared with the worker process (see load_shared) - empty for the threads of the render process"""
+
+    blocks: list
+    """the shared memory blocks of the frame opened by the worker process (see _open_scene)"""
+
+    scene: tuple
+    """scene of the render - (width,height,objects,camera,light_sources,mask,options), see _open_scene. In a worker process it is kept between the tasks,
+    the threads of the render process get it with every task"""
+
+    frame: dict
+    """the shared buffers of the frame of the render - name -> numpy array (see attach_frame), None if the render has no frame"""
+
+    timings: dict
+    """timings of the phases of the running task - None if the render is not timed (see _run_task)"""
+
+    def __init__(self):
+        self.shared = dict()
+        self.blocks = []
+        self.scene = None
+        self.frame = None
+        self.timings = None
+
+    def load_shared(self,references):
+        """
+        Loads the values shared with the worker process whose blocks changed since its previous task and rebuilds its scene
+
+        references: key -> (name of the shared memory block, size of the pickled value) - see Render_pool.imap_unordered
+        """
+        changed = False
+        for key,(name,size) in references.items():
+            if key in self.shared and self.shared[key][0] == name:
+                continue
+            block = shared_memory.SharedMemory(name=name)
+            try:
+                payload = bytes(block.buf[:size])
+            finally:
+                block.close()
+            self.shared[key] = (name,pickle.loads(payload))
+            changed = True
+        if not changed:
+            return
+
+        #every render has its own frame - the blocks of the previous one are closed
+        self.frame = None
+        for block in self.blocks:
+            block.close()
+        self.scene,self.frame,self.blocks = _open_scene(self.shared["scene"][1],self.shared["view"][1])
+
+_worker = _Worker_state()
+
+
+def _open_scene(objects,view):
+    """
+    Builds the scene of the workers from the shared values and opens the buffers of the frame of the render
+
+    objects, view: the values shared as "scene" and "view" - see share_scene
+
+    returns: (scene of the workers - see _Worker_state.scene, name -> numpy array of the frame or None, list of the opened shared memory blocks)
+    """
+    width,height,camera,light_sources,mask,options,frame,ray_directions = view
+    #the shared ray directions are opened together with the buffers of the frame
+    arrays,blocks = attach_frame({**(frame or dict()),**(ray_directions or dict())})
+    if ray_directions is not None:
+        options = dict(options,direction_buffer=arrays.pop("ray_directions"))
+    scene = (width,height,objects,camera,light_sources,mask,options)
+    return scene,(arrays if frame is not None else None),blocks
+
+
+def share_scene(pool,width,height,objects,camera,light_sources,mask=None,options=None,frame=None,scene_version=None,share_ray_directions=False,timings=None):
+    """
+    Broadcasts the scene of a render to the workers of the pool (see Render_pool.share) - the objects are sent only if scene_version changed,
+    the view (size, camera, light sources, mask of the pixels to render, options and frame) with every render.
+
+    options: dictionary of keyword arguments of render_pixels used for every tile (e.g. cone_starts, relaxation)
+    frame: description of the shared buffers of the frame (see Shared_frame.description) - the tiles are written into them
+    scene_version: see render_frame
+    share_ray_directions: the workers look the ray directions up in the buffer shared by the pool (see Render_pool.share_ray_directions) -
+                          pays off only for a pool that renders the same view more than once, calculating the buffer costs more than the directions of one frame
+    """
+    ray_directions = pool.share_ray_directions(width,height,camera,timings) if share_ray_directions else None
+    pool.share("scene",objects,scene_version,timings)
+    pool.share("view",(width,height,camera,light_sources,mask,options or dict(),frame,ray_directions),timings=timings)
+
+
+def _run_chunk(tasks):
+    """
+    Runs a chunk of tasks in the worker - returns the list of their results (see _run_task)
+    """
+    return [_run_task(task) for task in tasks]
+
+
+def _run_task(task):
+    """
+    Runs one task in the worker - see Render_pool.imap_unordered
+
+    task: (references of the shared values - see _Worker_state.load_shared, None for the threads of the render process,
+           scene and frame of the threads of the render process - see _open_scene, function, task of the function, whether the task is timed)
+
+    returns: the result of the function - for a timed task (the result, timings of the phases of the task),
+             the result pickled in a worker process, so the time spent serializing it is known
+    """
+    references,scene,frame,function,task,timed_task = task
+    _worker.timings = dict() if timed_task else None
+    try:
+        if references is not None:
+            with timed(_worker.timings,"scene_broadcast",time.thread_time):
+                _worker.load_shared(references)
+        else:
+            _worker.scene,_worker.frame = scene,frame
+        result = function(task)
+        if not timed_task:
+            return result
+        if references is not None:
+            with timed(_worker.timings,"task_serialization"):
+                result = pickle.dumps(result,protocol=pickle.HIGHEST_PROTOCOL)
+        return result,_worker.timings
+    finally:
+        _worker.timings = None
+        if references is None:
+            #the buffers of the frame of the threads can be closed only when no task refers to them (see Render_pool.close_local_scene)
+            _worker.scene = _worker.frame = None
+
+
+def _render_into_frame(xs,ys):
+    """
+    Renders the pixels (xs[i],ys[i]) with the scene of the worker process and writes them into the shared buffers of the frame
+    """
+    width,height,objects,camera,light_sources,_,options = _worker.scene
+    pixels = np.stack([xs,ys],axis=-1)
+    colors,distance,object_ids,normal_vectors = render_pixels(pixels,width,height,objects,camera,light_sources,with_buffers=True,timings=_worker.timings,**options)
+    with timed(_worker.timings,"image_assembly",time.thread_time):
+        _worker.frame["color"][ys,xs] = colors
+        _worker.frame["depth"][ys,xs] = distance
+        _worker.frame["object_id"][ys,xs] = object_ids
+        if "normal" in _worker.frame:
+            _worker.frame["normal"][ys,xs] = normal_vectors
+
+
+def render_tile(tile):
+    """
+    Renders one tile of the frame using the scene stored in the worker process and writes it into the shared buffers of the frame -
+    only the pixels of the mask if the worker has one, the other pixels keep their values.
+
+    tile: (x0,y0,x1,y1) - see make_tiles
+
+    returns: tile - the notice that the tile is finished
+    """
+    mask = _worker.scene[5]
+    x0,y0,x1,y1 = tile
+
+    ys,xs = np.mgrid[y0:y1,x0:x1]
+    if mask is not None:
+        selected = mask[y0:y1,x0:x1]
+        ys,xs = ys[selected],xs[selected]
+    _render_into_frame(xs.ravel(),ys.ravel())
+    return tile
+
+
+def pass_mask(tile,stride,previous_stride=0):
+    """
+    Selects the pixels of a tile rendered in one pass of progressive rendering (see render_progressive) - the pixels whose x and y
+    are divisible by stride, except for those already rendered in the previous pass (x and y divisible by previous_stride).
+
+    tile: (x0,y0,x1,y1) - see make_tiles
+    previous_stride: stride of the previous pass, 0 for the first pass
+
+    returns: boolean numpy array of shape (y1-y0,x1-x0)
+    """
+    x0,y0,x1,y1 = tile
+    ys,xs = np.mgrid[y0:y1,x0:x1]
+    mask = (xs % stride == 0) & (ys % stride == 0)
+    if previous_stride > 0:
+        mask &= ~((xs % previous_stride == 0) & (ys % previous_stride == 0))
+    return mask
+
+
+def render_tile_pass(task):
+    """
+    Renders the pixels of one tile that belong to one pass of progressive rendering, using the scene stored in the worker process,
+    and writes them into the shared buffers of the frame.
+
+    task: (tile, stride, previous_stride) - see pass_mask
+
+    returns: task - the notice that the task is finished
+    """
+    tile,stride,previous_stride = task
+    x0,y0,x1,y1 = tile
+
+    ys,xs = np.mgrid[y0:y1,x0:x1]
+    selected = pass_mask(tile,stride,previous_stride)
+    _render_into_frame(xs[selected],ys[selected])
+    return task
+
+
+def render_subpixel_samples(task):
+    """
+    Renders the extra sub-pixel samples of the pixels selected for anti-aliasing (see antialias_frame), using the scene stored in the worker process.
+    The color of every pixel in the shared framebuffer becomes the mean of its primary sample and the ANTIALIAS_OFFSETS samples.
+
+    task: (tile, numpy array of shape (N,2) with the (x,y) positions of the selected pixels of the tile)
+
+    returns: tile - the notice that the task is finished
+    """
+    width,height,objects,camera,light_sources,_,options = _worker.scene
+    tile,pixels = task
+
+    #all the samples of all the pixels are marched in one batch
+    samples = (pixels[None,:,:] + ANTIALIAS_OFFSETS[:,None,:]).reshape(-1,2)
+    colors = render_pixels(samples,width,height,objects,camera,light_sources,timings=_worker.timings,**options).reshape(len(ANTIALIAS_OFFSETS),len(pixels),3)
+
+    with timed(_worker.timings,"image_assembly",time.thread_time):
+        xs,ys = pixels[:,0],pixels[:,1]
+        framebuffer = _worker.frame["color"]
+        #the primary sample is one of the samples of the pixel
+        count = len(ANTIALIAS_OFFSETS)
+        framebuffer[ys,xs] = np.round((framebuffer[ys,xs] + count * colors.mean(axis=0)) / (count + 1)).astype(np.uint8)
+    return tile
+
+
+def upscale_samples(framebuffer,stride):
+    """
+    Fills every stride x stride block of the framebuffer with the color of the sample in its top left corner
+    - used to show the incomplete frame during progressive rendering
+
+    returns: new numpy array of the same shape as framebuffer
+    """
+    height,width,_ = framebuffer.shape
+    samples = framebuffer[::stride,::stride]
+    return np.repeat(np.repeat(samples,stride,axis=0),stride,axis=1)[:height,:width]
+
+
+def edge_pixels(framebuffer,distance,object_ids=None):
+    """
+    Finds the pixels on the edges of the image - the pixels that differ from one of their right, left, upper or lower neighbours in hit status
+    (one ray hits, the other misses), in the hit distance (the silhouette of an object in front of another one, see ANTIALIAS_DEPTH_THRESHOLD),
+    in the hit object (two touching objects) or in shade (see ANTIALIAS_COLOR_THRESHOLD).
+
+    framebuffer: numpy array of shape (height,width,3) with the colors of the pixels
+    distance: numpy array of shape (height,width) with the distances to the hit points (np.inf for misses) -
+              np.nan for pixels whose distance is not known, those are compared only by color
+    object_ids: optional numpy array of shape (height,width) with the ids of the hit objects (see render_frame with return_object_ids=True)
+
+    returns: boolean numpy array of shape (height,width)
+    """
+    colors = framebuffer.astype(np.int16)
+    known = ~np.isnan(distance)
+    hit = distance < np.inf
+    edges = np.zeros(distance.shape,dtype=bool)
+
+    # the pairs of horizontal and vertical neighbours - (first pixels of the pairs, second pixels of the pairs)
+    for first,second in (((slice(None),slice(None,-1)),(slice(None),slice(1,None))),((slice(None,-1),slice(None)),(slice(1,None),slice(None)))):
+        different = np.abs(colors[first] - colors[second]).max(axis=-1) > ANTIALIAS_COLOR_THRESHOLD
+
+        both_known = known[first] & known[second]
+        different |= both_known & (hit[first] != hit[second])
+
+        both_hit = both_known & hit[first] & hit[second]
+        with np.errstate(invalid="ignore"):
+            depth_step = np.abs(distance[first] - distance[second]) > ANTIALIAS_DEPTH_THRESHOLD * np.minimum(distance[first],distance[second])
+        different |= both_hit & depth_step
+        if object_ids is not None:
+            different |= both_hit & (object_ids[first] != object_ids[second])
+
+        edges[first] |= different
+        edges[second] |= different
+    return edges
+
+
+def prepare_object(node,use_distance_grids=False):
+    """
+    Converts a CSG object into the form used by the renderer - the compiled tape of the object or,
+    if use_distance_grids is True, its baked distance grid (both cached in the node, see csg_tape.cached_tape and distance_grid.py).
+    Primitives are never baked, their exact SDF is as cheap as the grid lookup.
+    """
+    if use_distance_grids and not node.is_leaf():
+        return distance_grid.cached_distance_grid(node)
+    return csg_tape.cached_tape(node)
+
+
+def prepare_objects(all_objects,scene_bvh=None,use_distance_grids=False):
+    """
+    Returns the list of objects sent to the worker processes - see prepare_object and render_frame.
+    A list is assumed to be prepared already and is returned unchanged - the objects can be prepared before the render
+    (e.g. to take a snapshot of the scene before rendering it in the background)
+    Every prepared object gets an object_id - the position of its CSG object in all_objects - that identifies the hit objects
+    (see ray_marching.scene_sdf with with_ids=True)
+    """
+    if isinstance(all_objects,list):
+        return all_objects
+    object_ids = {id(obj): object_id for object_id,obj in enumerate(all_objects.values())}
+
+    def prepare(obj):
+        #the tapes and the grids are cached in the nodes and can be shared by several scenes (or renders running at the same time) -
+        #the id is set on a shallow copy that shares their arrays
+        prepared = copy.copy(prepare_object(obj,use_distance_grids))
+        prepared.object_id = object_ids.get(id(obj),-1)
+        return prepared
+
+    if scene_bvh is not None:
+        return [scene_bvh.map_items(prepare)]
+    return [prepare(obj) for obj in all_objects.values()]
+
+
+def tile_results(pool,function,tasks,cancel=None,progress=None,done=0,total=None,timings=None):
+    """
+    Yields the results of function for all the tasks computed by the pool (Render_pool) in the order they are finished.
+    While waiting for the next result the cancel event is checked every CANCEL_POLL_INTERVAL seconds.
+
+    cancel: optional threading.Event - Render_cancelled is raised when it is set (the workers are terminated, see Render_pool.session)
+    progress: optional function called with (finished tasks, total tasks) after every task
+    done, total: number of tasks finished before and number of all the tasks - when the tasks are one part of a longer render
+    timings: optional dictionary the times of the phases of the tasks in the workers are added to (see _run_task),
+             together with the time the results of the worker processes take to serialize and deserialize (task_serialization)
+    """
+    if total is None:
+        total = len(tasks)
+    results = pool.imap_unordered(function,tasks,timed_tasks=timings is not None)
+    for _ in range(len(tasks)):
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise Render_cancelled()
+            try:
+                result = results.next(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except multiprocessing.TimeoutError:
+                pass
+        if timings is not None:
+            result,task_timings = result
+            for phase,seconds in task_timings.items():
+                timings[phase] = timings.get(phase,0) + seconds
+            if pool.backend == "process":
+                with timed(timings,"task_serialization"):
+                    result = pickle.loads(result)
+        done += 1
+        if progress is not None:
+            progress(done,total)
+        yield result
+
+
+def antialias_frame(pool,frame,tile_size,region=None,cancel=None,progress=None,done=0,total=0,timings=None):
+    """
+    Adaptive anti-aliasing of a rendered frame - only the pixels on the edges (see edge_pixels) get the extra sub-pixel samples
+    (ANTIALIAS_OFFSETS) and their color becomes the mean of all their samples. The workers change the shared framebuffer in place.
+    The pixels are sent to the pool grouped by the tiles of the frame, tiles without edges are skipped.
+
+    pool: Render_pool the scene and the buffers of frame are shared with (see share_scene)
+    frame: the rendered frame in shared memory (Shared_frame) - its colors, distances and object ids are used to find the edges
+    region: optional boolean numpy array of shape (height,width) - only the edge pixels inside of it are anti-aliased
+    done, total: number of tasks of the render finished so far and of all its tasks without the anti-aliasing - see tile_results
+    timings: optional dictionary of the times of the phases of the render (see RENDER_PHASES)
+
+    returns: number of anti-aliased pixels
+    """
+    height,width,_ = frame["color"].shape
+    with timed(timings,"image_assembly"):
+        edges = edge_pixels(frame["color"],frame["depth"],frame["object_id"])
+        if region is not None:
+            edges &= region
+
+        tasks = []
+        for tile in make_tiles(width,height,tile_size):
+            x0,y0,x1,y1 = tile
+            ys,xs = np.nonzero(edges[y0:y1,x0:x1])
+            if len(xs) > 0:
+                tasks.append((tile,np.stack([xs + x0,ys + y0],axis=-1)))
+
+    for _ in tile_results(pool,render_subpixel_samples,tasks,cancel,progress,done,total + len(tasks),timings):
+        pass
+    return int(edges.sum())
+
+
+class Render_settings:
+    """
+    Settings of a render - how the frame is split into tasks and run by the workers and which accelerations and quality options are used.
+    Shared by render_frame, render_progressive and render_statistics, the same settings can be used for many renders.
+    """
+
+    tile_size: int
+    """size of the tiles - int for square tiles or a tuple (tile_width,tile_height)"""
+
+    processes: int
+    """number of workers - None for the number of available cores (see available_cores), with a pool the number of workers of the pool"""
+
+    backend: str
+    """how the tiles are rendered - one of BACKENDS, None for worker processes or the backend of the pool"""
+
+    chunksize: int
+    """number of tiles sent to a worker at once - None for one tile or the chunk size of the pool"""
+
+    use_distance_grids: bool
+    """march with the baked distance grids of the objects (distance_grid.py) - faster repeated renders of unchanged complex objects"""
+
+    antialiasing: bool
+    """smooth the edges with extra sub-pixel samples of only the pixels on the edges (see antialias_frame) -
+    for an incremental render only the edges among the rendered pixels, not used by render_statistics"""
+
+    cone_marching: bool
+    """march one cone per block of CONE_BLOCK_SIZE x CONE_BLOCK_SIZE pixels before the rays (see cone_distances) -
+    the rays skip the empty space their cone has crossed"""
+
+    relaxation: float
+    """over-relaxation factor omega of the sphere tracing (see ray_marching.march_rays) - the rays step by omega * d
+    and go back when a step was too long, 1 is the standard sphere tracing"""
+
+    normals: str
+    """how the normals are calculated - one of NORMAL_METHODS (see get_normal)"""
+
+    def __init__(self,tile_size=32,processes=None,backend=None,chunksize=None,use_distance_grids=False,antialiasing=False,cone_marching=False,relaxation=1,normals="tetrahedral"):
+        self.tile_size = tile_size
+        self.processes = processes
+        self.backend = backend
+        self.chunksize = chunksize
+        self.use_distance_grids = use_distance_grids
+        self.antialiasing = antialiasing
+        self.cone_marching = cone_marching
+        self.relaxation = relaxation
+        self.normals = normals
+
+    def pixel_options(self,width,height,objects,camera,timings=None):
+        """
+        Returns the dictionary of keyword arguments of render_pixels used for every tile of a render -
+        runs the cone marching pre-pass if it is turned on (see cone_distances)
+
+        objects: the prepared objects of the render (see prepare_objects)
+        timings: optional dictionary the time of the cone marching is added to (cone_marching)
+        """
+        options = dict(relaxation=self.relaxation,normals=self.normals)
+        if self.cone_marching:
+            with timed(timings,"cone_marching"):
+                options["cone_starts"] = cone_distances(width,height,objects,camera)
+        return options
+
+
+def render_frame(width,height,all_objects,camera,light_sources,settings=None,scene_bvh=None,previous_frame=None,changed_spheres=None,return_object_ids=False,return_buffers=False,pool=None,scene_version=None,cancel=None,progress=None,timings=None):
+    """
+    Renders the scene into a numpy framebuffer using ray marching.
+    Uses multiprocessing to speed up the rendering process. The frame is split into tiles that are handed out
+    to the processes one at a time, so a cheap background tile doesn't wait behind an expensive one.
+    The scene is broadcast to the processes once (see Render_pool), the tasks only contain the tile coordinates.
+    The CSG trees are compiled into flat tapes (csg_tape.py) before they are sent to the processes.
+    The frame lives in shared memory (see Shared_frame), the processes write the pixels of their tiles into it directly.
+
+    width, height: size of the frame in pixels
+    all_objects: dictionary of CSG objects in the scene (or the list returned by prepare_objects)
     camera: camera object with position and rotation
-    light_sources: tuple of light source positions (numpy arrays)
+    light_sources: dictionary of light source objects
+    settings: Render_settings of the render - None for the default settings
+    scene_bvh: optional bounding volume hierarchy over the objects of all_objects (bvh.BVH) - if given, the scene SDF is queried through it
+    pool: optional Render_pool whose workers are kept between the renders - without it a new pool is started and closed for this render
+    scene_version: any value that changes whenever the prepared objects change (e.g. a counter of the edits) - with a pool, the objects are
+                   broadcast to the workers only if it is different from the one of the previous render, None always broadcasts them
+    previous_frame: framebuffer of the last render of the same view - if given together with changed_spheres, only the pixels that can
+                    have changed are rendered again (see changed_pixels), the others are copied from previous_frame
+    changed_spheres: list of the bounding spheres of the regions of the scene changed since previous_frame
+                     (old and new bounding spheres of the edited objects)
+    return_object_ids: also return the object id buffer - the index of the object of all_objects hit by the ray of every pixel
+    return_buffers: also return the depth, normal and object id buffers of the frame (see FRAME_BUFFERS) - the normal buffer is
+                    filled only when it is asked for
+    cancel: optional threading.Event - setting it from another thread stops the render, Render_cancelled is raised
+    progress: optional function called with (finished tiles, all tiles) after every tile - the anti-aliasing tasks are added to the tiles
+              once the edges are known
+    timings: optional dictionary the times of the phases of the render (RENDER_PHASES) and the total time ("total") are added to
 
-    PROCESSES: number of processes to use for multiprocessing(default is 4)    
+    returns: numpy array of shape (height,width,3) and dtype uint8 with the rgb colors of the pixels
+    (and a numpy array of shape (height,width) and dtype int32 with the object ids - -1 for misses, -2 for the pixels copied from previous_frame
+    in an incremental render - if return_object_ids is True)
+    (and a dictionary with the "depth", "normal" and "object_id" buffers if return_buffers is True - the pixels copied from previous_frame
+    have the values of the pixels that were not rendered, see FRAME_BUFFERS)
     """
+    if settings is None:
+        settings = Render_settings()
+    names = ("color","depth","object_id","normal") if return_buffers else ("color","depth","object_id")
+    with timed(timings,"total"):
+        buffers = _render_frame(width,height,all_objects,camera,light_sources,settings,scene_bvh,previous_frame,changed_spheres,names,pool,scene_version,cancel,progress,timings)
+    returned = [buffers.pop("color")]
+    if return_object_ids:
+        returned.append(buffers["object_id"])
+    if return_buffers:
+        returned.append(buffers)
+    return returned[0] if len(returned) == 1 else tuple(returned)
 
-    PROCESSES = 4
 
-    width = int(canvas['width'])
-    height = int(canvas['height'])
+def _render_frame(width,height,all_objects,camera,light_sources,settings,scene_bvh,previous_frame,changed_spheres,names,pool,scene_version,cancel,progress,timings):
+    """
+    render_frame without the total time - returns the dictionary of the buffers names of the rendered frame (see FRAME_BUFFERS)
+    """
+    mask = None
+    with timed(timings,"scene_preparation"):
+        if previous_frame is not None and changed_spheres is not None:
+            mask = changed_pixels(width,height,camera,changed_spheres)
+            tiles = [(x0,y0,x1,y1) for x0,y0,x1,y1 in make_tiles(width,height,settings.tile_size) if mask[y0:y1,x0:x1].any()]
+            if len(tiles) == 0:
+                buffers = {name: np.full((height,width) + channels,fill,dtype=dtype) for name,(channels,dtype,fill) in FRAME_BUFFERS.items() if name in names}
+                buffers["color"] = previous_frame.copy()
+                return buffers
+        else:
+            tiles = make_tiles(width,height,settings.tile_size)
+        objects = prepare_objects(all_objects,scene_bvh,settings.use_distance_grids)
+    options = settings.pixel_options(width,height,objects,camera,timings)
 
-    image = tk.PhotoImage(width=width, height=height)
-    pixels = [[i,j] for i in range(width) for j in range(height)]
+    with Shared_frame(width,height,names) as frame:
+        if mask is not None:
+            frame["color"][...] = previous_frame
+        with render_session(pool,settings.processes,settings.backend,settings.chunksize,timings) as render_pool:
+            #the ray directions are worth sharing only with a pool that renders the same view again (see share_scene)
+            share_scene(render_pool,width,height,objects,camera,light_sources,mask,options,frame.description(),scene_version,pool is not None,timings)
+            for _ in tile_results(render_pool,render_tile,tiles,cancel,progress,timings=timings):
+                pass
+            if settings.antialiasing:
+                antialias_frame(render_pool,frame,settings.tile_size,mask,cancel,progress,len(tiles),len(tiles),timings)
 
-    
-    with multiprocessing.Pool(processes=PROCESSES) as pool:
-        results = pool.starmap(render_pixel, [(pos,width,height,all_objects,camera,light_sources) for pos in pixels])
-        for x,y,rgb in results:
-            image.put(f"#{rgb_to_hex(rgb)}", (x, y))
-    
-    canvas.image = image
-    canvas.create_image((width // 2, height // 2), image=image, anchor=tk.CENTER)
+        with timed(timings,"image_assembly"):
+            #the shared memory is released at the end of the with block
+            return {name: frame[name].copy() for name in names}
+
+
+def render_progressive(width,height,all_objects,camera,light_sources,settings=None,scene_bvh=None,strides=PROGRESSIVE_STRIDES,pool=None,scene_version=None,cancel=None,progress=None,timings=None):
+    """
+    Renders the scene in passes from coarse to fine - a generator that yields the frame after every pass, so it can be shown
+    long before the whole frame is finished.
+    The pass with stride s renders the pixels whose x and y are divisible by s, the samples of the previous passes are kept,
+    so the passes together render every pixel exactly once. The frames of the incomplete passes are upscaled (see upscale_samples).
+    One session of the pool (see Render_pool) and one shared frame (see Shared_frame) are used for all the passes, the tiles of a pass are stride times larger
+    so every task has about the same number of pixels.
+
+    settings: Render_settings of the render (see render_frame) - with antialiasing the edges of the finished frame are anti-aliased before it is yielded
+    strides: strides of the passes - every stride has to divide the previous one and the last one has to be 1
+    progress: optional function called with (finished tiles, tiles of all the passes) after every tile
+    timings: optional dictionary the times of the phases of all the passes are added to - see render_frame
+    other parameters: same as render_frame
+
+    yields: (stride, numpy array of shape (height,width,3) and dtype uint8) after every pass - the last frame is the finished frame
+    """
+    if settings is None:
+        settings = Render_settings()
+    start_time = time.perf_counter()
+    with timed(timings,"scene_preparation"):
+        objects = prepare_objects(all_objects,scene_bvh,settings.use_distance_grids)
+    options = settings.pixel_options(width,height,objects,camera,timings)
+    tile_size = settings.tile_size
+    tile_width,tile_height = (tile_size,tile_size) if isinstance(tile_size,int) else tile_size
+
+    passes = []
+    previous_stride = 0
+    for stride in strides:
+        passes.append([(tile,stride,previous_stride) for tile in make_tiles(width,height,(tile_width * stride,tile_height * stride))])
+        previous_stride = stride
+    total = sum(len(tasks) for tasks in passes)
+
+    done = 0
+    #closing the generator early ends the with blocks - the session of the pool ends and the shared memory is released
+    with Shared_frame(width,height) as frame:
+        with render_session(pool,settings.processes,settings.backend,settings.chunksize,timings) as render_pool:
+            share_scene(render_pool,width,height,objects,camera,light_sources,None,options,frame.description(),scene_version,pool is not None,timings)
+            for stride,tasks in zip(strides,passes):
+                for _ in tile_results(render_pool,render_tile_pass,tasks,cancel,progress,done,total,timings):
+                    pass
+                done += len(tasks)
+                if stride == 1 and settings.antialiasing:
+                    antialias_frame(render_pool,frame,tile_size,None,cancel,progress,done,total,timings)
+                with timed(timings,"image_assembly"):
+                    framebuffer = frame["color"].copy() if stride == 1 else upscale_samples(frame["color"],stride)
+                if stride == 1 and timings is not None:
+                    timings["total"] = time.perf_counter() - start_time
+                yield stride,framebuffer
+
+
+STEP_HISTOGRAM_BIN = 5
+"""width of the bins of the histogram of the step counts in the summary of render_statistics"""
+
+HEATMAP_COLORS = np.array([[0,0,0],[0,0,160],[160,0,160],[255,64,0],[255,255,0],[255,255,255]],dtype=float)
+"""colors of the heatmaps from the lowest to the highest value - see heatmap"""
+
+
+def render_tile_statistics(tile):
+    """
+    Marches the rays of one tile with the statistics turned on (see render_pixels with with_stats), using the scene stored in the worker process.
+
+    tile: (x0,y0,x1,y1) - see make_tiles
+
+    returns: (tile, dictionary with the "steps", "evaluations" and "reason" arrays of shape (y1-y0,x1-x0))
+    """
+    width,height,objects,camera,light_sources,_,options = _worker.scene
+    x0,y0,x1,y1 = tile
+
+    ys,xs = np.mgrid[y0:y1,x0:x1]
+    pixels = np.stack([xs.ravel(),ys.ravel()],axis=-1)
+    _,stats = render_pixels(pixels,width,height,objects,camera,light_sources,with_stats=True,**options)
+    return tile,{key: values.reshape(y1 - y0,x1 - x0) for key,values in stats.items()}
+
+
+def render_statistics(width,height,all_objects,camera,light_sources,settings=None,scene_bvh=None,pool=None,scene_version=None,cancel=None,progress=None):
+    """
+    Instrumented render - marches the rays of every pixel like render_frame, but instead of the colors it collects how the rays were marched,
+    to find the parts of the scene and the camera setups that burn the iterations. The counting makes the marching slower,
+    so it is a separate render. The cone marching pre-pass is not counted, only the steps of the rays after it.
+
+    parameters: same as render_frame - the anti-aliasing of the settings is not used
+
+    returns: dictionary with numpy arrays of shape (height,width):
+        "steps" - number of steps forward of the ray of every pixel
+        "evaluations" - number of SDF evaluations of every pixel (marching and normal)
+        "reason" - why the ray stopped, index in ray_marching.TERMINATION_REASONS
+    """
+    if settings is None:
+        settings = Render_settings()
+    objects = prepare_objects(all_objects,scene_bvh,settings.use_distance_grids)
+    options = settings.pixel_options(width,height,objects,camera)
+
+    statistics = {key: np.zeros((height,width),dtype=int) for key in ("steps","evaluations","reason")}
+    tiles = make_tiles(width,height,settings.tile_size)
+    with render_session(pool,settings.processes,settings.backend,settings.chunksize) as render_pool:
+        share_scene(render_pool,width,height,objects,camera,light_sources,None,options,None,scene_version,pool is not None)
+        for (x0,y0,x1,y1),tile_statistics in tile_results(render_pool,render_tile_statistics,tiles,cancel,progress):
+            for key,values in tile_statistics.items():
+                statistics[key][y0:y1,x0:x1] = values
+    return statistics
 
 
-def rgb_to_hex(rgb):
-    """Convert an RGB tuple to a hexadecimal color string."""
-    return f"{hex(rgb[0])[2:]:0>2}{hex(rgb[1])[2:]:0>2}{hex(rgb[2])[2:]:0>2}"
\ No newline at end of file
+def statistics_summary(statistics,bin_width=STEP_HISTOGRAM_BIN):
+    """
+    Summarizes the result of render_statistics - the totals, the number of rays and their mean steps for every termination reason
+    and the histogram of the step counts ("first-last step count of the bin" -> number of rays, bins of bin_width steps).
+
+    returns: dictionary that can be saved as JSON
+    """
+    steps = statistics["steps"].ravel()
+    evaluations = statistics["evaluations"].ravel()
+    reason = statistics["reason"].ravel()
+
+    reasons = dict()
+    for code,name in enumerate(ray_marching.TERMINATION_REASONS):
+        selected = reason == code
+        reasons[name] = {"rays": int(selected.sum()),"mean_steps": float(steps[selected].mean()) if selected.any() else 0.0}
+
+    edges = np.arange(0,steps.max() + bin_width + 1,bin_width)
+    counts,_ = np.histogram(steps,bins=edges)
+    return {
+        "pixels": len(steps),
+        "total_steps": int(steps.sum()),
+        "total_evaluations": int(evaluations.sum()),
+        "mean_steps": float(steps.mean()),
+        "mean_evaluations": float(evaluations.mean()),
+        "max_steps": int(steps.max()),
+        "reasons": reasons,
+        "step_histogram": {f"{low}-{high - 1}": int(count) for low,high,count in zip(edges[:-1],edges[1:],counts)},
+    }
+
+
+def heatmap(values,maximum=None):
+    """
+    Turns per-pixel counts into an image - the values are mapped linearly from 0 to maximum (the largest value by default) onto HEATMAP_COLORS
+
+    values: numpy array of shape (height,width)
+
+    returns: numpy array of shape (height,width,3) and dtype uint8
+    """
+    if maximum is None:
+        maximum = max(values.max(),1)
+    scaled = np.clip(values / maximum,0,1) * (len(HEATMAP_COLORS) - 1)
+    stops = np.arange(len(HEATMAP_COLORS))
+    return np.stack([np.interp(scaled,stops,HEATMAP_COLORS[:,channel]) for channel in range(3)],axis=-1).astype(np.uint8)
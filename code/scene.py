@@ -0,0 +1,388 @@
+import csg
+
+import numpy as np
+import json
+import os
+
+
+class Light_source:
+    """
+    class to store the position and color of the light source
+
+    Attributes:"""
+    """numpy array of shape (3,) representing the position"""
+    position: np.array
+    """Can be one of "white","red","green","blue" """
+    color: str
+
+    def __init__(self,position,color):
+        self.position = position
+        if color not in ["white","red","green","blue"]:
+            raise ValueError("Color must be one of 'white','red','green','blue'")
+        self.color = color
+
+class camera:
+    """ 
+    class to store the position and rotation of the camera
+
+    To change the position and rotation of the camera use the translate and rotate methods
+"""
+
+    position: np.array
+    """numpy array of shape (3,) representing the position of the camera"""
+
+    rotation:np.array
+    """numpy array of shape (3,3) representing the rotation matrix"""
+
+    def __init__(self,position=np.array([0,0,0])):
+        self.position = position
+        self.rotation = np.eye(3)
+    def rotate(self,rotation_matrix):
+        """
+        Rotate the camera by the given rotation matrix
+
+        rotation_matrix: numpy array of shape (3,3)
+        """
+        self.rotation = rotation_matrix @ self.rotation
+    def translate(self,translation_vector):
+        """
+        Translate the camera by the given translation vector
+        translation_vector: numpy array of shape (3,)
+        """
+        self.position = self.position + translation_vector
+
+
+SCENE_FORMAT_VERSION = 1
+"""version of the scene file format - stored in every saved scene file and checked when loading"""
+
+# A scene can be stored in two forms, the form is chosen by the extension of the file:
+#
+# JSON (any extension other than .npz) - readable form:
+# {
+#     "version": 1,
+#     "camera": {"position": [x,y,z], "rotation": 3x3 list},
+#     "lights": {"white0": {"position": [x,y,z], "color": "white"}, ...},
+#     "objects": {"sphere0": node, ...}
+# }
+# where node is either a leaf {"primitive": {"type": "box"/"sphere"/"cylinder", parameters..., "translation": [x,y,z], "rotation": 3x3 list}, "center": [x,y,z]}
+# or an operation {"operator": "union"/"intersection"/"difference", "left": node, "right": node, "center": [x,y,z]}
+#
+# binary (.npz) - compact form for large scenes, all the CSG trees are stored as flat numpy arrays:
+#     node_operator (n,)    - index into OPERATORS (0 for leaves)
+#     node_left, node_right (n,) - indices of the children (-1 for leaves)
+#     node_primitive (n,)   - index of the primitive of a leaf (-1 for operations)
+#     node_center (n,3)
+#     primitive_type (p,)   - index into PRIMITIVE_TYPES
+#     primitive_parameters (p,3) - box: length,width,height; sphere: radius,0,0; cylinder: radius,height,0
+#     primitive_translation (p,3), primitive_rotation (p,3,3)
+#     object_names, object_roots - names of the objects and the indices of their root nodes
+#     camera_position, camera_rotation, light_names, light_positions, light_colors
+# the nodes are stored in postorder, so the children of a node always come before the node itself
+
+OPERATORS = [None,"union","intersection","difference"]
+PRIMITIVE_TYPES = ["box","sphere","cylinder"]
+
+
+def primitive_parameters(primitive:csg.Primitive):
+    """
+    Returns the type and the 3 shape parameters of the primitive (see the description of the binary form above)
+    """
+    if isinstance(primitive,csg.Box):
+        return "box",[float(length) for length in primitive.side_lengths]
+    elif isinstance(primitive,csg.Sphere):
+        return "sphere",[float(primitive.r),0.0,0.0]
+    elif isinstance(primitive,csg.Cylinder):
+        return "cylinder",[float(primitive.r),float(primitive.h),0.0]
+    else:
+        raise ValueError(f"Unknown primitive {type(primitive).__name__}")
+
+def make_primitive(primitive_type:str,parameters,translation,rotation) -> csg.Primitive:
+    """
+    Creates a primitive of the given type from its shape parameters and transformation
+    """
+    if primitive_type == "box":
+        primitive = csg.Box(parameters[0],parameters[1],parameters[2])
+    elif primitive_type == "sphere":
+        primitive = csg.Sphere(parameters[0])
+    elif primitive_type == "cylinder":
+        primitive = csg.Cylinder(parameters[0],parameters[1])
+    else:
+        raise ValueError(f"Unknown primitive type {primitive_type}")
+
+    primitive.translation = np.array(translation,dtype=float)
+    primitive.rotation = np.array(rotation,dtype=float)
+    return primitive
+
+
+def primitive_to_dict(primitive:csg.Primitive) -> dict:
+    """
+    Returns the dictionary representation of a primitive (see the description of the JSON form above)
+    """
+    primitive_type,parameters = primitive_parameters(primitive)
+    if primitive_type == "box":
+        data = {"type":"box","length":parameters[0],"width":parameters[1],"height":parameters[2]}
+    elif primitive_type == "sphere":
+        data = {"type":"sphere","radius":parameters[0]}
+    else:
+        data = {"type":"cylinder","radius":parameters[0],"height":parameters[1]}
+
+    data["translation"] = primitive.translation.tolist()
+    data["rotation"] = primitive.rotation.tolist()
+    return data
+
+def primitive_from_dict(data:dict) -> csg.Primitive:
+    """
+    Creates a primitive from its dictionary representation (see the description of the JSON form above)
+    """
+    if data["type"] == "box":
+        parameters = [data["length"],data["width"],data["height"]]
+    elif data["type"] == "sphere":
+        parameters = [data["radius"],0,0]
+    elif data["type"] == "cylinder":
+        parameters = [data["radius"],data["height"],0]
+    else:
+        raise ValueError(f"Unknown primitive type {data['type']}")
+
+    return make_primitive(data["type"],parameters,data.get("translation",[0,0,0]),data.get("rotation",np.eye(3)))
+
+
+def node_to_dict(node:csg.CSG_object_node) -> dict:
+    """
+    Returns the dictionary representation of a CSG tree (see the description of the JSON form above)
+    """
+    # iterative postorder traversal like scene_to_arrays - the dictionaries of the children are made before the one of their parent
+    stack = [(node,False)]
+    results = []
+    while stack:
+        current,children_done = stack.pop()
+        if current.is_leaf():
+            data = {"primitive":primitive_to_dict(current.primitive)}
+        elif not children_done:
+            stack.append((current,True))
+            stack.append((current.right,False))
+            stack.append((current.left,False))
+            continue
+        else:
+            right = results.pop()
+            left = results.pop()
+            data = {"operator":current.operator,"left":left,"right":right}
+        data["center"] = current.center.tolist()
+        results.append(data)
+    return results.pop()
+
+def node_from_dict(data:dict) -> csg.CSG_object_node:
+    """
+    Creates a CSG tree from its dictionary representation (see the description of the JSON form above)
+    """
+    # iterative postorder traversal - the children are created before their parent
+    stack = [(data,False)]
+    nodes = []
+    while stack:
+        current,children_done = stack.pop()
+        if "primitive" in current:
+            node = csg.CSG_object_node(primitive_from_dict(current["primitive"]))
+        elif not children_done:
+            stack.append((current,True))
+            stack.append((current["right"],False))
+            stack.append((current["left"],False))
+            continue
+        else:
+            right = nodes.pop()
+            left = nodes.pop()
+            node = csg.CSG_object_node(operator=current["operator"],left=left,right=right)
+
+        #the center is stored because rotations move it away from the default computed in the constructor
+        if "center" in current:
+            node.center = np.array(current["center"],dtype=float)
+        nodes.append(node)
+    return nodes.pop()
+
+
+def scene_to_dict(objects:dict,scene_camera,light_sources:dict) -> dict:
+    """
+    Returns the JSON form of the scene as a dictionary
+    """
+    return {
+        "version":SCENE_FORMAT_VERSION,
+        "camera":{"position":np.asarray(scene_camera.position,dtype=float).tolist(),"rotation":np.asarray(scene_camera.rotation,dtype=float).tolist()},
+        "lights":{name: {"position":np.asarray(light.position,dtype=float).tolist(),"color":light.color} for name,light in light_sources.items()},
+        "objects":{name: node_to_dict(node) for name,node in objects.items()},
+    }
+
+def scene_from_dict(data:dict):
+    """
+    Creates the scene from its JSON form - returns (objects,camera,light_sources), see load_scene
+    """
+    check_version(data.get("version",SCENE_FORMAT_VERSION))
+
+    objects = {name: node_from_dict(node) for name,node in data.get("objects",{}).items()}
+
+    camera_data = data.get("camera",{})
+    scene_camera = camera(np.array(camera_data.get("position",[0,0,-6]),dtype=float))
+    scene_camera.rotation = np.array(camera_data.get("rotation",np.eye(3)),dtype=float)
+
+    light_sources = {name: Light_source(np.array(light["position"],dtype=float),light["color"])
+                     for name,light in data.get("lights",{}).items()}
+
+    return objects,scene_camera,light_sources
+
+
+def scene_to_arrays(objects:dict,scene_camera,light_sources:dict) -> dict:
+    """
+    Returns the binary form of the scene as a dictionary of numpy arrays (see the description of the binary form above)
+    """
+    node_operator,node_left,node_right,node_primitive,node_center = [],[],[],[],[]
+    primitive_type,primitive_params,primitive_translation,primitive_rotation = [],[],[],[]
+    object_roots = []
+
+    for node in objects.values():
+        # iterative postorder traversal - deep trees (long difference chains) would hit the recursion limit
+        stack = [(node,False)]
+        indices = []
+        while stack:
+            current,children_done = stack.pop()
+            if current.is_leaf():
+                kind,parameters = primitive_parameters(current.primitive)
+                primitive_type.append(PRIMITIVE_TYPES.index(kind))
+                primitive_params.append(parameters)
+                primitive_translation.append(current.primitive.translation)
+                primitive_rotation.append(current.primitive.rotation)
+
+                node_operator.append(0)
+                node_left.append(-1)
+                node_right.append(-1)
+                node_primitive.append(len(primitive_type) - 1)
+            elif not children_done:
+                stack.append((current,True))
+                stack.append((current.right,False))
+                stack.append((current.left,False))
+                continue
+            else:
+                right = indices.pop()
+                left = indices.pop()
+                node_operator.append(OPERATORS.index(current.operator))
+                node_left.append(left)
+                node_right.append(right)
+                node_primitive.append(-1)
+            node_center.append(current.center)
+            indices.append(len(node_operator) - 1)
+        object_roots.append(indices.pop())
+
+    return {
+        "version":np.array(SCENE_FORMAT_VERSION),
+        "node_operator":np.array(node_operator,dtype=np.int8),
+        "node_left":np.array(node_left,dtype=np.int32),
+        "node_right":np.array(node_right,dtype=np.int32),
+        "node_primitive":np.array(node_primitive,dtype=np.int32),
+        "node_center":np.array(node_center,dtype=float).reshape(-1,3),
+        "primitive_type":np.array(primitive_type,dtype=np.int8),
+        "primitive_parameters":np.array(primitive_params,dtype=float).reshape(-1,3),
+        "primitive_translation":np.array(primitive_translation,dtype=float).reshape(-1,3),
+        "primitive_rotation":np.array(primitive_rotation,dtype=float).reshape(-1,3,3),
+        "object_names":np.array(list(objects.keys()),dtype=str),
+        "object_roots":np.array(object_roots,dtype=np.int32),
+        "camera_position":np.asarray(scene_camera.position,dtype=float),
+        "camera_rotation":np.asarray(scene_camera.rotation,dtype=float),
+        "light_names":np.array(list(light_sources.keys()),dtype=str),
+        "light_positions":np.array([light.position for light in light_sources.values()],dtype=float).reshape(-1,3),
+        "light_colors":np.array([light.color for light in light_sources.values()],dtype=str),
+    }
+
+def scene_from_arrays(arrays) -> tuple:
+    """
+    Creates the scene from its binary form - returns (objects,camera,light_sources), see load_scene
+    """
+    check_version(int(arrays["version"]))
+
+    # converting the arrays to lists once is much faster than indexing numpy arrays element by element
+    primitive_type = arrays["primitive_type"].tolist()
+    primitive_params = arrays["primitive_parameters"].tolist()
+    primitive_translation = arrays["primitive_translation"]
+    primitive_rotation = arrays["primitive_rotation"]
+    primitives = [make_primitive(PRIMITIVE_TYPES[primitive_type[i]],primitive_params[i],primitive_translation[i],primitive_rotation[i])
+                  for i in range(len(primitive_type))]
+
+    node_operator = arrays["node_operator"].tolist()
+    node_left = arrays["node_left"].tolist()
+    node_right = arrays["node_right"].tolist()
+    node_primitive = arrays["node_primitive"].tolist()
+    node_center = arrays["node_center"]
+
+    # the nodes are in postorder so the children are always created before their parent
+    nodes = []
+    for i in range(len(node_operator)):
+        if node_operator[i] == 0:
+            node = csg.CSG_object_node(primitives[node_primitive[i]])
+        else:
+            node = csg.CSG_object_node(operator=OPERATORS[node_operator[i]],left=nodes[node_left[i]],right=nodes[node_right[i]])
+        node.center = node_center[i].copy()
+        nodes.append(node)
+
+    objects = {str(name): nodes[root] for name,root in zip(arrays["object_names"],arrays["object_roots"].tolist())}
+
+    scene_camera = camera(arrays["camera_position"].copy())
+    scene_camera.rotation = arrays["camera_rotation"].copy()
+
+    light_sources = {str(name): Light_source(position.copy(),str(color))
+                     for name,position,color in zip(arrays["light_names"],arrays["light_positions"],arrays["light_colors"])}
+
+    return objects,scene_camera,light_sources
+
+
+def check_version(version:int):
+    """
+    Raises a ValueError if the scene file was saved in a newer version of the format than this program can read
+    """
+    if version > SCENE_FORMAT_VERSION:
+        raise ValueError(f"Scene file format version {version} is not supported (newest supported version is {SCENE_FORMAT_VERSION})")
+
+
+def save_scene(path:str,objects:dict,scene_camera,light_sources:dict):
+    """
+    Saves the scene to a file - the binary form is used if the path ends with .npz, otherwise the JSON form.
+    The scene is written into a temporary file next to path that then replaces it, so a failed save leaves the previous file intact.
+    The json module limits the nesting of the JSON form - trees deeper than about a thousand levels can only be saved in the binary form.
+
+    path: path to the scene file
+    objects: dictionary of CSG objects - Key: object name, Value: CSG_object_node
+    scene_camera: camera object
+    light_sources: dictionary of light sources - Key: color+id, Value: Light_source object
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        if path.endswith(".npz"):
+            arrays = scene_to_arrays(objects,scene_camera,light_sources)
+            #np.savez_compressed would add .npz to the name of the temporary file
+            with open(temporary_path,"wb") as file:
+                np.savez_compressed(file,**arrays)
+        else:
+            data = scene_to_dict(objects,scene_camera,light_sources)
+            with open(temporary_path,"w") as file:
+                try:
+                    json.dump(data,file,indent=1)
+                except RecursionError:
+                    raise ValueError("The CSG trees are too deep for the JSON form - save the scene as .npz") from None
+        os.replace(temporary_path,path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+def load_scene(path:str):
+    """
+    Loads a scene from a scene file - the binary form is used if the path ends with .npz, otherwise the JSON form.
+
+    path: path to the scene file
+
+    returns: (objects,camera,light_sources) - the same structures that the App uses
+        objects: dictionary of CSG objects - Key: object name, Value: CSG_object_node
+        camera: camera object
+        light_sources: dictionary of light sources - Key: color+id, Value: Light_source object
+    """
+    if path.endswith(".npz"):
+        with np.load(path,allow_pickle=False) as arrays:
+            return scene_from_arrays(arrays)
+
+    with open(path) as file:
+        data = json.load(file)
+    return scene_from_dict(data)
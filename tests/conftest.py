@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the application import each other by their names - the code directory has to be on the path
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"code"))
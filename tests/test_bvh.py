@@ -0,0 +1,31 @@
+import benchmark
+import bvh
+import ray_marching
+import rendering
+
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("scene_name",["sphere_union","rotated_primitives"])
+def test_bvh_matches_the_linear_scene_sdf(scene_name):
+    objects,_,_ = benchmark.stress_scene(scene_name)
+    scene_bvh = bvh.BVH(objects.values())
+    rng = np.random.default_rng(0)
+
+    for _ in range(2):
+        items = rendering.prepare_objects(objects)
+        tree = rendering.prepare_objects(objects,scene_bvh)
+        center,radius = scene_bvh.bounding_sphere()
+        p = center + rng.uniform(-1,1,(3000,3)) * radius
+
+        np.testing.assert_array_equal(ray_marching.scene_sdf(tree,p),ray_marching.scene_sdf(items,p))
+        for result,expected in zip(ray_marching.scene_sdf(tree,p,with_ids=True),ray_marching.scene_sdf(items,p,with_ids=True)):
+            np.testing.assert_array_equal(result,expected)
+        for result,expected in zip(tree[0].sdf_gradient(p),ray_marching.scene_sdf_gradient(items,p)):
+            np.testing.assert_array_equal(result,expected)
+
+        #the tree is refitted after objects move
+        for node in list(objects.values())[::5]:
+            node.translate(rng.uniform(-2,2,3))
+        scene_bvh.refit()
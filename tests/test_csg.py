@@ -0,0 +1,52 @@
+import benchmark
+import csg
+import csg_tape
+
+import numpy as np
+import pytest
+
+
+def finite_differences(sdf,p,h):
+    """central differences of sdf at the points p of shape (N,3)"""
+    return np.stack([(sdf(p + h * axis) - sdf(p - h * axis)) / (2 * h) for axis in np.eye(3)],axis=-1)
+
+
+def assert_gradient_matches(sdf,sdf_gradient,p):
+    """
+    The analytic gradient is the gradient of the SDF wherever the SDF is smooth - the points on the edges and the seams of the operations
+    (where the central differences with two step sizes disagree) are left out
+    """
+    distance,gradient = sdf_gradient(p)
+    np.testing.assert_array_equal(distance,sdf(p))
+    estimate = finite_differences(sdf,p,1e-6)
+    smooth = np.all(np.abs(estimate - finite_differences(sdf,p,2e-6)) < 1e-4,axis=-1)
+    assert smooth.mean() > 0.8
+    np.testing.assert_allclose(gradient[smooth],estimate[smooth],atol=1e-4)
+
+
+def transformed_primitives():
+    rng = np.random.default_rng(0)
+    primitives = [csg.Box(1,2,3),csg.Sphere(1.5),csg.Cylinder(0.8,2)]
+    for primitive in primitives:
+        node = csg.CSG_object_node(primitive)
+        node.rotate(*benchmark.random_rotation(rng))
+        node.translate(rng.uniform(-1,1,3))
+    return primitives
+
+
+@pytest.mark.parametrize("primitive",transformed_primitives())
+def test_primitive_gradient_matches_finite_differences(primitive):
+    center = primitive.translation
+    p = center + np.random.default_rng(1).normal(size=(2000,3)) * 2
+    assert_gradient_matches(primitive.sdf,primitive.sdf_gradient,p)
+
+
+@pytest.mark.parametrize("scene_name",["difference_chain","rotated_primitives"])
+def test_tree_and_tape_gradients_match_finite_differences(scene_name):
+    rng = np.random.default_rng(2)
+    for node in list(benchmark.stress_scene(scene_name)[0].values())[:8]:
+        center,radius = node.bounding_sphere()
+        p = center + rng.normal(size=(2000,3)) * radius
+        assert_gradient_matches(node.sdf,node.sdf_gradient,p)
+        tape = csg_tape.compile_tree(node)
+        assert_gradient_matches(tape.sdf,tape.sdf_gradient,p)
@@ -0,0 +1,45 @@
+import benchmark
+import csg
+import csg_tape
+
+import numpy as np
+import pytest
+
+
+def scene_objects():
+    """the CSG trees of the seeded stress scenes with operations - deep difference chains and rotated primitives"""
+    objects = list(benchmark.stress_scene("difference_chain")[0].values()) + list(benchmark.stress_scene("rotated_primitives")[0].values())
+    lens = csg.CSG_intersection(csg.CSG_object_node(csg.Sphere(1.2)),csg.CSG_object_node(csg.Cylinder(0.8,2)))
+    lens.translate(np.array([3.0,-1.0,1.0]))
+    return objects + [csg.CSG_union(lens,csg.CSG_object_node(csg.Box(1,2,3)))]
+
+
+@pytest.mark.parametrize("node",scene_objects())
+def test_tape_matches_the_tree(node):
+    """
+    The tape gives the exact SDF of the tree near the object and a lower bound far from it - the points farther than BOUND_MARGIN
+    from the bounding sphere of a subtree get the distance to that sphere
+    """
+    tape = csg_tape.compile_tree(node)
+    center,radius = node.bounding_sphere()
+    p = center + np.random.default_rng(0).normal(size=(4000,3)) * radius * 1.5
+    expected = node.sdf(p)
+    distance = tape.sdf(p)
+
+    near = expected <= csg_tape.BOUND_MARGIN
+    np.testing.assert_array_equal(distance[near],expected[near])
+    assert np.all(distance <= expected)
+    assert np.array_equal(np.sign(distance),np.sign(expected))
+
+    if not node.is_leaf():
+        #the far points of an operation get the distance to its bounding sphere
+        sphere_distance = np.linalg.norm(p - center,axis=-1) - radius
+        far = sphere_distance > csg_tape.BOUND_MARGIN
+        assert far.any()
+        np.testing.assert_allclose(distance[far],sphere_distance[far])
+
+    assert tape.sdf(p[0]) == distance[0]
+    leaf_distance,leaf = tape.sdf_leaf(p)
+    np.testing.assert_array_equal(leaf_distance,distance)
+    node_distance,node_leaf = node.sdf_leaf(p[near])
+    np.testing.assert_array_equal(leaf[near],node_leaf)
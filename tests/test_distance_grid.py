@@ -0,0 +1,39 @@
+import benchmark
+import csg_tape
+import distance_grid
+
+import numpy as np
+import pytest
+
+
+def surface_points(node,rng,count):
+    """points on the surface of the object - random points moved onto the surface along the gradient of the SDF"""
+    center,radius = node.bounding_sphere()
+    p = center + rng.normal(size=(count,3)) * radius * 0.5
+    for _ in range(20):
+        distance,gradient = node.sdf_gradient(p)
+        p = p - distance[:,None] * gradient
+    return p
+
+
+@pytest.mark.parametrize("scene_name",["difference_chain","rotated_primitives"])
+def test_grid_is_a_lower_bound_and_exact_near_the_surface(scene_name):
+    rng = np.random.default_rng(0)
+    for node in list(benchmark.stress_scene(scene_name)[0].values())[:8]:
+        grid = distance_grid.Distance_grid(csg_tape.compile_tree(node))
+        center,radius = node.bounding_sphere()
+        band = distance_grid.EXACT_BAND * grid.cell_size
+
+        #points all over the grid and around it - the grid never overestimates the distance
+        p = center + rng.uniform(-1.5,1.5,(3000,3)) * radius
+        distance,expected = grid.sdf(p),node.sdf(p)
+        np.testing.assert_array_less(distance,expected + 1e-5)
+        assert np.any(distance < expected - band)
+
+        #points within the band around the surface and inside of the object get the exact distance
+        p = surface_points(node,rng,2000)
+        p = np.concatenate([p + rng.normal(size=p.shape) * band * 0.5,center + rng.normal(size=(1000,3)) * radius * 0.5])
+        expected = node.sdf(p)
+        near = expected <= band
+        assert near.sum() > 1000
+        np.testing.assert_allclose(grid.sdf(p)[near],expected[near],rtol=0,atol=1e-12)
@@ -0,0 +1,98 @@
+import csg
+import csg_tape
+import ray_marching
+import rendering
+
+import numpy as np
+import pytest
+
+
+def seeded_scene(seed=0):
+    """
+    Objects of a small seeded CSG scene - a box with a sphere cut out of it, an intersection of a sphere and a cylinder
+    and a few separate spheres
+    """
+    rng = np.random.default_rng(seed)
+    box = csg.CSG_object_node(csg.Box(1.5,1.5,1.5))
+    hole = csg.CSG_object_node(csg.Sphere(1))
+    hole.translate(np.array([0.5,0.5,-0.5]))
+    cut = csg.CSG_difference(box,hole)
+
+    lens = csg.CSG_intersection(csg.CSG_object_node(csg.Sphere(1.2)),csg.CSG_object_node(csg.Cylinder(0.8,2)))
+    lens.translate(np.array([3.0,-1.0,1.0]))
+
+    objects = [cut,lens]
+    for _ in range(4):
+        sphere = csg.CSG_object_node(csg.Sphere(rng.uniform(0.3,0.7)))
+        sphere.translate(rng.uniform(-4,4,3) + np.array([0,0,3]))
+        objects.append(sphere)
+    return objects
+
+
+def random_directions(rng,count):
+    """normalized directions of count rays pointing roughly along +z"""
+    directions = rng.normal(size=(count,3)) * [0.4,0.4,0.1] + [0,0,1]
+    return directions / np.linalg.norm(directions,axis=-1,keepdims=True)
+
+
+def cast_all(objects,origin,directions,**options):
+    return [ray_marching.cast_ray(objects,origin,direction,with_stats=True,**options) for direction in directions]
+
+
+@pytest.mark.parametrize("relaxation",[1,1.6])
+def test_march_rays_matches_cast_ray(relaxation):
+    rng = np.random.default_rng(1)
+    objects = seeded_scene()
+    #rays from the camera in front of the scene - most of them hit, the ones at the sides miss, the ones pointing away pass the clipping distance
+    #and the ones from inside of the box end up inside of an object
+    groups = [
+        (np.array([0.0,0.0,-6.0]),np.concatenate([random_directions(rng,200),-random_directions(rng,10)])),
+        (np.array([-0.5,-0.5,0.5]),random_directions(rng,20)),
+    ]
+
+    reasons = set()
+    for origin,directions in groups:
+        expected = cast_all(objects,origin,directions,relaxation=relaxation,clipping_distance=20)
+        result = ray_marching.march_rays(objects,origin,directions,relaxation=relaxation,clipping_distance=20,with_stats=True)
+
+        for i,ray in enumerate(expected):
+            assert result["hit"][i] == ray["hit"]
+            assert ray_marching.TERMINATION_REASONS[result["reason"][i]] == ray["reason"]
+            assert result["steps"][i] == ray["steps"]
+            assert result["evaluations"][i] == ray["evaluations"]
+            if ray["hit"]:
+                assert result["distance"][i] == pytest.approx(ray["distance"])
+                np.testing.assert_allclose(result["point"][i],ray["point"])
+            else:
+                assert result["distance"][i] == np.inf
+                assert np.isnan(result["point"][i]).all()
+            reasons.add(ray["reason"])
+
+    assert {"hit","clipping_distance","inside"} <= reasons
+
+
+def test_march_rays_iteration_limit_matches_cast_ray():
+    objects = seeded_scene()
+    origin = np.array([0.0,0.0,-6.0])
+    directions = random_directions(np.random.default_rng(2),50)
+
+    expected = cast_all(objects,origin,directions,iteration_limit=3)
+    result = ray_marching.march_rays(objects,origin,directions,iteration_limit=3,with_stats=True)
+
+    assert [ray["reason"] for ray in expected] == [ray_marching.TERMINATION_REASONS[reason] for reason in result["reason"]]
+    assert "iteration_limit" in {ray["reason"] for ray in expected}
+    assert list(result["steps"]) == [ray["steps"] for ray in expected]
+
+
+def test_culled_rays_do_not_depend_on_the_batch():
+    """the objects are culled per ray (see rendering.cull_objects), so a ray ends the same way in every batch it is marched in"""
+    objects = [csg_tape.compile_tree(obj) for obj in seeded_scene()]
+    origin = np.array([0.0,0.0,-6.0])
+    directions = random_directions(np.random.default_rng(3),240)
+
+    expected = ray_marching.march_rays(rendering.cull_objects(objects,origin,directions),origin,directions)
+    for start in range(0,len(directions),40):
+        batch = directions[start:start + 40]
+        result = ray_marching.march_rays(rendering.cull_objects(objects,origin,batch),origin,batch)
+        np.testing.assert_array_equal(result["hit"],expected["hit"][start:start + 40])
+        np.testing.assert_array_equal(result["distance"],expected["distance"][start:start + 40])
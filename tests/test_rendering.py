@@ -0,0 +1,105 @@
+import benchmark
+import bvh
+import rendering
+
+import threading
+import numpy as np
+import pytest
+
+
+def test_thread_backend_renders_again_after_cancel():
+    """
+    A cancelled render leaves the threads of the pool in the middle of their tiles - the next render on the same pool
+    must not close the buffers of the frame they still write into
+    """
+    objects,camera,light_sources = benchmark.stress_scene("sphere_union")
+    with rendering.Render_pool(4,"thread",1) as pool:
+        for _ in range(2):
+            cancel = threading.Event()
+            with pytest.raises(rendering.Render_cancelled):
+                rendering.render_frame(256,64,objects,camera,light_sources,rendering.Render_settings(tile_size=64),pool=pool,cancel=cancel,progress=lambda done,total: cancel.set())
+        framebuffer = rendering.render_frame(64,64,objects,camera,light_sources,pool=pool)
+
+    expected = rendering.render_frame(64,64,objects,camera,light_sources,rendering.Render_settings(backend="serial"))
+    assert np.array_equal(framebuffer,expected)
+
+
+def test_prepared_tapes_are_cached_until_the_object_moves():
+    objects,_,_ = benchmark.stress_scene("rotated_primitives")
+    first = rendering.prepare_objects(objects)
+    assert all(a.instructions is b.instructions for a,b in zip(first,rendering.prepare_objects(objects)))
+    #the ids of a render are set on copies, the cached tapes are not changed
+    assert [tape.object_id for tape in first] == list(range(len(objects)))
+    assert all(node.cache["tape"].object_id == -1 for node in objects.values())
+
+    moved = next(iter(objects.values()))
+    moved.translate(np.array([1.0,0.0,0.0]))
+    again = rendering.prepare_objects(objects)
+    assert again[0].instructions is not first[0].instructions
+    assert np.allclose(again[0].center,first[0].center + [1.0,0.0,0.0])
+    assert all(a.instructions is b.instructions for a,b in zip(first[1:],again[1:]))
+
+
+@pytest.mark.parametrize("use_bvh",[False,True])
+def test_image_does_not_depend_on_the_tiles(use_bvh):
+    """the objects are culled per ray, so the tile size, the progressive passes and incremental renders give the same pixels"""
+    objects,camera,light_sources = benchmark.stress_scene("rotated_primitives")
+    scene_bvh = bvh.BVH(objects.values()) if use_bvh else None
+
+    def settings(tile_size,antialiasing=True):
+        return rendering.Render_settings(tile_size,backend="serial",antialiasing=antialiasing)
+
+    expected = rendering.render_frame(96,72,objects,camera,light_sources,settings(32),scene_bvh)
+    assert np.array_equal(rendering.render_frame(96,72,objects,camera,light_sources,settings(16),scene_bvh),expected)
+    assert np.array_equal(rendering.render_frame(96,72,objects,camera,light_sources,settings((96,8)),scene_bvh),expected)
+    *_,(_,progressive) = rendering.render_progressive(96,72,objects,camera,light_sources,settings(32),scene_bvh)
+    assert np.array_equal(progressive,expected)
+
+    before = rendering.render_frame(96,72,objects,camera,light_sources,settings(32,False),scene_bvh)
+    moved = objects["box0"]
+    old_sphere = moved.bounding_sphere()
+    moved.translate(np.array([0.3,0.2,0.0]))
+    if scene_bvh is not None:
+        scene_bvh.refit()
+    incremental = rendering.render_frame(96,72,objects,camera,light_sources,settings(16,False),scene_bvh,previous_frame=before,changed_spheres=[old_sphere,moved.bounding_sphere()])
+    assert np.array_equal(incremental,rendering.render_frame(96,72,objects,camera,light_sources,settings(32,False),scene_bvh))
+
+
+def test_pool_shares_the_ray_directions_of_its_view():
+    objects,camera,light_sources = benchmark.stress_scene("difference_chain")
+    expected = rendering.render_frame(64,48,objects,camera,light_sources,rendering.Render_settings(backend="serial"))
+    with rendering.Render_pool(2,"process") as pool:
+        assert np.array_equal(rendering.render_frame(64,48,objects,camera,light_sources,pool=pool),expected)
+        key,block = pool.ray_directions
+        assert key == rendering.ray_direction_key(64,48,camera)
+        np.testing.assert_array_equal(np.ndarray((48,64,3),buffer=block.buf),rendering.all_ray_directions(64,48,camera))
+
+        #moving the camera keeps the buffer, a new resolution replaces it
+        camera.translate(np.array([0.0,0.5,0.0]))
+        rendering.render_frame(64,48,objects,camera,light_sources,pool=pool)
+        assert pool.ray_directions[1] is block
+        rendering.render_frame(32,24,objects,camera,light_sources,pool=pool)
+        assert pool.ray_directions[0] == rendering.ray_direction_key(32,24,camera)
+    assert pool.ray_directions is None
+
+
+def test_frame_buffers_describe_the_hit_points():
+    objects,camera,light_sources = benchmark.stress_scene("rotated_primitives")
+    framebuffer,buffers = rendering.render_frame(64,48,objects,camera,light_sources,rendering.Render_settings(backend="process",processes=2),return_buffers=True)
+    serial_framebuffer,serial = rendering.render_frame(64,48,objects,camera,light_sources,rendering.Render_settings(backend="serial"),return_buffers=True)
+    assert np.array_equal(framebuffer,serial_framebuffer)
+    for name in ("depth","object_id","normal"):
+        np.testing.assert_array_equal(buffers[name],serial[name])
+
+    hit = buffers["object_id"] >= 0
+    assert 0 < hit.sum() < hit.size
+    assert np.all(np.isinf(buffers["depth"][~hit]))
+    assert np.all(buffers["object_id"][~hit] == -1)
+    assert np.all(buffers["normal"][~hit] == 0)
+
+    #the hit points lie on the surfaces of the objects with the ids, the normals are unit vectors
+    points = camera.position + buffers["depth"][hit][:,None] * rendering.all_ray_directions(64,48,camera)[hit]
+    nodes = list(objects.values())
+    distances = np.array([nodes[object_id].sdf(point) for object_id,point in zip(buffers["object_id"][hit],points)])
+    assert np.all(np.abs(distances) < 0.001)
+    np.testing.assert_allclose(np.linalg.norm(buffers["normal"][hit],axis=-1),1,atol=1e-5)
@@ -0,0 +1,60 @@
+import benchmark
+import csg
+import scene
+
+import numpy as np
+import pytest
+
+
+def assert_same_scene(loaded,objects,camera,light_sources):
+    """the loaded scene has the same objects (the same SDF and centers), camera and light sources"""
+    loaded_objects,loaded_camera,loaded_lights = loaded
+    assert list(loaded_objects) == list(objects)
+    points = np.random.default_rng(1).uniform(-5,5,(500,3)) + [0,0,3]
+    for name,node in objects.items():
+        np.testing.assert_allclose(loaded_objects[name].sdf(points),node.sdf(points))
+        np.testing.assert_allclose(loaded_objects[name].center,node.center)
+    np.testing.assert_allclose(loaded_camera.position,camera.position)
+    np.testing.assert_allclose(loaded_camera.rotation,camera.rotation)
+    assert list(loaded_lights) == list(light_sources)
+    for name,light in light_sources.items():
+        np.testing.assert_allclose(loaded_lights[name].position,light.position)
+        assert loaded_lights[name].color == light.color
+
+
+@pytest.mark.parametrize("extension",[".json",".npz"])
+@pytest.mark.parametrize("scene_name",["difference_chain","rotated_primitives"])
+def test_scene_round_trip(tmp_path,extension,scene_name):
+    objects,camera,light_sources = benchmark.stress_scene(scene_name)
+    camera.rotate(np.array([[0.0,0.0,1.0],[0.0,1.0,0.0],[-1.0,0.0,0.0]]))
+    path = str(tmp_path / f"scene{extension}")
+    scene.save_scene(path,objects,camera,light_sources)
+    assert_same_scene(scene.load_scene(path),objects,camera,light_sources)
+    assert [file.name for file in tmp_path.iterdir()] == [f"scene{extension}"]
+
+
+def test_deep_tree_is_saved_as_npz_and_a_failed_json_save_keeps_the_old_file(tmp_path):
+    node = csg.CSG_object_node(csg.Sphere(1))
+    for i in range(3000):
+        hole = csg.CSG_object_node(csg.Sphere(0.1))
+        hole.translate(np.array([np.cos(i),np.sin(i),-1.0]))
+        node = csg.CSG_difference(node,hole)
+    objects = {"chain": node}
+    camera = scene.camera(np.array([0.0,0.0,-6.0]))
+    light_sources = {"white0": scene.Light_source(np.array([10.0,10.0,-10.0]),"white")}
+
+    path = str(tmp_path / "deep.npz")
+    scene.save_scene(path,objects,camera,light_sources)
+    #the SDF of the nodes is recursive - the trees are compared through their binary form
+    expected = scene.scene_to_arrays(objects,camera,light_sources)
+    from_dict = {"chain": scene.node_from_dict(scene.node_to_dict(node))}
+    for loaded in (scene.load_scene(path),(from_dict,camera,light_sources)):
+        for key,values in scene.scene_to_arrays(*loaded).items():
+            np.testing.assert_array_equal(values,expected[key])
+
+    path = str(tmp_path / "deep.json")
+    scene.save_scene(path,{},camera,light_sources)
+    with pytest.raises(ValueError):
+        scene.save_scene(path,objects,camera,light_sources)
+    assert scene.load_scene(path)[0] == {}
+    assert sorted(file.name for file in tmp_path.iterdir()) == ["deep.json","deep.npz"]